@@ -1,8 +1,21 @@
-from flask import Flask, request, send_file, redirect, url_for, render_template, session, flash, g
-import random, time, qrcode, os, csv, io, json, sys
+from flask import Flask, request, send_file, send_from_directory, redirect, url_for, render_template, session, flash, g, jsonify
+from flask import get_flashed_messages, has_request_context
+import random, time, os, csv, io, json, sys, threading, re, mimetypes, gzip, hashlib, base64, uuid, functools, math
 from datetime import datetime
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from profiler import RequestSampler, ProfileRing
+from state_store import StateStore
+from classroom_sync import ClassroomStore, SyncEngine
+import attendance_bitmaps as bitmaps
+from subject_catalog import SubjectCatalog
+from user_directory import UserDirectory, FIELDS as USER_FIELDS, LOOKUP_BATCH
+from student_search import StudentIndex
+from report_replica import ReportReplica, Replicator, REPLICA_MAX_LAG
+from jobs import JobStore, JobRunner, ACTIVE as ACTIVE_JOB_STATES
+from exports import ExportSpool, FORMATS as EXPORT_FORMATS, available_formats, export_key
+from rate_limit import TokenBuckets, LocalTokenBuckets, AdmissionGate
+from supabase_guard import (CircuitBreaker, GuardedQuery, run_guarded, DB_READ_TIMEOUT, DB_WRITE_TIMEOUT,
+                            DB_CONNECT_TIMEOUT)
 
 # Load environment variables
 load_dotenv()
@@ -29,38 +42,114 @@ def inject_now():
 # ---------------- CONFIG ----------------
 QR_REFRESH_TIME = 15          # seconds
 TOKEN_VALID_TIME = 40         # seconds
+ACTIVE_SESSION_TTL = 5        # seconds a scan may reuse another worker's active-session lookup
+
+# Token, active session and QR image shared by all worker processes on this host
+state = StateStore()
+
+# Offline-first classroom mode (see classroom_sync.py): sessions and marks are kept on this
+# host and pushed to Supabase in the background; tokens then never leave the state store
+CLASSROOM_MODE = os.environ.get("ATTENDX_CLASSROOM") == "1"
+classroom = ClassroomStore() if CLASSROOM_MODE else None
+
+# Report replica (see report_replica.py): report pages aggregate a local copy of the
+# attendance tables, kept current by a background replicator
+REPORT_REPLICA = os.environ.get("ATTENDX_REPORT_REPLICA") == "1"
+report_replica = ReportReplica() if REPORT_REPLICA else None
 
 # Supabase Setup
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
+class LazySupabase:
+    """
+    Stands in for the Supabase client; importing supabase-py and building the client waits for first use.
+    table() queries run through a circuit breaker, on a client whose timeout suits the operation
+    (supabase_guard.py; see DEGRADED MODE).
+    """
+
+    def __init__(self, url, key, name="primary"):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._reader = None
+        self._failed = False
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker(name)
+
+    def get(self):
+        if self._client is None and not self._failed:
+            with self._lock:
+                if self._client is None and not self._failed:
+                    try:
+                        import httpx
+                        from supabase import create_client, ClientOptions
+
+                        def build(timeout):
+                            return create_client(self.url, self.key, options=ClientOptions(
+                                postgrest_client_timeout=httpx.Timeout(timeout, connect=DB_CONNECT_TIMEOUT)))
+                        self._reader = build(DB_READ_TIMEOUT)
+                        self._client = build(DB_WRITE_TIMEOUT)
+                    except Exception as e:
+                        print(f"Error connecting to Supabase: {e}")
+                        self._failed = True
+        return self._client
+
+    def table(self, name):
+        return GuardedQuery(self, [("table", (name,), {})])
+
+    def run(self, query):
+        """ Execute a GuardedQuery: reads on the short-timeout client and retried, writes once """
+        client = self.get()
+        if client is None:
+            raise RuntimeError("Supabase client unavailable")
+        return run_guarded(self.breaker, query, self._reader if query.is_read else client, note_upstream_failure)
+
+    def __bool__(self):
+        # Keeps the `if not supabase:` guards working: false when the client cannot be built
+        return self.get() is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     print("WARNING: Supabase credentials not found. Please set SUPABASE_URL and SUPABASE_KEY environment variables.")
     # For CI/Build process where env vars might be missing, we can default to None, 
     # but app will fail on DB calls.
-    supabase: Client = None
+    supabase = None
 else:
-    try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"Error connecting to Supabase: {e}")
-        supabase = None
-
-SERVER_IP = "127.0.0.1" # Default fallback
-try:
-    import socket
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(('10.255.255.255', 1))
-    SERVER_IP = s.getsockname()[0]
-    s.close()
-except:
-    pass
+    supabase = LazySupabase(SUPABASE_URL, SUPABASE_KEY)
+
+# Optional read-only endpoint (a read replica behind its own PostgREST URL). Idempotent
+# report and dashboard reads go there while it keeps up; see READ ENDPOINT below. (Test
+# `supabase is not None`: truth-testing a LazySupabase builds its client.)
+SUPABASE_READ_URL = os.environ.get("SUPABASE_READ_URL")
+SUPABASE_READ_KEY = os.environ.get("SUPABASE_READ_KEY") or SUPABASE_KEY
+supabase_read = LazySupabase(SUPABASE_READ_URL, SUPABASE_READ_KEY, "read endpoint") if supabase is not None and SUPABASE_READ_URL else None
+
+_server_ip = None
+
+def get_server_ip():
+    """ LAN address used in QR links when there is no request host; looked up once, on first QR """
+    global _server_ip
+    if _server_ip is None:
+        _server_ip = "127.0.0.1" # Default fallback
+        try:
+            import socket
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(('10.255.255.255', 1))
+            _server_ip = s.getsockname()[0]
+            s.close()
+        except:
+            pass
+    return _server_ip
 
 # ---------------- HELPERS ----------------
 def generate_token():
     return str(random.randint(100000, 999999))
 
 def generate_qr(token):
+    """ PNG bytes of the QR code for `token`, also kept in the shared state store for the other workers """
     # Dynamic URL: Use current request host (works on Render and Local Automatically)
     # If not in request context, fallback to env or local IP
     server_url = os.environ.get('RENDER_EXTERNAL_URL')
@@ -72,13 +161,16 @@ def generate_qr(token):
         pass
     
     if not server_url:
-        server_url = f"http://{SERVER_IP}:{os.environ.get('PORT', 5000)}"
+        server_url = f"http://{get_server_ip()}:{os.environ.get('PORT', 5000)}"
     
     url = f"{server_url}/student?token={token}"
+    import qrcode  # pulls in PIL; only workers that show a QR pay for it
     img = qrcode.make(url)
-    static_dir = resource_path("static")
-    os.makedirs(static_dir, exist_ok=True)
-    img.save(os.path.join(static_dir, "qr.png"))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    png = buffer.getvalue()
+    state.set_blob(f"qr_png:{token}", png, ttl=TOKEN_VALID_TIME)
+    return png
 
 def cleanup_tokens():
     if not supabase: return
@@ -90,6 +182,664 @@ def cleanup_tokens():
     except Exception as e:
         print(f"Cleanup error: {e}")
 
+def token_age(row):
+    """ Seconds since a valid_tokens row was created, or None if its timestamp cannot be parsed """
+    try:
+        # Parse timestamp (Supabase is ISO 8601)
+        last_created = datetime.fromisoformat(row['created_at'].replace('Z', '+00:00'))
+        return (datetime.now(last_created.tzinfo) - last_created).total_seconds()
+    except Exception as e:
+        print(f"Date parse error: {e}")
+        return None
+
+def remember_token(session_id, row):
+    """ Publish the live token to every worker on this host until it expires """
+    state.set(f"qr_token:{session_id}", row, ttl=TOKEN_VALID_TIME)
+    state.set(f"qr_token:{session_id}:{row['token']}", True, ttl=TOKEN_VALID_TIME)
+
+def new_token_row():
+    return {
+        "token": generate_token(),
+        "created_at": datetime.now().isoformat(),
+        "expires_at": datetime.fromtimestamp(time.time() + TOKEN_VALID_TIME).isoformat()
+    }
+
+def refresh_session_token(session_id):
+    """ Rotate the QR token once it is older than QR_REFRESH_TIME and return the live token row """
+    current = state.get(f"qr_token:{session_id}")
+    age = token_age(current) if current else None
+    if age is not None and age <= QR_REFRESH_TIME:
+        return current
+
+    # Only one worker rotates; the rest keep showing the current token meanwhile
+    if not state.claim(f"qr_rotation:{session_id}", ttl=10):
+        if current or classroom:
+            return current
+        tk_resp = supabase.table("valid_tokens").select("token, created_at, expires_at").order("created_at", desc=True).limit(1).execute()
+        return tk_resp.data[0] if tk_resp.data else None
+
+    try:
+        if classroom:
+            # Classroom tokens are only ever checked on this host, so Supabase never sees them
+            row = new_token_row()
+            generate_qr(row['token'])
+            remember_token(session_id, row)
+            return row
+
+        # Another host (or this one before a restart) may already have issued a fresh token
+        tk_resp = supabase.table("valid_tokens").select("token, created_at, expires_at").order("created_at", desc=True).limit(1).execute()
+        row = tk_resp.data[0] if tk_resp.data else None
+        age = token_age(row) if row else None
+
+        if age is None or age > QR_REFRESH_TIME:
+            # Expired rows only pile up when a new token is issued, so purge them then, in the background
+            job_runner.submit("purge_tokens", key="purge_tokens")
+            row = new_token_row()
+            supabase.table("valid_tokens").insert(row).execute()
+            generate_qr(row['token'])
+        remember_token(session_id, row)
+        return row
+    finally:
+        state.delete(f"qr_rotation:{session_id}")
+
+def token_is_live(session_id, token):
+    """ True if `token` is an unexpired QR token; tokens issued on this host are checked without Supabase """
+    if not token:
+        return False
+    if state.get(f"qr_token:{session_id}:{token}"):
+        return True
+    if classroom:
+        return False
+    token_resp = supabase.table("valid_tokens").select("token").eq("token", token) \
+        .gt("expires_at", datetime.now().isoformat()).limit(1).execute()
+    return bool(token_resp.data)
+
+def get_active_session():
+    """ Active session's id and subject; cached for ACTIVE_SESSION_TTL in the shared state store """
+    if classroom:
+        return classroom.active_session()
+    cached = state.get("active_session")
+    if cached is not None:
+        return cached or None
+    resp = supabase.table("attendance_sessions").select("session_id, subject_id, subject").eq("active", True).limit(1).execute()
+    active_session = resp.data[0] if resp.data else None
+    state.set("active_session", active_session or {}, ttl=ACTIVE_SESSION_TTL)
+    return active_session
+
+def forget_active_session():
+    state.delete("active_session")
+
+def load_subjects():
+    return supabase.table("subjects").select("*").execute().data or []
+
+# Subjects change a few times a term; pages read this copy (see subject_catalog.py) and the
+# admin subject routes invalidate it after every write
+subject_catalog = SubjectCatalog(load_subjects, state)
+
+def load_users(sids):
+    query = supabase.table("users").select(", ".join(USER_FIELDS))
+    if sids is not None: query = query.in_("sid", sids)
+    return query.execute().data or []
+
+# sid -> name/role/status/class for pages that only label sids (see user_directory.py); every
+# route that writes users invalidates the sids it touched
+user_directory = UserDirectory(load_users, state)
+
+def load_students():
+    return supabase.table("users").select("sid, name").eq("role", "student").execute().data or []
+
+# Name / sid search over students (see student_search.py); rebuilt when the user directory moves
+student_index = StudentIndex(load_students, state)
+AUTOCOMPLETE_LIMIT = 10
+SEARCH_MAX_SIDS = 200         # broader searches filter records by name instead of by sid
+
+def fetch_enrolled(subject):
+    """ sid and name of every student in the subject's department, semester and section """
+    dept = subject.get('department')
+    sem = subject.get('semester')
+    sec = subject.get('section')
+    query = supabase.table("users").select("sid, name").eq("role", "student")
+    if dept: query = query.ilike("department", f"{dept.strip()}")
+    if sem: query = query.ilike("semester", f"{sem.strip()}")
+    if sec: query = query.ilike("section", f"{sec.strip()}")
+    return query.execute().data or []
+
+def fetch_enrolled_for(subject_id):
+    subject = subject_catalog.get(subject_id)
+    return fetch_enrolled(subject) if subject else []
+
+classroom_sync = SyncEngine(classroom, supabase, state, fetch_enrolled_for) if classroom else None
+
+def sync_status():
+    return classroom_sync.status() if classroom_sync else None
+
+# ---------------- ATTENDANCE BITMAPS ----------------
+# Finished sessions carry their present / absent sets as bitmaps over a dense per-student
+# bit index (attendance_bitmaps.py, migrate_attendance_bitmaps.sql). attendance_records stays
+# the source of truth: any later write to a session clears its bitmaps. Only the stop job
+# and backfill_session_bitmaps.py store bitmaps; reports only read, and count a session
+# whose bitmaps are missing from its rows.
+ABSENCE_STREAK_ALERT = 3      # consecutive missed classes that get flagged on reports
+STUDENT_BITS_BATCH = LOOKUP_BATCH     # sids per student_bits request (URL length; replies stay under max-rows)
+
+def student_bits_for(sids, assign=False):
+    """ sid -> bit position; with assign=True students seen for the first time are given one """
+    sids = sorted({str(s).strip() for s in sids})
+    batches = [sids[i:i + STUDENT_BITS_BATCH] for i in range(0, len(sids), STUDENT_BITS_BATCH)]
+    bits = {}
+    for batch in batches:
+        bits.update((r['sid'], r['bit']) for r in
+                    supabase.table("student_bits").select("sid, bit").in_("sid", batch).execute().data)
+    missing = [s for s in sids if s not in bits]
+    if assign:
+        for i in range(0, len(missing), STUDENT_BITS_BATCH):
+            batch = missing[i:i + STUDENT_BITS_BATCH]
+            # Two stops racing over the same new student both end up reading the one bit that won
+            supabase.table("student_bits").upsert([{"sid": s} for s in batch], on_conflict="sid",
+                                                   ignore_duplicates=True, returning="minimal").execute()
+            bits.update((r['sid'], r['bit']) for r in
+                        supabase.table("student_bits").select("sid, bit").in_("sid", batch).execute().data)
+    return bits
+
+def records_to_bitmaps(records, bits):
+    """ (present, absent) bitmaps of one session's attendance rows """
+    present, absent = 0, 0
+    for r in records:
+        bit = bits.get(str(r['sid']).strip())
+        if bit is None: continue
+        if r.get('status', 'present') == 'present':
+            present |= 1 << bit
+        elif r.get('status') == 'absent':
+            absent |= 1 << bit
+    return present, absent
+
+def store_session_bitmaps(session_id, present, absent, change_seq):
+    """ Save a session's bitmaps unless its records were written since `change_seq` was read """
+    try:
+        supabase.table("attendance_sessions").update({
+            "present_bits": bitmaps.encode(present),
+            "absent_bits": bitmaps.encode(absent)
+        }).eq("session_id", session_id).eq("change_seq", change_seq).execute()
+    except Exception as e:
+        print(f"Bitmap write failed for session {session_id}: {e}")
+
+def finished_sessions(subject_id=None):
+    """ Completed sessions with their bitmaps, oldest first """
+    query = supabase.table("attendance_sessions").select(
+        "session_id, subject_id, change_seq, present_bits, absent_bits").eq("active", False)
+    if subject_id: query = query.eq("subject_id", subject_id)
+    return query.order("start_time").order("session_id").execute().data or []
+
+def load_session_bitmaps(sessions, bits):
+    """
+    session_id -> (present, absent). A bitmap left stale is rebuilt from attendance_records in
+    memory only (pages never write); its students missing from `bits` are looked up and added,
+    and students without a stored bit get a temporary one past every bit in use here.
+    """
+    loaded = {}
+    stale = []
+    for s in sessions:
+        if s.get('present_bits') is None or s.get('absent_bits') is None:
+            stale.append(s)
+        else:
+            loaded[s['session_id']] = (bitmaps.decode(s['present_bits']), bitmaps.decode(s['absent_bits']))
+    if stale:
+        records = supabase.table("attendance_records").select("session_id, sid, status").in_(
+            "session_id", [s['session_id'] for s in stale]).execute().data
+        sids = {str(r['sid']).strip() for r in records}
+        bits.update(student_bits_for(sids - bits.keys()))
+        spare = max([b + 1 for b in bits.values()] + [m.bit_length() for pair in loaded.values() for m in pair],
+                    default=0)
+        for sid in sorted(sids - bits.keys()):
+            bits[sid], spare = spare, spare + 1
+        by_session = {}
+        for r in records:
+            by_session.setdefault(r['session_id'], []).append(r)
+        for s in stale:
+            loaded[s['session_id']] = records_to_bitmaps(by_session.get(s['session_id'], []), bits)
+    return loaded
+
+def term_matrices(sessions, bits):
+    """ str(subject_id) -> TermMatrix over that subject's finished sessions; `bits` as for load_session_bitmaps """
+    loaded = load_session_bitmaps(sessions, bits)
+    by_subject = {}
+    for s in sessions:
+        by_subject.setdefault(str(s['subject_id']), []).append((s['session_id'], *loaded[s['session_id']]))
+    return {sub_id: bitmaps.TermMatrix(rows) for sub_id, rows in by_subject.items()}
+
+def rebuild_session_bitmaps():
+    """ Build and store the bitmaps of every finished session that has none (backfill_session_bitmaps.py); returns how many """
+    stale = [s for s in finished_sessions() if s.get('present_bits') is None or s.get('absent_bits') is None]
+    for s in stale:
+        records = supabase.table("attendance_records").select("sid, status").eq(
+            "session_id", s['session_id']).execute().data
+        bits = student_bits_for([r['sid'] for r in records], assign=True)
+        store_session_bitmaps(s['session_id'], *records_to_bitmaps(records, bits), s.get('change_seq') or 0)
+    return len(stale)
+
+def build_student_report(sid):
+    """ Per-subject classes held / attended / missed streak for one student """
+    subjects = subject_catalog.all()
+    bits = student_bits_for([sid])
+    matrices = term_matrices(finished_sessions(), bits)
+    my_bit = bits.get(str(sid).strip())
+
+    report = []
+    for sub in subjects:
+        matrix = matrices.get(str(sub['subject_id']))
+        held = matrix.held if matrix else 0
+        attended = matrix.attended(my_bit) if matrix and my_bit is not None else 0
+        report.append({
+            'subject_name': sub['subject_name'],
+            'total_classes': held,
+            'attended': attended,
+            'percentage': round((attended / held) * 100, 2) if held else 0.0,
+            'missed_streak': matrix.missed_streak(my_bit) if matrix and my_bit is not None else 0
+        })
+    return report
+
+# ---------------- ACADEMIC TERMS ----------------
+# attendance_sessions / attendance_records hold only the terms not yet archived; ended terms
+# are moved into *_archive tables partitioned by term (migrate_term_archive.sql). Pages read
+# the live tables, which is the current term, and add archived terms only when a report's
+# from_date reaches back into them.
+TERMS_TTL = 300               # seconds the term list is shared between workers
+
+def get_terms():
+    """ Every academic term, oldest first ([] until migrate_term_archive.sql is applied) """
+    terms = state.get("terms")
+    if terms is None:
+        try:
+            terms = supabase.table("terms").select("term_id, name, starts_on, ends_on, archived").order("starts_on").execute().data or []
+        except Exception as e:
+            print(f"Terms lookup failed: {e}")
+            terms = []
+        state.set("terms", terms, ttl=TERMS_TTL)
+    return terms
+
+def archived_terms_for(from_date, to_date=None):
+    """ term_ids of the archived terms a from_date / to_date range reaches into; none without a from_date """
+    if not from_date:
+        return []
+    return [t['term_id'] for t in get_terms()
+            if t.get('archived') and str(t['ends_on']) >= from_date and (not to_date or str(t['starts_on']) <= to_date)]
+
+# ---------------- REPORT REPLICA ----------------
+# With ATTENDX_REPORT_REPLICA=1 the heavy report routes read report_replica instead of
+# Supabase while it is at most REPLICA_MAX_LAG seconds behind, and show how far behind
+# it is. Date ranges that reach an archived term still go to Supabase (the replica holds
+# the live tables only).
+replicator = Replicator(report_replica, supabase, state) if report_replica else None
+
+def fresh_replica():
+    """ The report replica if it is enabled and recent enough to serve a report, else None """
+    if not report_replica:
+        return None
+    try:
+        lag = report_replica.lag()
+    except Exception as e:
+        print(f"Report replica unavailable: {e}")
+        return None
+    return report_replica if lag is not None and lag <= REPLICA_MAX_LAG else None
+
+def replica_lag(replica):
+    """ Whole seconds the replica is behind, for the page; None when the page came from Supabase """
+    return int(replica.lag()) if replica else None
+
+# ---------------- READ ENDPOINT ----------------
+# Teacher and admin reports and dashboards read through read_db(). With SUPABASE_READ_URL
+# set that is the read endpoint, as long as it is at most READ_MAX_LAG seconds behind the
+# primary; lag is the gap between the newest attendance_sessions.updated_at on each side
+# (migrate_report_replica.sql), measured at most every READ_LAG_CHECK seconds per host.
+# Everything else stays on `supabase`: writes, scans and duplicate checks, the teacher's
+# session flow, cached lookups (their invalidation must not reload stale rows) and the
+# students' own pages, which must show the scan they just made. A user who wrote in the
+# last READ_MAX_LAG seconds also reads from the primary.
+READ_MAX_LAG = float(os.environ.get("ATTENDX_READ_MAX_LAG", 10))    # seconds
+READ_LAG_CHECK = 15           # seconds a lag measurement is shared between workers
+WRITE_GET_ENDPOINTS = {"approve_user", "reject_user"}     # GET routes that write
+
+def newest_session_change(client):
+    rows = client.table("attendance_sessions").select("updated_at").order("updated_at", desc=True).limit(1).execute().data
+    return datetime.fromisoformat(rows[0]['updated_at']) if rows else None
+
+def read_endpoint_lag():
+    """ Seconds the read endpoint is behind the primary; None if it cannot be used """
+    measured = state.get("read_endpoint_lag")
+    if measured is None:
+        try:
+            primary, replica = newest_session_change(supabase), newest_session_change(supabase_read)
+            if primary is None or (replica is not None and replica >= primary):
+                lag = 0.0
+            else:
+                lag = (primary - replica).total_seconds() if replica else None
+        except Exception as e:
+            print(f"Read endpoint check failed: {e}")
+            lag = None
+        measured = {"lag": lag}
+        state.set("read_endpoint_lag", measured, ttl=READ_LAG_CHECK)
+    return measured["lag"]
+
+def read_db():
+    """ Client for this request's report reads; fixed per request so a page's data version and data agree """
+    if 'read_db' not in g:
+        g.read_db = supabase
+        wrote_at = session.get('_wrote_at', 0)
+        if supabase_read and time.time() - wrote_at > READ_MAX_LAG:
+            lag = read_endpoint_lag()
+            if lag is not None and lag <= READ_MAX_LAG:
+                g.read_db = supabase_read
+    return g.read_db
+
+@app.after_request
+def remember_write(response):
+    # Read-your-writes: this user's next reads stay on the primary for READ_MAX_LAG seconds
+    if supabase_read and 'user' in session and response.status_code < 400 and (
+            request.method != 'GET' or request.endpoint in WRITE_GET_ENDPOINTS):
+        session['_wrote_at'] = time.time()
+    return response
+
+# ---------------- DEGRADED MODE ----------------
+# A Supabase query that fails upstream (timeout, refused connection, open circuit breaker)
+# marks the request. The dashboards, decorated with @serves_stale, then send the copy of
+# the page they last rendered for this user, kept in the state store for LAST_GOOD_TTL
+# seconds, under a banner saying when it is from, instead of a page of empty lists. One
+# copy is kept per user and dashboard (the key ignores the query string) and pages over
+# LAST_GOOD_MAX_BYTES are not kept, so the state file stays bounded by the user count.
+# Reports, decorated with @warns_degraded, keep no copies: the page that was rendered goes
+# out under a warning that data may be missing, as does a dashboard with no copy.
+LAST_GOOD_TTL = 6 * 3600      # seconds a page copy is kept for outages
+LAST_GOOD_REFRESH = 60        # seconds between copies of the same page, per worker
+LAST_GOOD_TRACKED = 1000      # page copies a worker remembers the time of
+LAST_GOOD_MAX_BYTES = 256 * 1024    # larger pages are not kept
+DEGRADED_BANNER_SLOT = "<!-- attendx:degraded-banner -->"     # in base.html
+_last_good_saved = {}
+
+def note_upstream_failure(error):
+    if has_request_context():
+        g.upstream_failed = True
+
+def degraded_response(page, kept=None):
+    """ `page` (or the kept copy) under the banner saying Supabase cannot be reached """
+    stale_since = datetime.fromtimestamp(kept['at']).strftime("%d %b %Y, %I:%M %p") if kept else None
+    banner = render_template("degraded_banner.html", stale_since=stale_since)
+    response = app.make_response((kept['page'] if kept else page).replace(DEGRADED_BANNER_SLOT, banner, 1))
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-AttendX-Stale'] = str(int(time.time() - kept['at'])) if kept else 'no-copy'
+    return response
+
+def warns_degraded(view):
+    """ While Supabase is failing send the page `view` renders under a warning that data may be missing """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        page = view(*args, **kwargs)
+        if isinstance(page, str) and g.get('upstream_failed'):
+            return degraded_response(page)
+        return page
+    return wrapper
+
+def serves_stale(view):
+    """ Remember the page `view` renders; while Supabase is failing send the remembered one instead """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        page = view(*args, **kwargs)
+        if not isinstance(page, str):
+            return page     # redirects, 304s and errors
+        key = f"last_good:{session.get('user', '')}:{session.get('role', '')}:{request.path}"
+
+        if g.get('upstream_failed'):
+            try:
+                kept = state.get(key)
+            except Exception as e:
+                print(f"Last good page lookup failed: {e}")
+                kept = None
+            return degraded_response(page, kept)
+
+        now = time.monotonic()
+        if not get_flashed_messages() and now - _last_good_saved.get(key, -LAST_GOOD_REFRESH) >= LAST_GOOD_REFRESH \
+                and len(page.encode()) <= LAST_GOOD_MAX_BYTES:
+            try:
+                state.set(key, {"at": time.time(), "page": page}, ttl=LAST_GOOD_TTL)
+                if len(_last_good_saved) >= LAST_GOOD_TRACKED:
+                    _last_good_saved.clear()
+                _last_good_saved[key] = now
+            except Exception as e:
+                print(f"Last good page store failed: {e}")
+        return page
+    return wrapper
+
+# ---------------- BACKGROUND JOBS ----------------
+# Work that need not finish before the response runs on JobRunner threads (jobs.py): the
+# absentees of a stopped session, the purge of expired QR tokens and large exports (see
+# EXPORTS). /jobs/<id> reports a job's progress; the teacher dashboard polls it for the
+# teacher's own jobs.
+JOB_LABELS = {
+    "stop_session": "Marking absentees",
+    "purge_tokens": "Purging expired QR tokens",
+    "export": "Preparing export",
+}
+JOB_SHOW_FINISHED = 600       # seconds a finished job stays on the dashboard
+
+jobs = JobStore()
+job_runner = JobRunner(jobs)
+
+def job_view(job):
+    """ The public part of a job, for the status endpoints and the dashboard """
+    return {
+        "job_id": job['job_id'],
+        "kind": job['kind'],
+        "label": JOB_LABELS.get(job['kind'], job['kind']),
+        "status": job['status'],
+        "progress": round(job['progress'] or 0, 3),
+        "message": job['message'],
+        "result": job['result'],
+        "error": job['error'] if job['status'] == 'failed' else None,
+        "created_at": job['created_at'],
+        "finished_at": job['finished_at'],
+        "download_url": url_for('export_download', job_id=job['job_id']) if job['kind'] == 'export' else None,
+    }
+
+def stop_session_job(job):
+    """ Mark everyone enrolled but unmarked in a stopped session absent, store its bitmaps, purge QR tokens """
+    sess_id = job.args['session_id']
+    resp = supabase.table("attendance_sessions").select("*").eq("session_id", sess_id).execute()
+    stopped = resp.data[0] if resp.data else None
+    if not stopped:
+        return {"enrolled": 0, "marked": 0, "absentees": 0}
+
+    # Everyone enrolled in the subject's department / semester / section
+    sub_id = stopped['subject_id']
+    sub = subject_catalog.get(sub_id)
+    enrolled = fetch_enrolled(sub) if sub else []
+    job.progress(0.2, f"{len(enrolled)} students enrolled")
+
+    # Students already marked (present or otherwise)
+    marked = supabase.table("attendance_records").select("sid, status").eq("session_id", sess_id).execute().data or []
+    marked_sids = {str(m['sid']).strip() for m in marked}
+
+    # Identify absentees (those in enrolled but NOT in marked_sids): roster minus
+    # everyone marked, as one operation on the session bitmaps
+    roster_sids = {str(s['sid']).strip() for s in enrolled}
+    try:
+        bits = student_bits_for(roster_sids | marked_sids, assign=True)
+    except Exception as be:
+        print(f"Student bit lookup failed: {be}")
+        bits = None
+    if bits is not None and not roster_sids | marked_sids <= bits.keys():
+        print(f"Session {sess_id}: {len((roster_sids | marked_sids) - bits.keys())} students without a bit; "
+              "absentees found without bitmaps")
+        bits = None
+    if bits is not None:
+        present_bits, absent_bits = records_to_bitmaps(marked, bits)
+        roster_bits = bitmaps.from_positions(bits[str(s['sid']).strip()] for s in enrolled)
+        missing_bits = bitmaps.difference(roster_bits, present_bits | absent_bits)
+        absentees = [s for s in enrolled if missing_bits >> bits[str(s['sid']).strip()] & 1]
+    else:
+        # We use strip for a robust comparison
+        absentees = [s for s in enrolled if str(s['sid']).strip() not in marked_sids]
+    print(f"Session {sess_id}: {len(enrolled)} enrolled, {len(marked_sids)} marked, {len(absentees)} absentees.")
+    job.progress(0.5, f"Marking {len(absentees)} absent")
+
+    # Use a consistent date format: %d-%m-%Y (same as student QR marking)
+    rec_date = datetime.now().strftime("%d-%m-%Y")
+    rec_time = datetime.now().strftime("%H:%M:%S")
+
+    # Insert all absentee records in one round trip; rows a late scan (or an earlier run of
+    # this job) already created are skipped by the UNIQUE(session_id, sid) constraint
+    inserted = 0
+    if absentees:
+        inserted = supabase.table("attendance_records").upsert([{
+            "session_id": sess_id,
+            "sid": str(student['sid']).strip(),
+            "name": student['name'],
+            "subject_id": sub_id,
+            "subject": stopped['subject'],
+            "date": rec_date,
+            "time": rec_time,
+            "status": "absent",
+            "marked_type": "auto"
+        } for student in absentees], on_conflict="session_id,sid", ignore_duplicates=True,
+           returning="minimal", count="exact").execute().count
+    job.progress(0.8, f"{len(absentees)} marked absent")
+
+    # Each record write bumps change_seq once, so the bitmaps are only stored if
+    # nothing but our own absentee rows landed since the session was read
+    if bits is not None and inserted is not None:
+        store_session_bitmaps(sess_id, present_bits, absent_bits | missing_bits,
+                              (stopped.get('change_seq') or 0) + inserted)
+
+    # The session was deactivated (which prunes its change log) before the absentees were
+    # written, and every write logs a change; nothing reads the log of a stopped session
+    try:
+        supabase.table("attendance_changes").delete(returning="minimal").eq("session_id", sess_id).execute()
+    except Exception as ce:
+        print(f"Change log cleanup failed: {ce}")
+
+    # Cleanup valid_tokens (Safe wrap to prevent a permission error from failing the job)
+    try:
+        supabase.table("valid_tokens").delete().neq("token", "dummy").execute()
+        supabase.table("valid_tokens").delete().gt("expires_at", "2000-01-01").execute()
+    except Exception as te:
+        print(f"Token Cleanup Permission Error: {te}")
+    return {"enrolled": len(enrolled), "marked": len(marked_sids), "absentees": len(absentees)}
+
+job_runner.register("stop_session", stop_session_job)
+job_runner.register("purge_tokens", lambda job: cleanup_tokens())
+
+def recent_jobs(owner):
+    """ The owner's running jobs and those that finished in the last JOB_SHOW_FINISHED seconds """
+    now = time.time()
+    return [job_view(j) for j in jobs.for_owner(owner, limit=5)
+            if j['status'] in ACTIVE_JOB_STATES or now - (j['finished_at'] or 0) < JOB_SHOW_FINISHED]
+
+# ---------------- EXPORTS ----------------
+# Exports are files in export_spool (exports.py), named after the data version they were
+# read at, so an unchanged dataset is downloaded again without reading a row. Exports of
+# up to EXPORT_INLINE_ROWS rows are written during the request; larger ones become an
+# "export" job and the browser waits on /exports/<job_id>, which sends the file once it
+# is done. Files are sent with their SHA-256 as ETag and Repr-Digest, and with Range
+# support, so an interrupted download resumes where it stopped.
+EXPORT_INLINE_ROWS = int(os.environ.get("ATTENDX_EXPORT_INLINE_ROWS", 20000))
+EXPORT_PAGE = 1000            # records per request, PostgREST's default max-rows
+
+export_spool = ExportSpool()
+job_runner.on_purge = lambda purged: export_spool.purge()
+
+def attendance_export_rows(args, client, replica):
+    """ Batches of /export rows: the archived terms asked for, then the live records, by record_id """
+    def row(r):
+        return [r['session_id'], r['name'], r['sid'], r['subject'], r['date'], r['time'], r.get('status') or 'present']
+
+    if replica:
+        records = replica.records(order="record_id")
+        for start in range(0, len(records), EXPORT_PAGE):
+            yield [row(r) for r in records[start:start + EXPORT_PAGE]]
+        return
+
+    sources = [("attendance_records_archive", args['archive_terms'])] if args['archive_terms'] else []
+    for table, terms in sources + [("attendance_records", None)]:
+        last = None
+        while True:
+            query = client.table(table).select("record_id, session_id, name, sid, subject, date, time, status")
+            if terms:
+                query = query.in_("term_id", terms)
+            if last is not None:
+                query = query.gt("record_id", last)
+            page = query.order("record_id").limit(EXPORT_PAGE).execute().data or []
+            if page:
+                yield [row(r) for r in page]
+                last = page[-1]['record_id']
+            if len(page) < EXPORT_PAGE:
+                break
+
+def student_report_export_rows(args, client, replica):
+    yield [[item['subject_name'], item['total_classes'], item['attended'], f"{item['percentage']}%"]
+           for item in build_student_report(args['sid'])]
+
+# report -> (header, rows(args, client, replica))
+EXPORT_REPORTS = {
+    "attendance": (["Session", "Name", "ID", "Subject", "Date", "Time", "Status"], attendance_export_rows),
+    "student_report": (["Subject", "Total Classes", "Attended", "Percentage"], student_report_export_rows),
+}
+
+def build_export(args, client, replica=None, progress=None):
+    """ Write the export `args` describes to the spool; returns its sidecar """
+    header, rows = EXPORT_REPORTS[args['report']]
+    return export_spool.write(args['key'], args['format'], header, rows(args, client, replica),
+                              total=args.get('rows'), progress=progress, download_name=args['download_name'])
+
+def export_job(job):
+    """ Build a large export in the background (reusing the file if another run already wrote it) """
+    meta = export_spool.lookup(job.args['key'])
+    if meta is None:
+        replica = fresh_replica() if job.args['source'] == 'replica' else None
+        client = supabase
+        if job.args['source'] == 'read' and supabase_read:
+            lag = read_endpoint_lag()
+            if lag is not None and lag <= READ_MAX_LAG:
+                client = supabase_read
+        meta = build_export(job.args, client, replica, job.progress)
+    return {"rows": meta['rows'], "size": meta['size'], "sha256": meta['sha256'], "format": meta['format']}
+
+job_runner.register("export", export_job)
+
+def requested_export_format():
+    """ ?format= of an export request: csv (default), csv.gz or xlsx; None if unknown or not installed """
+    fmt = request.args.get('format', 'csv')
+    return fmt if fmt in available_formats() else None
+
+def send_export(meta):
+    """ Send a finished export: conditional on its content hash, with Range support """
+    response = send_file(meta['path'], mimetype=meta['mimetype'], as_attachment=True,
+                         download_name=meta['download_name'], etag=meta['sha256'], conditional=True, max_age=0)
+    response.headers['Repr-Digest'] = f"sha-256=:{base64.b64encode(bytes.fromhex(meta['sha256'])).decode()}:"
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def start_export(report, params, fmt, version, rows, download_name, client, replica=None):
+    """ Send the export of this data version if it exists, write it now if it is small, else queue a job """
+    # A failed version lookup gets a name of its own, so nothing else ever reuses that file
+    key = export_key(report, params, fmt, version if version is not None else uuid.uuid4().hex)
+    meta = export_spool.lookup(key)
+    if meta:
+        return send_export(meta)
+
+    args = dict(params, report=report, format=fmt, key=key, rows=rows,
+                download_name=download_name + EXPORT_FORMATS[fmt][1],
+                source="replica" if replica else ("read" if client is supabase_read else "primary"),
+                retry_url=request.full_path)
+    if rows is not None and rows <= EXPORT_INLINE_ROWS:
+        return send_export(build_export(args, client, replica))
+    job_id = job_runner.submit("export", args, owner=session['user'], key=f"export:{key}")
+    return redirect(url_for('export_download', job_id=job_id))
+
+def version_rows(version):
+    """ Row count of a scope_version() string ("<max id>.<row count>") """
+    try:
+        return int(version.rsplit(".", 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
 def login_required(role=None):
     if 'user' not in session:
         return False
@@ -97,6 +847,256 @@ def login_required(role=None):
         return False
     return True
 
+# ---------------- RATE LIMITS & ADMISSION ----------------
+# Requests to the endpoints below take a token from a bucket per identity (rate_limit.py):
+# "user" is the signed-in sid, "username" the sid typed into the login form, "ip" the
+# client address. Scans get a budget per student and a far larger one per address (a
+# whole class may share one campus NAT); logins a small one per account and per address.
+# Every database-bound request also has to get through the per-process admission gate.
+# Refusals are 429s with Retry-After, sent before any query is made.
+RATE_LIMITS_ON = os.environ.get("ATTENDX_RATE_LIMITS", "1") != "0"
+PROXY_HOPS = int(os.environ.get("ATTENDX_PROXY_HOPS", 0))          # reverse proxies that add X-Forwarded-For
+MAX_IN_FLIGHT = int(os.environ.get("ATTENDX_MAX_IN_FLIGHT", 128))  # database-bound requests per process
+ADMISSION_RETRY_AFTER = 1     # seconds a request turned away at the gate is told to wait
+
+# endpoint -> (methods, ((identity, tokens per second, burst), ...))
+RATE_LIMITS = {
+    "login": ({"POST"}, (("username", 5 / 60, 5), ("ip", 20 / 60, 20))),
+    "register": ({"POST"}, (("ip", 5 / 60, 5),)),
+    "student": ({"GET", "POST"}, (("user", 1, 5), ("ip", 50, 300))),
+    "api_scan": ({"POST"}, (("user", 1, 5), ("ip", 50, 300))),
+    "teacher_live": ({"GET"}, (("user", 2, 10),)),
+    "api_student_search": ({"GET"}, (("user", 5, 20),)),
+}
+# Served without a database round trip (or just a redirect)
+ADMISSION_EXEMPT = {"static", "hashed_static", "teacher_qr", "job_list", "job_status", "logout", "home"}
+
+rate_buckets = TokenBuckets() if os.environ.get("ATTENDX_RATE_STORE") != "memory" else LocalTokenBuckets()
+admission = AdmissionGate(MAX_IN_FLIGHT)
+
+def client_ip():
+    """ The client's address: behind PROXY_HOPS proxies, the entry the outermost one added to X-Forwarded-For """
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    hops = [h.strip() for h in forwarded.split(',') if h.strip()]
+    if PROXY_HOPS and len(hops) >= PROXY_HOPS:
+        return hops[-PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+def rate_identity(kind):
+    if kind == "user":
+        return session.get('user')
+    if kind == "username":
+        return request.form.get('username', '').strip().lower() or None
+    return client_ip()
+
+def too_many_requests(wait, message="Too many requests. Please wait a moment and try again."):
+    retry_after = max(1, math.ceil(wait))
+    if request.endpoint in ("api_scan", "teacher_live", "api_student_search"):
+        response = jsonify(ok=False, status="rate_limited", retry_after=retry_after,
+                           message=f"Too many attempts. Try again in {retry_after} seconds.")
+    else:
+        response = app.make_response((message, 429, {"Content-Type": "text/plain; charset=utf-8"}))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def admit_request():
+    if not RATE_LIMITS_ON or request.endpoint is None or request.endpoint in ADMISSION_EXEMPT:
+        return None
+    methods, limits = RATE_LIMITS.get(request.endpoint, ((), ()))
+    if request.method in methods:
+        for kind, rate, burst in limits:
+            who = rate_identity(kind)
+            if who is None:
+                continue
+            try:
+                wait = rate_buckets.take(f"{request.endpoint}:{kind}:{who}", rate, burst)
+            except Exception as e:
+                print(f"Rate limit store error: {e}")     # fail open: the limiter must not take the app down
+                wait = 0
+            if wait:
+                return too_many_requests(wait)
+    if not admission.try_enter():
+        return too_many_requests(ADMISSION_RETRY_AFTER, "The server is busy. Please try again in a moment.")
+    g.admitted = True
+
+@app.teardown_request
+def leave_admission(exc):
+    if g.pop('admitted', False):
+        admission.leave()
+
+# ---------------- REQUEST PROFILER ----------------
+# Admins can profile any request by adding ?_profile=1 or the X-AttendX-Profile header.
+# Unflagged requests only pay for two substring/dict checks on the raw WSGI environ.
+PROFILE_QUERY_FLAG = "_profile"
+PROFILE_HEADER = "HTTP_X_ATTENDX_PROFILE"
+profile_ring = ProfileRing()
+
+def _profile_requested(environ):
+    return PROFILE_HEADER in environ or PROFILE_QUERY_FLAG in environ.get('QUERY_STRING', '')
+
+@app.before_request
+def start_request_profiler():
+    if not _profile_requested(request.environ):
+        return
+    if PROFILE_QUERY_FLAG not in request.args and PROFILE_HEADER not in request.environ:
+        return
+    if not login_required('admin'):
+        return
+    g.profiler = RequestSampler(threading.get_ident()).start()
+
+@app.after_request
+def stop_request_profiler(response):
+    sampler = g.pop('profiler', None)
+    if sampler:
+        sampler.stop()
+        profile = profile_ring.add(sampler, request.method, request.full_path.rstrip('?'),
+                                   response.status_code, session.get('user'))
+        response.headers['X-AttendX-Profile-Id'] = str(profile['id'])
+    return response
+
+@app.teardown_request
+def discard_request_profiler(exc):
+    # after_request is skipped on unhandled errors; never leave a sampler thread running
+    sampler = g.pop('profiler', None)
+    if sampler:
+        sampler.stop()
+
+# ---------------- STATIC ASSETS ----------------
+# build_assets.py writes content-hashed copies of static files (plus .gz/.br variants)
+# to static/dist/ with a manifest. When the manifest exists, url_for('static', ...)
+# resolves to the hashed name, which is served with an immutable one-year cache.
+ASSET_DIST_DIR = os.path.join(app.static_folder, "dist")
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+def load_asset_manifest():
+    try:
+        with open(os.path.join(ASSET_DIST_DIR, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+ASSET_MANIFEST = load_asset_manifest()
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    if endpoint == 'static' and ASSET_MANIFEST:
+        hashed = ASSET_MANIFEST.get(values.get('filename'))
+        if hashed:
+            values['filename'] = hashed
+
+@app.route("/static/dist/<path:filename>")
+def hashed_static(filename):
+    """ Serve a fingerprinted asset, preferring a precompressed variant the client accepts """
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    for encoding, suffix in ASSET_ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(ASSET_DIST_DIR, filename + suffix)):
+            response = send_from_directory(ASSET_DIST_DIR, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSET_DIST_DIR, filename, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
+
+_vendored_assets = {}
+
+@app.template_global()
+def asset_url(filename, cdn_url=None):
+    """ Local (hashed when built) URL for a static file, or `cdn_url` if it was never vendored """
+    if filename not in _vendored_assets:
+        _vendored_assets[filename] = filename in ASSET_MANIFEST or os.path.isfile(os.path.join(app.static_folder, filename))
+    if _vendored_assets[filename] or not cdn_url:
+        return url_for('static', filename=filename)
+    return cdn_url
+
+# ---------------- RESPONSE COMPRESSION & CONDITIONAL GET ----------------
+# Text responses above COMPRESS_MIN_SIZE are gzip/brotli encoded for clients that accept it.
+# Report pages compute a cheap data version first and answer 304 without querying or
+# rendering when the browser's copy is still current. A version is "(max id, row count)"
+# per table scope, so pure renames (e.g. editing a subject name) show up only after the
+# next attendance write.
+COMPRESS_MIN_SIZE = 1024      # bytes
+COMPRESS_MIMETYPES = {"text/html", "text/csv", "text/plain", "application/json"}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.mimetype not in COMPRESS_MIMETYPES
+            or 'Content-Encoding' in response.headers or request.endpoint in ('static', 'hashed_static')):
+        return response
+    if 'Repr-Digest' in response.headers:
+        return response     # spooled exports: Range requests address their bytes (format=csv.gz compresses)
+    if response.is_streamed and not response.direct_passthrough:
+        return response     # generators are sent as they are produced
+
+    if brotli and request.accept_encodings['br']:
+        encoding = 'br'
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    # send_file(io.BytesIO(...)) downloads are passthrough responses; buffer them like any other body
+    response.direct_passthrough = False
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def scope_version(table, id_column, select=None, client=None, **filters):
+    """ "<max id>.<row count>" for the rows of `table` matching `filters`, in one request """
+    query = (client or supabase).table(table).select(select or id_column, count="exact").order(id_column, desc=True).limit(1)
+    for column, value in filters.items():
+        query = query.eq(column, value)
+    resp = query.execute()
+    latest = resp.data[0] if resp.data else {}
+    return ".".join(str(latest.get(c.strip(), "")) for c in (select or id_column).split(",")) + f".{resp.count or 0}"
+
+def sessions_version(client=None):
+    # Records are only ever edited inside the newest (active) session, and every edit bumps its
+    # change_seq (migrate_roster_changes.sql), so the newest session row covers in-place updates
+    return scope_version("attendance_sessions", "session_id", "session_id, change_seq, active", client)
+
+def report_not_modified(*versions):
+    """ 304 response if the client already has this page for these data versions, else None """
+    if any(v is None for v in versions) or session.get('_flashes'):
+        return None
+    key = "|".join([request.full_path, session.get('user', ''), session.get('role', '')] + list(versions))
+    g.report_etag = hashlib.sha1(key.encode()).hexdigest()
+    if request.if_none_match.contains_weak(g.report_etag):
+        response = app.response_class(status=304)
+        response.set_etag(g.report_etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+def report_versions(*scopes):
+    """ Run the version lookups for a report; None (no caching) if any of them fails """
+    try:
+        return [scope() for scope in scopes]
+    except Exception as e:
+        print(f"Data version error: {e}")
+        return [None]
+
+@app.after_request
+def apply_report_etag(response):
+    etag = g.pop('report_etag', None)
+    if etag and response.status_code == 200:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # ---------------- AUTH ROUTES ----------------
 @app.route("/", methods=["GET"])
 def home():
@@ -191,6 +1191,7 @@ def register():
                 "semester": semester,
                 "section": section
             }).execute()
+            user_directory.invalidate(sid)
             flash("Registration successful! Please wait for account approval.", "success")
             return redirect(url_for('login'))
         except Exception as e:
@@ -210,6 +1211,7 @@ def logout():
 
 # ---------------- ADMIN DASHBOARD ----------------
 @app.route("/admin_dashboard")
+@serves_stale
 def admin_dashboard():
     if not login_required('admin'):
         return redirect(url_for('login'))
@@ -218,13 +1220,14 @@ def admin_dashboard():
     
     try:
         # Statistics using count='exact' and head=True to avoid fetching data
-        total_teachers = supabase.table("users").select("*", count="exact", head=True).eq("role", "teacher").execute().count
-        total_students = supabase.table("users").select("*", count="exact", head=True).eq("role", "student").execute().count
-        total_sessions = supabase.table("attendance_sessions").select("*", count="exact", head=True).execute().count
-        active_sessions = supabase.table("attendance_sessions").select("*", count="exact", head=True).eq("active", True).execute().count
+        db = read_db()
+        total_teachers = db.table("users").select("*", count="exact", head=True).eq("role", "teacher").execute().count
+        total_students = db.table("users").select("*", count="exact", head=True).eq("role", "student").execute().count
+        total_sessions = db.table("attendance_sessions").select("*", count="exact", head=True).execute().count
+        active_sessions = db.table("attendance_sessions").select("*", count="exact", head=True).eq("active", True).execute().count
         
         # Pending Approvals
-        pending_students = supabase.table("users").select("*").eq("role", "student").eq("status", "pending").execute().data
+        pending_students = db.table("users").select("*").eq("role", "student").eq("status", "pending").execute().data
 
     except Exception as e:
         print(f"Stats Error: {e}")
@@ -256,6 +1259,7 @@ def add_teacher():
             "password": password, 
             "role": "teacher"
         }).execute()
+        user_directory.invalidate(sid)
         flash("Teacher added successfully!", "success")
     except Exception:
         flash("User ID already exists.", "error")
@@ -271,6 +1275,7 @@ def approve_user(sid):
     
     try:
         supabase.table("users").update({"status": "approved"}).eq("sid", sid).execute()
+        user_directory.invalidate(sid)
         flash(f"User {sid} approved successfully.", "success")
     except Exception as e:
         flash(f"Error approving user: {e}", "error")
@@ -287,6 +1292,7 @@ def reject_user(sid):
     
     try:
         supabase.table("users").update({"status": "rejected"}).eq("sid", sid).execute()
+        user_directory.invalidate(sid)
         flash(f"User {sid} rejected.", "warning")
     except Exception as e:
         flash(f"Error rejecting user: {e}", "error")
@@ -294,14 +1300,15 @@ def reject_user(sid):
     return redirect(request.referrer or url_for('admin_dashboard'))
 
 @app.route("/admin/users")
+@warns_degraded
 def admin_users():
     if not login_required('admin'):
         return redirect(url_for('login'))
         
     if not supabase: return "DB Error", 500
 
-    teachers = supabase.table("users").select("*").eq("role", "teacher").execute().data
-    students = supabase.table("users").select("*").eq("role", "student").execute().data
+    teachers = read_db().table("users").select("*").eq("role", "teacher").execute().data
+    students = read_db().table("users").select("*").eq("role", "student").execute().data
     
     return render_template("admin_users.html", teachers=teachers, students=students)
 
@@ -318,12 +1325,163 @@ def delete_user(sid):
 
     try:
         supabase.table("users").delete().eq("sid", sid).execute()
+        user_directory.invalidate(sid)
         flash(f"User {sid} deleted.", "success")
     except Exception as e:
         flash(f"Error deleting user: {e}", "error")
 
     return redirect(url_for('admin_users'))
 
+# ---------------- ADMIN ROSTER IMPORT ----------------
+ROSTER_CHUNK_SIZE = 500
+ROSTER_SID_PATTERN = re.compile(r"^[A-Za-z0-9._/-]{1,64}$")
+ROSTER_HEADER_ALIASES = {
+    "sid": "sid", "id": "sid", "student id": "sid", "teacher id": "sid", "roll no": "sid", "roll number": "sid",
+    "name": "name", "full name": "name", "student name": "name",
+    "password": "password",
+    "role": "role",
+    "department": "department", "dept": "department",
+    "semester": "semester", "sem": "semester",
+    "section": "section", "sec": "section",
+}
+
+def iter_roster_rows(upload):
+    """ Stream (line_no, row dict) pairs from an uploaded CSV or XLSX roster without loading it whole """
+    filename = (upload.filename or "").lower()
+    if filename.endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("XLSX import needs the openpyxl package; upload a CSV instead.")
+        sheet = load_workbook(upload.stream, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+    else:
+        rows = csv.reader(io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline=""))
+
+    header = next(rows, None)
+    if not header:
+        raise ValueError("The roster file is empty.")
+    columns = [ROSTER_HEADER_ALIASES.get(str(h or "").strip().lower()) for h in header]
+    if "sid" not in columns or "name" not in columns:
+        raise ValueError("The roster needs at least 'sid' and 'name' columns.")
+
+    for line_no, values in enumerate(rows, start=2):
+        row = {col: str(v).strip() for col, v in zip(columns, values) if col and v is not None}
+        if any(row.values()):
+            yield line_no, row
+
+def import_roster(rows, default_password):
+    """ Validate, de-duplicate and bulk insert roster rows; returns (imported, skipped, errors) """
+    imported = skipped = 0
+    errors = []
+    seen = set()
+
+    def flush(batch):
+        nonlocal imported, skipped
+        if not batch:
+            return
+        # One lookup per chunk for sids that are already registered
+        sids = [r['sid'] for _, r in batch]
+        try:
+            existing = {u['sid'] for u in supabase.table("users").select("sid").in_("sid", sids).execute().data}
+        except Exception as e:
+            print(f"Roster Import Error: {e}")
+            errors.extend({'line': line_no, 'sid': r['sid'], 'error': "Database error, row not imported"}
+                          for line_no, r in batch)
+            return
+        fresh = []
+        for line_no, r in batch:
+            if r['sid'] in existing:
+                skipped += 1
+                errors.append({'line': line_no, 'sid': r['sid'], 'error': "Already registered (skipped)"})
+            else:
+                fresh.append((line_no, r))
+        if fresh:
+            try:
+                supabase.table("users").upsert([r for _, r in fresh], on_conflict="sid", ignore_duplicates=True,
+                                               returning="minimal").execute()
+                user_directory.invalidate(*(r['sid'] for _, r in fresh))
+                imported += len(fresh)
+            except Exception as e:
+                print(f"Roster Import Error: {e}")
+                errors.extend({'line': line_no, 'sid': r['sid'], 'error': "Database error, row not imported"}
+                              for line_no, r in fresh)
+
+    batch = []
+    for line_no, row in rows:
+        sid = row.get('sid', '')
+        role = (row.get('role') or 'student').lower()
+        password = row.get('password') or default_password
+
+        if not ROSTER_SID_PATTERN.match(sid):
+            problem = "Missing or invalid ID"
+        elif not row.get('name'):
+            problem = "Missing name"
+        elif role not in ('student', 'teacher'):
+            problem = f"Unknown role '{row.get('role')}'"
+        elif not password:
+            problem = "No password in file and no default password given"
+        elif sid in seen:
+            problem = "Duplicate ID in file"
+        else:
+            problem = None
+
+        if problem:
+            errors.append({'line': line_no, 'sid': sid, 'error': problem})
+            continue
+
+        seen.add(sid)
+        batch.append((line_no, {
+            "sid": sid,
+            "name": row['name'][:120],
+            "password": password,
+            "role": role,
+            "status": "approved",
+            "department": row.get('department') or "General",
+            "semester": row.get('semester') or "1",
+            "section": row.get('section') or "A"
+        }))
+        if len(batch) >= ROSTER_CHUNK_SIZE:
+            flush(batch)
+            batch = []
+    flush(batch)
+
+    errors.sort(key=lambda e: e['line'])
+    return imported, skipped, errors
+
+@app.route("/admin/import_roster", methods=["GET", "POST"])
+def admin_import_roster():
+    if not login_required('admin'):
+        return redirect(url_for('login'))
+
+    if request.method == "GET":
+        return render_template("admin_import.html", report=None)
+
+    if not supabase: return "DB Error", 500
+
+    upload = request.files.get("roster")
+    if not upload or not upload.filename:
+        flash("Choose a CSV or XLSX roster to import.", "error")
+        return redirect(url_for('admin_import_roster'))
+
+    started = time.time()
+    try:
+        imported, skipped, errors = import_roster(iter_roster_rows(upload), request.form.get("default_password", ""))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        flash(f"Could not read roster: {e}", "error")
+        return redirect(url_for('admin_import_roster'))
+
+    report = {
+        'filename': upload.filename,
+        'imported': imported,
+        'skipped': skipped,
+        'failed': len(errors) - skipped,
+        'seconds': round(time.time() - started, 2),
+        'errors': errors
+    }
+    flash(f"Imported {imported} users from {upload.filename}.", "success" if imported else "warning")
+    return render_template("admin_import.html", report=report)
+
 # ---------------- ADMIN SUBJECT MANAGEMENT ----------------
 @app.route("/admin_subjects", methods=["GET", "POST"])
 def admin_subjects():
@@ -352,6 +1510,7 @@ def admin_subjects():
                         "section": section,
                         "added_by": session['user']
                     }).execute()
+                    subject_catalog.invalidate()
                     flash(f"Subject '{subject_name}' added successfully!", "success")
                 except Exception as e:
                     flash(f"Error adding subject: {e}", "error")
@@ -374,10 +1533,12 @@ def admin_subjects():
         # Actually safer to just fetch users names separately or handle logic in jinja if passed as dict.
         # But let's try to map it.
         
-        # Simpler approach: Fetch users and map manually to ensure robustness without relying on exact FK names
-        all_users = {u['sid']: u['name'] for u in supabase.table("users").select("sid, name").execute().data}
+        # Simpler approach: look the admins up in the user directory rather than rely on exact FK names
+        admins = user_directory.lookup(s['added_by'] for s in subjects)
         for s in subjects:
-            s['admin_name'] = all_users.get(s['added_by'], 'Unknown')
+            admin = admins.get(str(s['added_by']).strip()) if s.get('added_by') else None
+            s['admin_name'] = admin.name if admin else 'Unknown'
+
             
     except Exception as e:
         print(f"Subject List Error: {e}")
@@ -406,6 +1567,7 @@ def edit_subject(subject_id):
                 "semester": semester,
                 "section": section
             }).eq("subject_id", subject_id).execute()
+            subject_catalog.invalidate()
             flash("Subject updated successfully!", "success")
         except Exception as e:
             flash(f"Error updating subject: {e}", "error")
@@ -429,6 +1591,7 @@ def delete_subject(subject_id):
             flash(f"Cannot delete subject: {count} attendance sessions are linked to it.", "error")
         else:
             supabase.table("subjects").delete().eq("subject_id", subject_id).execute()
+            subject_catalog.invalidate()
             flash("Subject deleted successfully!", "success")
     except Exception as e:
         flash(f"Error deleting subject: {e}", "error")
@@ -437,29 +1600,68 @@ def delete_subject(subject_id):
 
 
 @app.route("/admin/reports")
+@warns_degraded
 def admin_reports():
     if not login_required('admin'):
         return redirect(url_for('login'))
 
     if not supabase: return "DB Error", 500
-    # SQL: SELECT a.*, u.role FROM ...
-    # Supabase: we can fetch all records and users, then join.
+
+    replica = fresh_replica()
+    if replica:
+        cached = report_not_modified(replica.version())
+    else:
+        db = read_db()
+        cached = report_not_modified(*report_versions(
+            lambda: scope_version("attendance_records", "record_id", client=db), lambda: sessions_version(db),
+            lambda: scope_version("users", "sid", client=db)))
+    if cached: return cached
+    # SQL: SELECT a.*, u.role FROM ... (run as-is on the report replica)
+    # Supabase: fetch all records, then join the roles from the user directory.
     try:
-        records = supabase.table("attendance_records").select("*").order("record_id", desc=True).execute().data
-        all_users = {u['sid']: u for u in supabase.table("users").select("sid, role").execute().data}
-        
-        for r in records:
-            user = all_users.get(r['sid'])
-            r['role'] = user['role'] if user else 'Unknown'
+        if replica:
+            records = replica.records_with_roles()
+        else:
+            records = read_db().table("attendance_records").select("*").order("record_id", desc=True).execute().data
+            users = user_directory.lookup(r['sid'] for r in records)
+
+            for r in records:
+                user = users.get(str(r['sid']).strip())
+                r['role'] = user.role if user else 'Unknown'
             
     except Exception as e:
         print(f"Reports Error: {e}")
         records = []
 
-    return render_template("admin_reports.html", records=records)
+    return render_template("admin_reports.html", records=records, replica_lag=replica_lag(replica))
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if not login_required('admin'):
+        return redirect(url_for('login'))
+
+    return render_template("admin_profiles.html", profiles=profile_ring.list())
+
+@app.route("/admin/profiles/<int:profile_id>.folded")
+def download_profile(profile_id):
+    if not login_required('admin'):
+        return redirect(url_for('login'))
+
+    profile = profile_ring.get(profile_id)
+    if not profile:
+        flash("Profile no longer available.", "error")
+        return redirect(url_for('admin_profiles'))
+
+    return send_file(
+        io.BytesIO(profile['folded'].encode()),
+        mimetype="text/plain",
+        as_attachment=request.args.get('download') == '1',
+        download_name=f"attendx_profile_{profile_id}.folded"
+    )
 
 # ---------------- TEACHER DASHBOARD ----------------
 @app.route("/teacher_dashboard")
+@serves_stale
 def teacher_dashboard():
     if not login_required('teacher'):
         return redirect(url_for('login'))
@@ -475,7 +1677,7 @@ def teacher_dashboard():
         if active_session:
             count = supabase.table("attendance_records").select("*", count="exact", head=True).eq("session_id", active_session['session_id']).execute().count
 
-        subjects = supabase.table("subjects").select("*").order("subject_name").execute().data
+        subjects = subject_catalog.all()
         
         # Pending Approvals (Teachers can also approve)
         pending_students = supabase.table("users").select("*").eq("role", "student").eq("status", "pending").execute().data
@@ -487,7 +1689,8 @@ def teacher_dashboard():
         subjects = []
         pending_students = []
 
-    return render_template("teacher_dashboard.html", active_session=active_session, attendance_count=count, subjects=subjects, pending_students=pending_students)
+    return render_template("teacher_dashboard.html", active_session=active_session, attendance_count=count, subjects=subjects, pending_students=pending_students,
+                           background_jobs=recent_jobs(session['user']))
 
 # ---------------- TEACHER ATTENDANCE ACTIONS ----------------
 @app.route("/teacher", methods=["GET", "POST"])
@@ -508,10 +1711,13 @@ def teacher():
             if subject_id and session_date:
                 try:
                     # Get subject details
-                    sub_resp = supabase.table("subjects").select("*").eq("subject_id", subject_id).execute()
-                    subject = sub_resp.data[0] if sub_resp.data else None
+                    subject = subject_catalog.get(subject_id)
                     
-                    if subject:
+                    if subject and classroom:
+                        # Written locally; the sync engine creates the Supabase session
+                        classroom.start_session(session['user'], subject, session_date, session_name)
+                        flash(f"Attendance started for {subject['subject_name']}", "success")
+                    elif subject:
                         # Deactivate all others first (Update active=False)
                         # We have to fetch active ones first? Or just update all?
                         # Supabase update allows filtering.
@@ -529,6 +1735,7 @@ def teacher():
                             "active": True,
                             "start_time": datetime.now().isoformat()
                         }).execute()
+                        forget_active_session()
                         
                         flash(f"Attendance started for {subject['subject_name']}", "success")
                     else:
@@ -538,75 +1745,33 @@ def teacher():
 
             else:
                 flash("Please select a subject and date", "error")
+        elif action == "stop" and classroom:
+            active_session = classroom.active_session()
+            if active_session:
+                try:
+                    enrolled = fetch_enrolled_for(active_session['subject_id'])
+                except Exception as e:
+                    # Uplink down: the sync engine marks the absentees once Supabase answers again
+                    print(f"Classroom absentee lookup failed: {e}")
+                    enrolled = None
+                classroom.stop_session(active_session['session_id'], enrolled)
+                state.delete(f"qr_token:{active_session['session_id']}")
+                classroom_sync.wake()
+            flash("Attendance stopped and missing students marked absent.", "success")
+            return redirect(url_for('teacher_dashboard'))
         elif action == "stop":
             try:
-                # 1. Get the currently active session to know which subject we are processing
-                active_resp = supabase.table("attendance_sessions").select("*").eq("active", True).execute()
-                active_session = active_resp.data[0] if active_resp.data else None
-                
-                if active_session:
-                    # Automatically mark absent students
-                    sub_id = active_session['subject_id']
-                    sess_id = active_session['session_id']
-                    
-                    # Fetch subject details to get dept/sem/sec
-                    sub_info = supabase.table("subjects").select("*").eq("subject_id", sub_id).execute().data
-                    if sub_info:
-                        sub = sub_info[0]
-                        dept = sub.get('department')
-                        sem = sub.get('semester')
-                        sec = sub.get('section')
-                        
-                        # Find all enrolled students for this subject
-                        print(f"DEBUG: Looking for students with Dept: '{dept}', Sem: '{sem}', Sec: '{sec}'")
-                        
-                        query = supabase.table("users").select("sid, name").eq("role", "student")
-                        if dept: query = query.ilike("department", f"{dept.strip()}")
-                        if sem: query = query.ilike("semester", f"{sem.strip()}")
-                        if sec: query = query.ilike("section", f"{sec.strip()}")
-                        
-                        enrolled_resp = query.execute()
-                        enrolled = enrolled_resp.data if enrolled_resp.data else []
-                        
-                        # Find students already marked (present or otherwise)
-                        marked_resp = supabase.table("attendance_records").select("sid").eq("session_id", sess_id).execute()
-                        marked_sids = [str(m['sid']).strip() for m in marked_resp.data] if marked_resp.data else []
-                        
-                # Identify absentees (those in enrolled but NOT in marked_sids)
-                # We use strip for a robust comparison
-                absentees = [s for s in enrolled if str(s['sid']).strip() not in marked_sids]
-                
-                print(f"DEBUG: Found {len(enrolled)} enrolled, {len(marked_sids)} marked, resulting in {len(absentees)} absentees.")
-                
-                # Use a consistent date format: %d-%m-%Y (same as student QR marking)
-                rec_date = datetime.now().strftime("%d-%m-%Y")
-                
-                # Insert absentee records
-                for student in absentees:
-                    try:
-                        supabase.table("attendance_records").insert({
-                            "session_id": sess_id,
-                            "sid": str(student['sid']).strip(),
-                            "name": student['name'],
-                            "subject_id": sub_id,
-                            "subject": active_session['subject'],
-                            "date": rec_date,
-                            "time": datetime.now().strftime("%H:%M:%S"),
-                            "status": "absent",
-                            "marked_type": "auto"
-                        }).execute()
-                    except Exception as ie:
-                        print(f"Error inserting absentee {student['sid']}: {ie}")
+                active_resp = supabase.table("attendance_sessions").select("session_id").eq("active", True).execute()
 
+                # Stop accepting scans now; the absentees are marked by a background job
+                # (see BACKGROUND JOBS) whose progress the dashboard shows
                 supabase.table("attendance_sessions").update({"active": False}).eq("active", True).execute()
-                # 3. Cleanup valid_tokens (Safe wrap to prevent crash on permission error)
-                try:
-                    supabase.table("valid_tokens").delete().neq("token", "dummy").execute() 
-                    supabase.table("valid_tokens").delete().gt("expires_at", "2000-01-01").execute() 
-                except Exception as te:
-                    print(f"Token Cleanup Permission Error: {te}")
-                
-                flash("Attendance stopped and missing students marked absent.", "success")
+                forget_active_session()
+                for stopped in active_resp.data or []:
+                    job_runner.submit("stop_session", {"session_id": stopped['session_id']}, owner=session['user'],
+                                      key=f"stop_session:{stopped['session_id']}")
+
+                flash("Attendance stopped. Missing students are being marked absent.", "success")
                 return redirect(url_for('teacher_dashboard'))
             except Exception as e:
                 flash(f"Error stopping session: {e}", "error")
@@ -614,51 +1779,28 @@ def teacher():
         return redirect(url_for("teacher"))
 
     # GET Logic (QR Display)
+    live_token = None
+    active_session = None
     try:
-        response = supabase.table("attendance_sessions").select("*").eq("active", True).execute()
-        active_session = response.data[0] if response.data else None
-        
-        subjects = supabase.table("subjects").select("*").order("subject_name").execute().data
+        if classroom:
+            active_session = classroom.active_session()
+        else:
+            response = supabase.table("attendance_sessions").select("*").eq("active", True).execute()
+            active_session = response.data[0] if response.data else None
         
         if active_session:
-            cleanup_tokens()
-            
             # 2. Update QR Token logic (Safe wrap to prevent crash on permission error)
+            # Runs before the subject list so a classroom QR still shows while the uplink is down
             try:
-                # Check latest token
-                tk_resp = supabase.table("valid_tokens").select("created_at").order("created_at", desc=True).limit(1).execute()
-                row = tk_resp.data[0] if tk_resp.data else None
-                
-                generate_new = False
-                if not row:
-                    generate_new = True
-                else:
-                    try:
-                        # Parse timestamp (Supabase is ISO 8601)
-                        last_created = datetime.fromisoformat(row['created_at'].replace('Z', '+00:00')) 
-                        if (datetime.now(last_created.tzinfo) - last_created).total_seconds() > QR_REFRESH_TIME:
-                            generate_new = True
-                    except Exception as e:
-                        print(f"Date parse error: {e}")
-                        generate_new = True
-
-                if generate_new:
-                    token = generate_token()
-                    now_iso = datetime.now().isoformat()
-                    expires_iso = datetime.fromtimestamp(time.time() + TOKEN_VALID_TIME).isoformat()
-                    
-                    supabase.table("valid_tokens").insert({
-                        "token": token,
-                        "created_at": now_iso,
-                        "expires_at": expires_iso
-                    }).execute()
-                    generate_qr(token)
+                live_token = refresh_session_token(active_session['session_id'])
             except Exception as te:
                 print(f"Token Refresh Permission Error: {te}")
                 # We still try to generate a fallback QR if no token exists, 
                 # but it might fail validation later if not in DB.
                 # For now, just logging it so the page doesn't crash.
                 flash("Warning: Token permission error. Attendance might not be markable.", "warning")
+        
+        subjects = subject_catalog.all()
     except Exception as e:
         print(f"Teacher Page Error: {e}")
         # Note: Do not reset active_session to None here if it was already fetched on line 590
@@ -668,42 +1810,35 @@ def teacher():
         
     # Extra data for manual tracking if session is active
     enrolled_students = []
-    present_sids = []
-    manual_present_sids = []
-    absent_sids = []
+    present_sids = set()
+    manual_present_sids = set()
+    absent_sids = set()
+    # Read before the records so a write landing in between is replayed, never missed, by the live poll
+    roster_version = (active_session.get('change_seq') or 0) if active_session else 0
     
     if active_session:
         try:
-            sub_id = active_session['subject_id']
-            # Robust mapping for subject details
-            sub_details = next((s for s in subjects if str(s['subject_id']) == str(sub_id)), None)
-            
-            if sub_details:
-                dept = sub_details.get("department")
-                sem = sub_details.get("semester")
-                sec = sub_details.get("section")
-                
-                # Fetch eligible students with robust filtering
-                query = supabase.table("users").select("sid, name").eq("role", "student")
-                if dept: query = query.ilike("department", f"{dept.strip()}")
-                if sem: query = query.ilike("semester", f"{sem.strip()}")
-                if sec: query = query.ilike("section", f"{sec.strip()}")
-                
-                enrolled_resp = query.execute()
-                enrolled_students = enrolled_resp.data if enrolled_resp.data else []
-                    
             # Fetch existing records and ensure SID comparison is string-safe
-            records_resp = supabase.table("attendance_records").select("sid, status, marked_type").eq("session_id", active_session['session_id']).execute()
-            records = records_resp.data if records_resp.data else []
+            if classroom:
+                records = classroom.records(active_session['session_id'])
+            else:
+                records_resp = supabase.table("attendance_records").select("sid, status, marked_type").eq("session_id", active_session['session_id']).execute()
+                records = records_resp.data if records_resp.data else []
             
             for r in records:
                 sid_str = str(r['sid']).strip()
                 if r.get('status', 'present') == 'present':
-                    present_sids.append(sid_str)
+                    present_sids.add(sid_str)
                     if r.get('marked_type') == 'manual':
-                        manual_present_sids.append(sid_str)
+                        manual_present_sids.add(sid_str)
                 elif r.get('status') == 'absent':
-                    absent_sids.append(sid_str)
+                    absent_sids.add(sid_str)
+            
+            sub_details = subject_catalog.get(active_session['subject_id'])
+            
+            if sub_details:
+                # Fetch eligible students with robust filtering
+                enrolled_students = fetch_enrolled(sub_details)
                     
         except Exception as e:
             print(f"Error fetching manual tracking data: {e}")
@@ -718,7 +1853,88 @@ def teacher():
                            enrolled_students=enrolled_students,
                            present_sids=present_sids,
                            manual_present_sids=manual_present_sids,
-                           absent_sids=absent_sids)
+                           absent_sids=absent_sids,
+                           qr_version=live_token['token'] if live_token else "",
+                           roster_version=roster_version,
+                           sync_status=sync_status(),
+                           poll_interval=QR_REFRESH_TIME)
+
+@app.route("/teacher/live")
+def teacher_live():
+    """ Poll target for the QR screen: current token, its expiry and roster changes since ?since=<seq> """
+    if not login_required('teacher'):
+        return jsonify(active=False, error="login_required"), 401
+    if not supabase:
+        return jsonify(active=False, error="DB Error"), 503
+
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        since = 0
+
+    try:
+        if classroom:
+            active_session = classroom.active_session()
+        else:
+            resp = supabase.table("attendance_sessions").select("session_id, change_seq").eq("active", True).limit(1).execute()
+            active_session = resp.data[0] if resp.data else None
+        if not active_session:
+            return jsonify(active=False)
+
+        sess_id = active_session['session_id']
+        live_token = refresh_session_token(sess_id)
+        version = active_session.get('change_seq') or 0
+        payload = {
+            "active": True,
+            "session_id": sess_id,
+            "token": live_token['token'],
+            "expires_at": live_token['expires_at'],
+            "qr_url": url_for('teacher_qr', token=live_token['token']),
+            "roster_version": version,
+            "changes": []
+        }
+        if classroom:
+            payload["sync"] = sync_status()
+
+        # Only the change log past the page's sequence is read (see migrate_roster_changes.sql);
+        # several writes to one student collapse to the latest, status None meaning cleared
+        if version > since:
+            if classroom:
+                log = classroom.changes_since(sess_id, since)
+            else:
+                log = supabase.table("attendance_changes").select("seq, sid, status, marked_type") \
+                    .eq("session_id", sess_id).gt("seq", since).order("seq").execute().data or []
+            latest = {}
+            for change in log:
+                latest[str(change['sid']).strip()] = change
+            payload["changes"] = [{
+                "sid": sid,
+                "status": change.get('status'),
+                "marked_type": change.get('marked_type')
+            } for sid, change in latest.items()]
+        return jsonify(payload)
+    except Exception as e:
+        print(f"Teacher Live Error: {e}")
+        return jsonify(active=True, error="An error occurred."), 500
+
+@app.route("/teacher/qr/<token>.png")
+def teacher_qr(token):
+    """ QR image for a live token; served from the shared state store so any worker can answer """
+    if not login_required('teacher'):
+        return redirect(url_for('login'))
+    png = state.get(f"qr_png:{token}")
+    if png is None:
+        # Only tokens of the running session are drawn again (the copy expired or was evicted)
+        try:
+            active_session = get_active_session()
+            live = bool(active_session) and token_is_live(active_session['session_id'], token)
+        except Exception as e:
+            print(f"QR token check failed: {e}")
+            live = False
+        if not live:
+            return "No such QR code", 404
+        png = generate_qr(token)
+    return send_file(io.BytesIO(png), mimetype="image/png", max_age=TOKEN_VALID_TIME)
 
 @app.route("/teacher/manual_mark", methods=["POST"])
 def teacher_manual_mark():
@@ -737,8 +1953,11 @@ def teacher_manual_mark():
     
     try:
         # Verify active session
-        resp = supabase.table("attendance_sessions").select("*").eq("active", True).execute()
-        active_session = resp.data[0] if resp.data else None
+        if classroom:
+            active_session = classroom.active_session()
+        else:
+            resp = supabase.table("attendance_sessions").select("*").eq("active", True).execute()
+            active_session = resp.data[0] if resp.data else None
         
         if not active_session:
             flash("No active session to mark attendance for.", "error")
@@ -748,6 +1967,16 @@ def teacher_manual_mark():
         sub_id = active_session['subject_id']
         teacher_id = session['user']
         
+        if classroom:
+            if mark_status == 'clear':
+                classroom.clear(sess_id, student_sid)
+                flash(f"Cleared record for {student_name}.", "success")
+            else:
+                classroom.mark(active_session, student_sid, student_name, mark_status, "manual", marked_by=teacher_id,
+                               date=active_session.get('session_date'))
+                flash(f"Marked {student_name} as {mark_status}.", "success")
+            return redirect(url_for('teacher'))
+        
         # Check if record already exists
         exist_check = supabase.table("attendance_records").select("*").eq("session_id", sess_id).eq("sid", student_sid).execute()
         
@@ -790,6 +2019,7 @@ def teacher_manual_mark():
     return redirect(url_for('teacher'))
 
 @app.route("/attendance")
+@warns_degraded
 def view_attendance():
     if not login_required('teacher'):
         return redirect(url_for('login'))
@@ -797,11 +2027,17 @@ def view_attendance():
     if not supabase: return "DB Error", 500
     
     subject_filter = request.args.get('subject_id', None)
+
+    db = read_db()
+    cached = report_not_modified(*report_versions(
+        lambda: scope_version("attendance_records", "record_id", client=db), lambda: sessions_version(db),
+        subject_catalog.version))
+    if cached: return cached
     
     try:
-        subjects = supabase.table("subjects").select("*").order("subject_name").execute().data
+        subjects = subject_catalog.all()
         
-        query = supabase.table("attendance_records").select("*").order("record_id", desc=True)
+        query = db.table("attendance_records").select("*").order("record_id", desc=True)
         if subject_filter:
             query = query.eq("subject_id", subject_filter)
         
@@ -812,10 +2048,57 @@ def view_attendance():
         subjects = []
     
     return render_template("attendance.html", attendance=records, total=len(records), 
-                          subjects=subjects, selected_subject=subject_filter)
+                          subjects=subjects, selected_subject=subject_filter, export_formats=available_formats())
+
+@app.route("/api/students/search")
+def api_student_search():
+    """ Autocomplete for the student search box: [{sid, name}] best matches first """
+    if not (login_required('teacher') or login_required('admin')):
+        return jsonify(error="login_required"), 401
+    if not supabase:
+        return jsonify(error="DB Error"), 503
+
+    try:
+        matches = student_index.search(request.args.get('q', ''), limit=AUTOCOMPLETE_LIMIT)
+    except Exception as e:
+        print(f"Student Search Error: {e}")
+        return jsonify(error="An error occurred."), 500
+    return jsonify([{"sid": sid, "name": name} for sid, name in matches])
+
+# ---------------- JOB STATUS ----------------
+@app.route("/jobs")
+def job_list():
+    """ The signed-in user's recent background jobs """
+    if 'user' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    return jsonify(recent_jobs(session['user']))
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    if 'user' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    job = jobs.get(job_id)
+    if not job or (job['owner'] != session['user'] and session.get('role') != 'admin'):
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job_view(job))
+
+@app.route("/exports/<job_id>")
+def export_download(job_id):
+    """ The finished export of an export job; a page that waits for it while the job runs """
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    job = jobs.get(job_id)
+    if not job or job['kind'] != 'export' or (job['owner'] != session['user'] and session.get('role') != 'admin'):
+        return "No such export", 404
+    if job['status'] == 'done':
+        meta = export_spool.lookup(job['args']['key'])
+        # Purged from the spool since: build it again
+        return send_export(meta) if meta else redirect(job['args']['retry_url'])
+    return render_template("export_status.html", job=job_view(job))
 
 # ---------------- PROFESSIONAL ATTENDANCE VIEW ----------------
 @app.route("/attendance/view")
+@warns_degraded
 def attendance_view():
     if 'user' not in session:
         return redirect(url_for('login'))
@@ -830,43 +2113,103 @@ def attendance_view():
     from_date = request.args.get('from_date', '')
     to_date = request.args.get('to_date', '')
     search = request.args.get('search', '').strip()
+
+    # Teachers and admins get the report replica unless the range reaches an archived term
+    replica = fresh_replica() if role != 'student' else None
+    if replica and archived_terms_for(from_date, to_date):
+        replica = None
+
+    # Students read their own records from the primary, so a scan shows up at once
+    db = read_db() if role != 'student' else supabase
+    if role == 'student':
+        scopes = (lambda: scope_version("attendance_records", "record_id", sid=user_id), sessions_version)
+    elif replica:
+        scopes = (replica.version, subject_catalog.version)
+    else:
+        scopes = (lambda: scope_version("attendance_records", "record_id", client=db), lambda: sessions_version(db),
+                  subject_catalog.version)
+    cached = report_not_modified(*report_versions(*scopes))
+    if cached: return cached
     
     try:
         # Get subjects based on role
         if role == 'student':
             subjects = []
         else:
-            subjects = supabase.table("subjects").select("*").order("subject_name").execute().data
-        
-        # Build query with role-based filtering
-        query = supabase.table("attendance_records").select("*")
-        
-        # Role-based data restriction
-        if role == 'student':
-            query = query.eq("sid", user_id)
-        # For teacher and admin, no restriction on user_id (they can see all students)
-        
-        # Apply filters
-        if subject_id:
-            query = query.eq("subject_id", subject_id)
-        
-        if from_date:
-            query = query.gte("date", from_date)
-        
-        if to_date:
-            query = query.lte("date", to_date)
+            subjects = subject_catalog.all()
         
+        # The search is tried as record filters in turn until one finds records: students the
+        # index matches by sid, prefix or substring (filtered by indexed sid equality); failing
+        # that, records whose sid or whole name is the text (students no longer in users); only
+        # then the index's near misses. A search matching too many students filters by name.
+        searches = [{}]
         if search and role != 'student':
-            # Search by name (case-insensitive partial match)
-            query = query.ilike("name", f"%{search}%")
+            try:
+                hits = [sid for sid, _ in student_index.search(search, limit=SEARCH_MAX_SIDS + 1, fuzzy=False)]
+                near = [] if hits else [sid for sid, _ in student_index.search(search, limit=SEARCH_MAX_SIDS)]
+            except Exception as se:
+                print(f"Student search index error: {se}")
+                hits, near = None, []
+            if hits is None or len(hits) > SEARCH_MAX_SIDS:
+                searches = [{"name_like": search}]
+            elif hits:
+                searches = [{"sids": hits}]
+            else:
+                searches = [{"sid": search}, {"name": search}] + ([{"sids": near}] if near else [])
+
+        def filtered(query, match):
+            # Role-based data restriction
+            if role == 'student':
+                query = query.eq("sid", user_id)
+            # For teacher and admin, no restriction on user_id (they can see all students)
+            
+            # Apply filters
+            if subject_id:
+                query = query.eq("subject_id", subject_id)
+            
+            if from_date:
+                query = query.gte("date", from_date)
+            
+            if to_date:
+                query = query.lte("date", to_date)
+            
+            if "sids" in match:
+                query = query.in_("sid", match["sids"])
+            elif "sid" in match:
+                query = query.eq("sid", match["sid"])
+            elif "name" in match:
+                # The whole name, case-insensitive
+                query = query.ilike("name", match["name"])
+            elif "name_like" in match:
+                # Search by name (case-insensitive partial match)
+                query = query.ilike("name", f"%{match['name_like']}%")
+            return query.order("date", desc=True).order("time", desc=True)
         
-        # Execute query
-        records = query.order("date", desc=True).order("time", desc=True).execute().data
+        # Execute query: the current term, then any archived term the date range reaches into
+        records = []
+        archive_terms = archived_terms_for(from_date, to_date) if not replica else []
+        for match in searches:
+            if replica:
+                replica_filters = dict(match, subject_id=subject_id, from_date=from_date, to_date=to_date)
+                records = replica.records(**replica_filters)
+            else:
+                records = filtered(db.table("attendance_records").select("*"), match).execute().data
+                if archive_terms:
+                    records += filtered(db.table("attendance_records_archive").select("*").in_(
+                        "term_id", archive_terms), match).execute().data
+            if records:
+                break
         
         # Calculate attendance summary per student
         student_summary = {}
+
+        if replica and records:
+            # GROUP BY student and subject, run by the replica
+            for row in replica.attendance_summary(**replica_filters):
+                key = f"{row['sid']}_{row['subject_id']}" if row['subject_id'] else row['sid']
+                student_summary[key] = dict(row, percentage=0, badge_class='badge-red')
         
-        for record in records:
+        for record in records if not replica else []:
             sid = record['sid']
             subject_id_rec = record.get('subject_id')
             
@@ -908,6 +2251,17 @@ def attendance_view():
         
         # Sort by name
         summary_list.sort(key=lambda x: x['name'])
+
+        # With one subject selected, flag students on a run of missed classes (session bitmaps)
+        if subject_id and role != 'student' and summary_list:
+            try:
+                bits = student_bits_for([s['sid'] for s in summary_list])
+                matrix = next(iter(term_matrices(finished_sessions(subject_id), bits).values()), None)
+                for summary in summary_list:
+                    bit = bits.get(str(summary['sid']).strip())
+                    summary['missed_streak'] = matrix.missed_streak(bit) if matrix and bit is not None else 0
+            except Exception as be:
+                print(f"Missed streak lookup failed: {be}")
         
     except Exception as e:
         print(f"Attendance View Error: {e}")
@@ -923,6 +2277,8 @@ def attendance_view():
                           from_date=from_date,
                           to_date=to_date,
                           search=search,
+                          streak_alert=ABSENCE_STREAK_ALERT,
+                          replica_lag=replica_lag(replica),
                           role=role)
 
 @app.route("/export")
@@ -931,28 +2287,44 @@ def export():
         return redirect(url_for('login'))
         
     if not supabase: return "DB Error", 500
-    
+
+    # Current term by default; ?from_date=YYYY-MM-DD (and ?to_date) adds the archived terms it reaches
+    from_date = request.args.get('from_date', '')
+    to_date = request.args.get('to_date', '')
+    archive_terms = archived_terms_for(from_date, to_date)
+    replica = fresh_replica() if not archive_terms else None
+    fmt = requested_export_format()
+    if not fmt: return f"Unsupported export format; choose one of {', '.join(available_formats())}", 400
+
+    # The data version names the export file; its row count decides between now and a job
+    db = read_db()
     try:
-        records = supabase.table("attendance_records").select("*").order("record_id").execute().data
-    except:
-        records = []
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Session", "Name", "ID", "Subject", "Date", "Time", "Status"])
-    for r in records:
-        writer.writerow([r['session_id'], r['name'], r['sid'], r['subject'], r['date'], r['time'], r.get('status', 'present')])
+        if replica:
+            version, rows = replica.version(), replica.count("attendance_records")
+        else:
+            records_version = scope_version("attendance_records", "record_id", client=db)
+            version, rows = f"{records_version}|{sessions_version(db)}", version_rows(records_version)
+            if archive_terms and rows is not None:
+                # Archived terms never change, so they need a size but no version
+                rows += db.table("attendance_records_archive").select("record_id", count="exact").in_(
+                    "term_id", archive_terms).limit(1).execute().count or 0
+    except Exception as e:
+        print(f"Data version error: {e}")
+        version, rows = None, None
 
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name="attendance.csv"
-    )
+    try:
+        response = start_export("attendance", {"archive_terms": archive_terms}, fmt, version, rows,
+                                "attendance", db, replica)
+    except Exception as e:
+        print(f"Export Error: {e}")
+        return f"Error: {e}", 500
+    if replica:
+        response.headers['X-AttendX-Replica-Lag'] = str(replica_lag(replica))
+    return response
 
 # ---------------- STUDENT DASHBOARD ----------------
 @app.route("/student_dashboard")
+@serves_stale
 def student_dashboard():
     if not login_required('student'):
         return redirect(url_for('login'))
@@ -993,11 +2365,8 @@ def student():
         flash("System error.", "error")
         return redirect(url_for('student_dashboard'))
     
-    cleanup_tokens()
-    
     try:
-        resp = supabase.table("attendance_sessions").select("*").eq("active", True).execute()
-        active_session = resp.data[0] if resp.data else None
+        active_session = get_active_session()
         
         if not active_session:
             flash("Attendance is currently closed.", "error")
@@ -1009,20 +2378,27 @@ def student():
             token_submitted = request.form.get("token")
             
             # Check duplicate
-            dup_check = supabase.table("attendance_records").select("*").eq("session_id", active_session['session_id']).eq("sid", sid).execute()
-            if dup_check.data:
+            if classroom:
+                already_marked = classroom.has_mark(active_session['session_id'], sid)
+            else:
+                dup_check = supabase.table("attendance_records").select("*").eq("session_id", active_session['session_id']).eq("sid", sid).execute()
+                already_marked = bool(dup_check.data)
+            if already_marked:
                 flash("You have already marked attendance for this session.", "error")
                 return redirect(url_for('student_dashboard'))
             
             # Validate token (Safe wrap)
-            token_valid = None
+            token_valid = False
             try:
-                token_resp = supabase.table("valid_tokens").select("*").eq("token", token_submitted).execute()
-                token_valid = token_resp.data if token_resp.data else None
+                token_valid = token_is_live(active_session['session_id'], token_submitted)
             except Exception as te:
                 print(f"Token Validation Permission Error: {te}")
             
-            if token_valid:
+            if token_valid and classroom:
+                classroom.mark(active_session, sid, name, "present", "qr", replace=False)
+                flash("Attendance marked successfully!", "success")
+                return redirect(url_for('student_dashboard'))
+            elif token_valid:
                 supabase.table("attendance_records").insert({
                     "session_id": active_session['session_id'],
                     "sid": sid,
@@ -1041,10 +2417,9 @@ def student():
 
         # GET - Confirmation
         if token:
-            token_valid = None
+            token_valid = False
             try:
-                token_resp = supabase.table("valid_tokens").select("*").eq("token", token).execute()
-                token_valid = token_resp.data if token_resp.data else None
+                token_valid = token_is_live(active_session['session_id'], token)
             except Exception as te:
                 print(f"Token Confirmation Permission Error: {te}")
 
@@ -1060,8 +2435,66 @@ def student():
     
     return render_template("scan.html")
 
+@app.route("/api/scan", methods=["POST"])
+def api_scan():
+    """ Validate a scanned token and mark attendance in one call (used by the in-page scanner) """
+    if 'user' not in session:
+        return jsonify(ok=False, status="login_required", message="Please login to mark attendance.",
+                       login_url=url_for('login')), 401
+    if session.get('role') != 'student':
+        return jsonify(ok=False, status="forbidden", message="Teachers cannot mark attendance."), 403
+    if not supabase:
+        return jsonify(ok=False, status="error", message="System error."), 503
+
+    from postgrest.exceptions import APIError  # already loaded by the client above; kept off the import path
+
+    payload = request.get_json(silent=True) or {}
+    token = str(payload.get("token") or request.form.get("token") or "").strip()
+    if not token:
+        return jsonify(ok=False, status="invalid_token", message="No QR token received."), 400
+
+    try:
+        active_session = get_active_session()
+        if not active_session:
+            return jsonify(ok=False, status="closed", message="Attendance is currently closed.")
+
+        # Expired rows are filtered by token_is_live() instead of running cleanup_tokens() on every scan
+        if not token_is_live(active_session['session_id'], token):
+            return jsonify(ok=False, status="invalid_token", message="Invalid or expired QR code. Please scan again.")
+
+        now = datetime.now()
+        if classroom:
+            if not classroom.mark(active_session, session['user'], session['name'], "present", "qr", replace=False):
+                return jsonify(ok=False, status="duplicate", subject=active_session['subject'],
+                               message="You have already marked attendance for this session.")
+            return jsonify(ok=True, status="marked", subject=active_session['subject'], time=now.strftime("%H:%M:%S"),
+                           message="Attendance marked successfully!")
+        try:
+            # UNIQUE(session_id, sid) makes the insert itself the duplicate check
+            supabase.table("attendance_records").insert({
+                "session_id": active_session['session_id'],
+                "sid": session['user'],
+                "name": session['name'],
+                "subject_id": active_session['subject_id'],
+                "subject": active_session['subject'],
+                "date": now.strftime("%d-%m-%Y"),
+                "time": now.strftime("%H:%M:%S")
+            }, returning="minimal").execute()
+        except APIError as e:
+            if e.code == "23505":
+                return jsonify(ok=False, status="duplicate", subject=active_session['subject'],
+                               message="You have already marked attendance for this session.")
+            raise
+
+        return jsonify(ok=True, status="marked", subject=active_session['subject'], time=now.strftime("%H:%M:%S"),
+                       message="Attendance marked successfully!")
+    except Exception as e:
+        print(f"Scan API Error: {e}")
+        return jsonify(ok=False, status="error", message="An error occurred."), 500
+
 # ---------------- STUDENT REPORTS ----------------
 @app.route("/student_report")
+@warns_degraded
 def student_report():
     if not login_required('student'):
         return redirect(url_for('login'))
@@ -1069,111 +2502,85 @@ def student_report():
     if not supabase: return "DB Error", 500
     
     sid = session['user']
+
+    cached = report_not_modified(*report_versions(
+        lambda: scope_version("attendance_records", "record_id", sid=sid), sessions_version,
+        subject_catalog.version))
+    if cached: return cached
     
-    # Complex aggregation logic (Python side to avoid complex SQL/RPC for now)
+    # Per-subject totals come from the session bitmaps (see ATTENDANCE BITMAPS)
     try:
-        # 1. Get all subjects
-        subjects = supabase.table("subjects").select("*").execute().data
-        
-        # 2. Get all distinct session counts per subject
-        # Fetch all inactive sessions to count 'total classes held'
-        all_sessions = supabase.table("attendance_sessions").select("subject_id, session_id").eq("active", False).execute().data
-        
-        # Map: subject_id -> set(session_ids)
-        subject_session_map = {}
-        for s in all_sessions:
-            sub_id = s['subject_id']
-            if sub_id not in subject_session_map:
-                subject_session_map[sub_id] = set()
-            subject_session_map[sub_id].add(s['session_id'])
-            
-        # 3. Get student attendance
-        my_records = supabase.table("attendance_records").select("session_id, subject_id").eq("sid", sid).execute().data
-        
-        # Map: subject_id -> set(attended_session_ids)
-        my_attendance_map = {}
-        for r in my_records:
-            if r.get('status', 'present') == 'present':
-                sub_id = r['subject_id']
-                if sub_id not in my_attendance_map:
-                    my_attendance_map[sub_id] = set()
-                my_attendance_map[sub_id].add(r['session_id'])
-            
-        # 4. Build Report
-        report = []
-        for sub in subjects:
-            sub_id = sub['subject_id']
-            
-            # Total unique completed sessions for this subject
-            total_sessions = len(subject_session_map.get(sub_id, []))
-            if total_sessions == 0: total_sessions = 1 # Avoid div by zero
-            
-            # My attended sessions
-            attended_sessions = len(my_attendance_map.get(sub_id, []))
-            
-            percentage = (attended_sessions / total_sessions) * 100
-            
-            report.append({
-                'subject_name': sub['subject_name'],
-                'total_classes': total_sessions if total_sessions > 0 and sub_id in subject_session_map else 0, # Display 0 if really 0
-                'attended': attended_sessions,
-                'percentage': round(percentage, 2)
-            })
-            
+        report = build_student_report(sid)
     except Exception as e:
         print(f"Report Generation Error: {e}")
         report = []
     
-    return render_template("student_report.html", report=report)
+    return render_template("student_report.html", report=report, streak_alert=ABSENCE_STREAK_ALERT)
 
 @app.route("/student_report/export")
 def export_student_report():
-    # Logic similar to above, reuse function or copy... copying for safety & speed
     if not login_required('student'): return redirect(url_for('login'))
     if not supabase: return "DB error", 500
     
     sid = session['user']
-    # ... (Re-run logic, omitted for brevity but strictly speaking should duplicate logic or call helper)
-    # Re-running logic for CSV:
+    fmt = requested_export_format()
+    if not fmt: return f"Unsupported export format; choose one of {', '.join(available_formats())}", 400
+
+    # One row per subject, so always written during the request
+    versions = report_versions(
+        lambda: scope_version("attendance_records", "record_id", sid=sid), sessions_version,
+        subject_catalog.version)
+    version = "|".join(versions) if None not in versions else None
     try:
-        subjects = supabase.table("subjects").select("*").execute().data
-        all_sessions = supabase.table("attendance_sessions").select("subject_id, session_id").eq("active", False).execute().data
-        subject_session_map = {}
-        for s in all_sessions:
-            sub_id = s['subject_id']
-            if sub_id not in subject_session_map: subject_session_map[sub_id] = set()
-            subject_session_map[sub_id].add(s['session_id'])
-        my_records = supabase.table("attendance_records").select("session_id, subject_id").eq("sid", sid).execute().data
-        my_attendance_map = {}
-        for r in my_records:
-            sub_id = r['subject_id']
-            if sub_id not in my_attendance_map: my_attendance_map[sub_id] = set()
-            my_attendance_map[sub_id].add(r['session_id'])
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Subject", "Total Classes", "Attended", "Percentage"])
-        
-        for sub in subjects:
-            sub_id = sub['subject_id']
-            total = len(subject_session_map.get(sub_id, []))
-            attended = len(my_attendance_map.get(sub_id, []))
-            real_total = total if total > 0 else 1
-            percentage = (attended / real_total) * 100
-            
-            writer.writerow([sub['subject_name'], total, attended, f"{round(percentage, 2)}%"])
-            
+        return start_export("student_report", {"sid": sid}, fmt, version, 0,
+                            f"attendance_report_{sid}", supabase)
     except Exception as e:
         return f"Error: {e}"
 
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name=f"attendance_report_{sid}.csv"
-    )
+# ---------------- STARTUP ----------------
+# Importing this module only defines routes on the module-level `app`: the Supabase client,
+# qrcode/PIL and the LAN address lookup are all deferred to first use. create_app() is not
+# an application factory but the startup hook of the process that serves: it returns that
+# same `app`, starts the background threads (job runner, classroom sync, report replicator)
+# and warms the lazy pieces so the first real request does not pay for them. gunicorn
+# preloads `app:app` in its master and calls create_app() from post_fork in each worker
+# (gunicorn.conf.py); asgi.py and `python app.py` call it in their own process. A process
+# that imports `app` without calling it runs no background threads.
+WARM_UP_TEMPLATES = ("base.html", "login.html", "scan.html", "student_dashboard.html", "teacher.html")
+_warm_up_started = False
+
+def warm_up_app():
+    """ Build the Supabase client and open its connection (loading the subject catalog), load qrcode/PIL and compile hot templates """
+    started = time.perf_counter()
+    if supabase:
+        try:
+            subject_catalog.all()
+        except Exception as e:
+            print(f"Warm-up query failed: {e}")
+    try:
+        import qrcode
+        qrcode.make("warm-up")
+    except Exception as e:
+        print(f"Warm-up QR failed: {e}")
+    for name in WARM_UP_TEMPLATES:
+        app.jinja_env.get_template(name)
+    return time.perf_counter() - started
+
+def create_app(warm_up=None):
+    """ Startup hook around the module-level app (not a factory; every call returns the same app): starts the warm-up thread (unless ATTENDX_WARM_UP=0), the job runner, the classroom sync engine and the report replicator """
+    global _warm_up_started
+    if warm_up is None:
+        warm_up = os.environ.get("ATTENDX_WARM_UP", "1") != "0"
+    if warm_up and not _warm_up_started:
+        _warm_up_started = True
+        threading.Thread(target=warm_up_app, name="attendx-warm-up", daemon=True).start()
+    job_runner.start()
+    if classroom_sync:
+        classroom_sync.start()
+    if replicator:
+        replicator.start()
+    return app
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True, use_reloader=False)
+    create_app().run(host="0.0.0.0", port=port, debug=True, use_reloader=False)
@@ -0,0 +1,105 @@
+"""
+Bitmap attendance engine.
+
+Every student gets a dense, permanent bit position (the student_bits table), so
+one session's attendance is two Python ints, `present` and `absent`, with one
+bit per student. Python ints are arbitrary-precision bitsets: &, |, ~ and
+bit_count() run in C a machine word at a time, so roster-minus-present or a
+popcount over a few thousand students takes microseconds. Stored, a bitmap is
+its little-endian bytes, zlib-compressed and base64-encoded, in
+attendance_sessions.present_bits / absent_bits (migrate_attendance_bitmaps.sql).
+
+TermMatrix turns the session bitmaps of one subject around into one int per
+student with one bit per session, newest session at bit 0, transposing only the
+students that are asked about. Per-student popcounts and "missed the last N
+classes" are then a few int operations each.
+"""
+
+import base64, zlib
+from functools import reduce
+
+
+def encode(bits):
+    """ Text form of a bitmap for the database; the empty bitmap is "" """
+    if not bits:
+        return ""
+    raw = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    return base64.b64encode(zlib.compress(raw)).decode("ascii")
+
+
+def decode(text):
+    if not text:
+        return 0
+    return int.from_bytes(zlib.decompress(base64.b64decode(text)), "little")
+
+
+def from_positions(positions):
+    bits = 0
+    for position in positions:
+        bits |= 1 << position
+    return bits
+
+
+def positions(bits):
+    """ Set bit positions, lowest first """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def union(bitmaps):
+    return reduce(lambda a, b: a | b, bitmaps, 0)
+
+
+def intersection(bitmaps):
+    bitmaps = list(bitmaps)
+    return reduce(lambda a, b: a & b, bitmaps) if bitmaps else 0
+
+
+def difference(bits, other):
+    """ Members of `bits` that are not in `other` (e.g. roster minus present) """
+    return bits & ~other
+
+
+class TermMatrix:
+    """ One subject's sessions seen per student: bit k of a row is the k-th most recent session """
+
+    def __init__(self, sessions):
+        # sessions: (session_id, present, absent) tuples, oldest first
+        sessions = list(sessions)
+        self.session_ids = [session_id for session_id, _, _ in sessions]
+        self.held = len(sessions)
+        self._columns = [(present, present | absent) for _, present, absent in reversed(sessions)]
+        self._rows = {}
+
+    def row(self, student):
+        """ (attended, rostered) session bits of one student, transposed on first use """
+        row = self._rows.get(student)
+        if row is None:
+            attended = rostered = 0
+            for k, (present, roster) in enumerate(self._columns):
+                attended |= (present >> student & 1) << k
+                rostered |= (roster >> student & 1) << k
+            row = self._rows[student] = (attended, rostered)
+        return row
+
+    def students(self):
+        return positions(union(roster for _, roster in self._columns))
+
+    def attended(self, student):
+        return self.row(student)[0].bit_count()
+
+    def rostered(self, student):
+        """ Sessions the student was enrolled for (present or absent) """
+        return self.row(student)[1].bit_count()
+
+    def missed_streak(self, student):
+        """ Classes missed in a row up to the most recent one, counting only those the student was enrolled for """
+        attended, rostered = self.row(student)
+        since_last = (attended & -attended) - 1 if attended else -1
+        return (rostered & since_last).bit_count()
+
+    def missed_at_least(self, n):
+        """ Students whose current run of missed classes is `n` or longer """
+        return [student for student in self.students() if self.missed_streak(student) >= n]
@@ -0,0 +1,29 @@
+"""
+Store the bitmaps of finished sessions that have none.
+
+The stop job stores a session's bitmaps when it marks the absentees. Sessions
+finished before migrate_attendance_bitmaps.sql, and sessions whose records were
+written after the stop (which clears their bitmaps), are left without them.
+Reports still count those from attendance_records; run this now and then
+(e.g. nightly from cron) so that they read the bitmaps instead. It gives
+students without a bit their permanent one.
+
+    python backfill_session_bitmaps.py
+"""
+
+import sys, time
+
+
+def main():
+    import app as attendx
+    if not attendx.supabase:
+        print("Supabase is not configured (SUPABASE_URL / SUPABASE_KEY)")
+        return 1
+    started = time.perf_counter()
+    rebuilt = attendx.rebuild_session_bitmaps()
+    print(f"Stored bitmaps for {rebuilt} sessions in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
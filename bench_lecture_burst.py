@@ -0,0 +1,349 @@
+"""
+Lecture-burst load test for AttendX.
+
+Simulates one lecture: a teacher starts a session, N students scan the QR code
+(GET /student?token=...) and confirm (POST /student) within a time window while
+the teacher screen keeps refreshing the token, then the teacher stops the session.
+
+By default everything runs in-process and offline: a fake PostgREST server
+(fake_postgrest.py) stands in for Supabase and the app is served by a threaded
+werkzeug server. --server gunicorn starts the production profile
+(gunicorn.conf.py) and --server uvicorn the async mode (asgi.py) as a
+subprocess against the same fake instead, and --target/--fake drive an
+externally started app.
+
+    python bench_lecture_burst.py --students 1000 --window 30 --latency-ms 15
+    python bench_lecture_burst.py --students 1000 --window 30 --latency-ms 15 --server gunicorn --workers 4
+    python bench_lecture_burst.py --students 1000 --window 30 --latency-ms 15 --server uvicorn --workers 1
+    python bench_lecture_burst.py --students 300 --max-p95-ms 800 --max-calls-per-scan 9
+
+Exit code is 1 when a --max-* gate is exceeded, so it can guard regressions.
+"""
+
+import argparse, json, os, random, socket, subprocess, sys, tempfile, threading, time
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from fake_postgrest import FAKE_KEY, start_fake_postgrest
+
+BENCH_DEPARTMENT, BENCH_SEMESTER, BENCH_SECTION = "BENCH", "1", "A"
+BENCH_TEACHER = "T-BENCH"
+BENCH_PASSWORD = "bench"
+
+
+class Browser:
+    """ Minimal cookie-keeping HTTP client; redirects are returned, not followed """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, form=None):
+        body = urlencode(form) if form is not None else None
+        headers = {"Connection": "close"}
+        if body is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={m.value}" for k, m in self.cookies.items())
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            for header in response.headers.get_all("Set-Cookie") or []:
+                self.cookies.load(header)
+            return response.status
+        finally:
+            conn.close()
+
+    def login(self, sid, role):
+        return self.request("POST", "/login", {"username": sid, "password": BENCH_PASSWORD, "role": role})
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def fake_stats(client_base):
+    parts = urlsplit(client_base)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    conn.request("GET", "/_fake/stats")
+    data = json.loads(conn.getresponse().read())
+    conn.close()
+    return data
+
+
+def seed(db_client, students):
+    """ Insert one teacher, one subject and `students` approved students; returns (subject_id, sids) """
+    db_client.table("users").upsert({
+        "sid": BENCH_TEACHER, "name": "Bench Teacher", "password": BENCH_PASSWORD,
+        "role": "teacher", "status": "approved"
+    }, on_conflict="sid").execute()
+    rows = [{
+        "sid": f"S-BENCH-{i:05d}", "name": f"Bench Student {i:05d}", "password": BENCH_PASSWORD,
+        "role": "student", "status": "approved", "department": BENCH_DEPARTMENT,
+        "semester": BENCH_SEMESTER, "section": BENCH_SECTION
+    } for i in range(students + 1)]   # +1 for the isolated calibration scan
+    for start in range(0, len(rows), 500):
+        db_client.table("users").upsert(rows[start:start + 500], on_conflict="sid").execute()
+    subject = db_client.table("subjects").insert({
+        "subject_name": "Load Testing 101", "class_name": "BENCH", "department": BENCH_DEPARTMENT,
+        "semester": BENCH_SEMESTER, "section": BENCH_SECTION, "added_by": BENCH_TEACHER
+    }).execute().data[0]
+    return subject["subject_id"], [r["sid"] for r in rows]
+
+
+def serve_app_in_process(fake_url):
+    """ Import app against the fake and serve it on a free port; returns the base URL """
+    os.environ["SUPABASE_URL"] = fake_url
+    os.environ["SUPABASE_KEY"] = FAKE_KEY
+    os.environ["ATTENDX_STATE_DB"] = fresh_state_db()
+    os.environ["ATTENDX_RATE_LIMITS"] = "0"     # every simulated student scans from 127.0.0.1
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import app as attendx
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, attendx.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="attendx-bench", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", attendx.QR_REFRESH_TIME
+
+
+def fresh_state_db():
+    """ Empty shared-state file so tokens from an earlier run are not reused """
+    return os.path.join(tempfile.mkdtemp(prefix="attendx-bench-"), "state.db")
+
+
+def serve_app_subprocess(server, fake_url, workers, threads):
+    """ Start gunicorn (gunicorn.conf.py) or uvicorn (asgi.py) against the fake; returns (process, base URL) """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SUPABASE_URL=fake_url, SUPABASE_KEY=FAKE_KEY, ATTENDX_STATE_DB=fresh_state_db(),
+               PORT=str(port), WEB_CONCURRENCY=str(workers), ATTENDX_THREADS=str(threads),
+               ATTENDX_RATE_LIMITS="0")     # every simulated student scans from 127.0.0.1
+    if server == "uvicorn":
+        command = ["uvicorn", "asgi:application", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    else:
+        command = ["gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+                   "--access-logfile", "/dev/null", "--log-level", "warning"]
+    proc = subprocess.Popen([sys.executable, "-m"] + command, cwd=here, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"{server} exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def server_label(args):
+    if args.target:
+        return f"external ({args.target})"
+    if args.server == "gunicorn":
+        return f"gunicorn {args.workers} workers x {args.threads} threads"
+    if args.server == "uvicorn":
+        return f"uvicorn {args.workers} workers, async"
+    return "werkzeug, in-process"
+
+
+def run(args):
+    if args.target:
+        if not args.fake:
+            sys.exit("--target needs --fake pointing at the PostgREST stand-in the app uses")
+        base_url, fake_url, refresh = args.target.rstrip("/"), args.fake.rstrip("/"), 15
+    elif args.server in ("gunicorn", "uvicorn"):
+        _, fake_url, _ = start_fake_postgrest(latency_ms=args.latency_ms)
+        server, base_url = serve_app_subprocess(args.server, fake_url, args.workers, args.threads)
+        refresh = 15
+        try:
+            return run_burst(args, base_url, fake_url, refresh)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    else:
+        _, fake_url, _ = start_fake_postgrest(latency_ms=args.latency_ms)
+        base_url, refresh = serve_app_in_process(fake_url)
+    return run_burst(args, base_url, fake_url, refresh)
+
+
+def run_burst(args, base_url, fake_url, refresh):
+    from supabase import create_client
+
+    db_client = create_client(fake_url, FAKE_KEY)
+    subject_id, sids = seed(db_client, args.students)
+    calibration_sid, sids = sids[-1], sids[:-1]
+
+    def latest_token():
+        rows = db_client.table("valid_tokens").select("token").order("created_at", desc=True).limit(1).execute().data
+        return rows[0]["token"] if rows else None
+
+    # ---- Teacher starts the session ----
+    teacher = Browser(base_url)
+    teacher.login(BENCH_TEACHER, "teacher")
+    teacher.request("POST", "/teacher", {
+        "action": "start", "subject_id": subject_id,
+        "session_date": time.strftime("%Y-%m-%d"), "session_name": "Burst"
+    })
+    teacher.request("GET", "/teacher")
+    state = {"token": latest_token()}
+
+    # ---- Students log in before class (not measured) ----
+    browsers = {sid: Browser(base_url) for sid in sids + [calibration_sid]}
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda sid: browsers[sid].login(sid, "student"), browsers))
+
+    def scan(browser):
+        token = state["token"]
+        started = time.perf_counter()
+        get_status = browser.request("GET", f"/student?token={token}")
+        post_status = browser.request("POST", "/student", {"token": token})
+        return time.perf_counter() - started, get_status, post_status
+
+    # ---- One isolated scan to measure DB calls per scan without background noise ----
+    before = fake_stats(fake_url)
+    scan(browsers[calibration_sid])
+    isolated_calls = fake_stats(fake_url)["calls"] - before["calls"]
+
+    # ---- The burst ----
+    absent = set(random.sample(sids, int(len(sids) * args.absent_ratio)))
+    scanners = [sid for sid in sids if sid not in absent]
+    arrivals = sorted(random.uniform(0, args.window) for _ in scanners)
+    latencies, errors = [], []
+    stop_teacher = threading.Event()
+
+    def teacher_screen():
+        # The QR page refreshes every QR_REFRESH_TIME seconds during the lecture
+        while not stop_teacher.wait(refresh):
+            teacher.request("GET", "/teacher")
+            state["token"] = latest_token() or state["token"]
+
+    def student_task(sid, arrival, start):
+        delay = start + arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            elapsed, get_status, post_status = scan(browsers[sid])
+            latencies.append(elapsed)
+            if get_status >= 400 or post_status >= 400:
+                errors.append(f"{sid}: HTTP {get_status}/{post_status}")
+        except Exception as e:
+            errors.append(f"{sid}: {e}")
+
+    refresher = threading.Thread(target=teacher_screen, daemon=True)
+    refresher.start()
+    before = fake_stats(fake_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for sid, arrival in zip(scanners, arrivals):
+            pool.submit(student_task, sid, arrival, start)
+    elapsed = time.perf_counter() - start
+    stop_teacher.set()
+    burst_calls = fake_stats(fake_url)["calls"] - before["calls"]
+
+    # ---- Teacher stops the session (absentee marking) ----
+    stop_started = time.perf_counter()
+    teacher.request("POST", "/teacher", {"action": "stop"})
+    stop_seconds = time.perf_counter() - stop_started
+
+    session_rows = db_client.table("attendance_sessions").select("session_id").eq("subject_id", subject_id) \
+        .order("session_id", desc=True).limit(1).execute().data
+    session_id = session_rows[0]["session_id"] if session_rows else None
+    records = db_client.table("attendance_records").select("sid, status").eq("session_id", session_id).execute().data
+    marked_present = sum(1 for r in records if r.get("status") == "present") - 1   # minus calibration scan
+    marked_absent = sum(1 for r in records if r.get("status") == "absent")
+
+    return {
+        "server": server_label(args),
+        "students": len(sids),
+        "scanners": len(scanners),
+        "window_s": args.window,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_scans_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1) if latencies else 0,
+        },
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "lost_marks": len(scanners) - marked_present,
+        "absentees_marked": marked_absent,
+        "expected_absentees": len(absent),
+        "db_calls_per_scan": isolated_calls,
+        "db_calls_per_scan_in_burst": round(burst_calls / len(scanners), 2) if scanners else 0,
+        "stop_session_s": round(stop_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a lecture's scan burst against AttendX")
+    parser.add_argument("--students", type=int, default=200, help="enrolled students (up to ~1000)")
+    parser.add_argument("--window", type=float, default=20, help="seconds over which scans arrive")
+    parser.add_argument("--concurrency", type=int, default=64, help="simultaneous client connections")
+    parser.add_argument("--absent-ratio", type=float, default=0.1, help="share of students who never scan")
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated Supabase round-trip time")
+    parser.add_argument("--server", choices=["werkzeug", "gunicorn", "uvicorn"], default="werkzeug",
+                        help="how to serve the app when no --target is given")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn/uvicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument("--target", help="base URL of an already running app (default: serve in-process)")
+    parser.add_argument("--fake", help="base URL of the fake PostgREST the --target app talks to")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if p95 scan latency exceeds this")
+    parser.add_argument("--max-calls-per-scan", type=float, help="fail if a scan needs more DB calls than this")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results = run(args)
+
+    print("=" * 60)
+    print("AttendX Lecture Burst")
+    print("=" * 60)
+    print(f"Server: {results['server']}")
+    print(f"Students: {results['students']} ({results['scanners']} scanning over {results['window_s']}s)")
+    print(f"Throughput: {results['throughput_scans_per_s']} scans/s in {results['elapsed_s']}s")
+    lat = results["latency_ms"]
+    print(f"Scan latency: p50 {lat['p50']} ms | p95 {lat['p95']} ms | p99 {lat['p99']} ms | max {lat['max']} ms")
+    print(f"Errors: {results['errors']} | Lost marks: {results['lost_marks']}")
+    for sample in results["error_samples"]:
+        print(f"  - {sample}")
+    print(f"DB calls per scan: {results['db_calls_per_scan']} isolated, "
+          f"{results['db_calls_per_scan_in_burst']} in burst (incl. teacher screen)")
+    print(f"Stop session: {results['stop_session_s']}s, "
+          f"{results['absentees_marked']}/{results['expected_absentees']} absentees marked")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    if args.max_p95_ms is not None and lat["p95"] > args.max_p95_ms:
+        print(f"✗ p95 {lat['p95']} ms exceeds {args.max_p95_ms} ms")
+        failed = True
+    if args.max_calls_per_scan is not None and results["db_calls_per_scan"] > args.max_calls_per_scan:
+        print(f"✗ {results['db_calls_per_scan']} DB calls per scan exceeds {args.max_calls_per_scan}")
+        failed = True
+    if results["errors"] or results["lost_marks"]:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
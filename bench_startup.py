@@ -0,0 +1,176 @@
+"""
+Cold-start benchmark for AttendX.
+
+Measures what a Render spin-up (or a freshly started attendX.exe) costs before
+users are served: a new Python process is started for every run, and the clock
+runs from process spawn to the first 200 response on /login, then to the first
+request that needs Supabase (a student login against the fake PostgREST server,
+fake_postgrest.py), sent after --idle-ms to mimic a user filling in the login
+form while create_app()'s background warm-up runs. The time spent importing
+app.py is reported separately.
+
+    python bench_startup.py                      # 5 runs, werkzeug server
+    python bench_startup.py --server gunicorn    # the production entry point, gunicorn.conf.py
+    python bench_startup.py --no-warm-up --runs 10 --json
+    python bench_startup.py --max-first-ms 1500  # exit code 1 above this median
+
+Keep this in mind when adding module-level work to app.py: every worker pays it.
+"""
+
+import argparse, json, os, socket, statistics, subprocess, sys, time
+import http.client
+from urllib.parse import urlencode
+
+from fake_postgrest import FAKE_KEY, start_fake_postgrest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_SID = "S-STARTUP"
+BENCH_PASSWORD = "startup"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(port, method, path, form=None, timeout=30):
+    body = urlencode(form) if form else None
+    headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def serve_child(port):
+    """ Child process: import the app, report how long that took, then serve it """
+    started = time.perf_counter()
+    import app as attendx
+    imported = time.perf_counter()
+    application = attendx.create_app()
+    print(json.dumps({"import_ms": (imported - started) * 1000}), flush=True)
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    make_server("127.0.0.1", port, application, threaded=True, request_handler=QuietHandler).serve_forever()
+
+
+def one_run(server, fake_url, warm_up, idle):
+    port = free_port()
+    env = dict(os.environ, SUPABASE_URL=fake_url, SUPABASE_KEY=FAKE_KEY,
+               ATTENDX_WARM_UP="1" if warm_up else "0")
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+               "--workers", "1", "--log-level", "warning", "--access-logfile", "/dev/null"]
+    else:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", str(port)]
+
+    spawned = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            try:
+                status = request(port, "GET", "/login", timeout=5)
+            except OSError:
+                time.sleep(0.002)
+                continue
+            if status == 200:
+                break
+        first = time.perf_counter()
+        time.sleep(idle)
+        login_sent = time.perf_counter()
+        status = request(port, "POST", "/login", {"username": BENCH_SID, "password": BENCH_PASSWORD,
+                                                  "role": "student"})
+        first_db = time.perf_counter()
+        if status != 302:
+            raise RuntimeError(f"student login returned {status}")
+    finally:
+        proc.terminate()
+        try:
+            out, _ = proc.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            out, _ = proc.communicate()
+
+    import_ms = None
+    for line in (out or "").splitlines():
+        if line.startswith("{"):
+            import_ms = json.loads(line).get("import_ms")
+    return {
+        "first_200_ms": (first - spawned) * 1000,
+        "first_db_ms": (first_db - login_sent) * 1000,
+        "import_ms": import_ms,
+    }
+
+
+def interpreter_ms():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AttendX cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--server", choices=["werkzeug", "gunicorn"], default="werkzeug")
+    parser.add_argument("--no-warm-up", action="store_true", help="start with ATTENDX_WARM_UP=0")
+    parser.add_argument("--idle-ms", type=float, default=1000, help="pause before the first Supabase request")
+    parser.add_argument("--max-first-ms", type=float, help="fail if the median spawn-to-first-200 exceeds this")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        serve_child(args.child)
+        return 0
+
+    _, fake_url, db = start_fake_postgrest()
+    db.insert("users", {"sid": BENCH_SID, "name": "Startup Student", "password": BENCH_PASSWORD,
+                        "role": "student", "status": "approved"})
+
+    baseline = interpreter_ms()
+    runs = [one_run(args.server, fake_url, not args.no_warm_up, args.idle_ms / 1000) for _ in range(args.runs)]
+    summary = {
+        "server": args.server,
+        "warm_up": not args.no_warm_up,
+        "runs": args.runs,
+        "interpreter_ms": round(baseline, 1),
+        "first_200_ms": round(statistics.median(r["first_200_ms"] for r in runs), 1),
+        "first_db_ms": round(statistics.median(r["first_db_ms"] for r in runs), 1),
+    }
+    imports = [r["import_ms"] for r in runs if r["import_ms"] is not None]
+    if imports:
+        summary["import_ms"] = round(statistics.median(imports), 1)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print("=" * 60)
+        print("AttendX Cold Start")
+        print("=" * 60)
+        print(f"Server: {args.server} | warm-up {'on' if summary['warm_up'] else 'off'} | {args.runs} runs (medians)")
+        print(f"Bare interpreter start:      {summary['interpreter_ms']:8.1f} ms")
+        if "import_ms" in summary:
+            print(f"Import app.py:               {summary['import_ms']:8.1f} ms")
+        print(f"Spawn -> first 200 (/login): {summary['first_200_ms']:8.1f} ms")
+        print(f"First Supabase-backed login: {summary['first_db_ms']:8.1f} ms  (sent {args.idle_ms:.0f} ms later)")
+
+    if args.max_first_ms is not None and summary["first_200_ms"] > args.max_first_ms:
+        print(f"\n❌ first 200 took {summary['first_200_ms']} ms > {args.max_first_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Static asset build for AttendX.
+
+Vendors the third-party CSS/JS/fonts the templates used to pull from public CDNs
+(Bootstrap, Font Awesome, ZXing) into static/vendor/, then writes a content-hashed
+copy of every asset to static/dist/ along with precompressed .gz/.br variants and
+a manifest.json. At runtime app.py maps url_for('static', filename=...) to the
+hashed name and serves static/dist/ with immutable cache headers, so browsers
+fetch each version exactly once and classrooms without internet still get a
+working scan page.
+
+    python build_assets.py              # fetch missing vendor files, then hash + compress
+    python build_assets.py --offline    # only use what is already in static/vendor/
+    python build_assets.py --clean      # remove static/dist/ (app falls back to plain files/CDN)
+
+Re-run after editing anything in static/. Brotli output needs the optional
+`Brotli` package; without it only gzip variants are written.
+"""
+
+import argparse, gzip, hashlib, json, os, posixpath, re, shutil, sys, urllib.request
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+
+FONT_AWESOME = "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0"
+VENDOR = {
+    "vendor/bootstrap/bootstrap.min.css": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css",
+    "vendor/bootstrap/bootstrap.bundle.min.js":
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js",
+    "vendor/fontawesome/css/all.min.css": f"{FONT_AWESOME}/css/all.min.css",
+    # Pinned instead of @latest so a new upstream release cannot break the scanner
+    "vendor/zxing/zxing.min.js": "https://unpkg.com/@zxing/library@0.21.3/umd/index.min.js",
+}
+for _font in ("fa-brands-400", "fa-regular-400", "fa-solid-900", "fa-v4compatibility"):
+    for _ext in ("woff2", "ttf"):
+        VENDOR[f"vendor/fontawesome/webfonts/{_font}.{_ext}"] = f"{FONT_AWESOME}/webfonts/{_font}.{_ext}"
+
+# First-party files (the QR image is generated per token by app.py and never touches static/)
+SOURCES = ["style.css", "particles.js", "canvas_animation.js", "logo.png"]
+
+# The navbar shows the logo at most 120px high; 2x that covers high-DPI screens
+IMAGE_MAX_HEIGHT = {"logo.png": 240}
+
+COMPRESSIBLE = (".css", ".js", ".svg", ".ttf", ".json", ".txt")
+MIN_COMPRESS_BYTES = 512
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+SOURCE_MAP = re.compile(rb"/\*# sourceMappingURL=[^*]*\*/|//# sourceMappingURL=\S*")
+
+
+def fetch_vendor(offline=False):
+    """ Download vendor files that are not in static/vendor/ yet; returns the logical names available """
+    available = []
+    for logical, url in VENDOR.items():
+        target = os.path.join(STATIC_DIR, *logical.split("/"))
+        if not os.path.exists(target):
+            if offline:
+                print(f"  missing {logical} (offline, templates keep the CDN link)")
+                continue
+            try:
+                with urllib.request.urlopen(url, timeout=30) as resp:
+                    data = resp.read()
+            except Exception as e:
+                print(f"  could not fetch {url}: {e}")
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+            print(f"  fetched {logical} ({len(data) // 1024} KB)")
+        available.append(logical)
+    return available
+
+
+def shrink_image(logical, data):
+    max_height = IMAGE_MAX_HEIGHT.get(logical)
+    if not max_height:
+        return data
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    import io
+    img = Image.open(io.BytesIO(data))
+    if img.height > max_height:
+        img = img.resize((round(img.width * max_height / img.height), max_height), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format=img.format or "PNG", optimize=True)
+    return out.getvalue() if len(out.getvalue()) < len(data) else data
+
+
+def rewrite_css_urls(logical, text, manifest):
+    """ Point relative url(...) references in a stylesheet at the hashed files """
+    base = posixpath.dirname(logical)
+
+    def replace(match):
+        quote, ref = match.group(1), match.group(2).strip()
+        if re.match(r"^(data:|https?:|//|#)", ref):
+            return match.group(0)
+        path, sep, suffix = ref, "", ""
+        query = re.search(r"[?#]", ref)
+        if query:
+            path, sep, suffix = ref[:query.start()], query.group(0), ref[query.end():]
+        target = posixpath.normpath(posixpath.join(base, path))
+        if target not in manifest:
+            return match.group(0)
+        relative = posixpath.relpath(manifest[target], posixpath.dirname(manifest[logical]))
+        return f"url({quote}{relative}{sep}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, text)
+
+
+def hashed_name(logical, data):
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    stem, ext = posixpath.splitext(logical)
+    return f"dist/{stem}.{digest}{ext}"
+
+
+def write_variants(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    written = [path]
+    if not path.endswith(COMPRESSIBLE) or len(data) < MIN_COMPRESS_BYTES:
+        return written
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    written.append(path + ".gz")
+    try:
+        import brotli
+    except ImportError:
+        return written
+    with open(path + ".br", "wb") as f:
+        f.write(brotli.compress(data, quality=11))
+    written.append(path + ".br")
+    return written
+
+
+def build(logicals):
+    """ Hash and compress every asset; stylesheets last so their url()s can be rewritten """
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest, sizes = {}, {}
+    ordered = sorted(logicals, key=lambda name: name.endswith(".css"))
+    for logical in ordered:
+        with open(os.path.join(STATIC_DIR, *logical.split("/")), "rb") as f:
+            data = f.read()
+        if logical.endswith((".css", ".js")):
+            data = SOURCE_MAP.sub(b"", data)
+        if logical.endswith(".css"):
+            # Provisional name so relative paths can be computed from the final directory
+            manifest[logical] = hashed_name(logical, data)
+            data = rewrite_css_urls(logical, data.decode("utf-8"), manifest).encode("utf-8")
+        data = shrink_image(logical, data)
+        manifest[logical] = hashed_name(logical, data)
+
+        target = os.path.join(STATIC_DIR, *manifest[logical].split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        sizes[logical] = {os.path.splitext(p)[1] if p.endswith((".gz", ".br")) else "raw": os.path.getsize(p)
+                          for p in write_variants(target, data)}
+
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vendor, fingerprint and precompress AttendX static assets")
+    parser.add_argument("--offline", action="store_true", help="do not download missing vendor files")
+    parser.add_argument("--clean", action="store_true", help="delete static/dist/ and exit")
+    args = parser.parse_args()
+
+    if args.clean:
+        shutil.rmtree(DIST_DIR, ignore_errors=True)
+        print("Removed static/dist/")
+        return 0
+
+    print("Vendoring third-party assets...")
+    vendored = fetch_vendor(args.offline)
+    print("Fingerprinting and compressing...")
+    manifest, sizes = build(SOURCES + vendored)
+
+    for logical in sorted(manifest):
+        variants = ", ".join(f"{k} {v // 1024 if v >= 1024 else v}{'KB' if v >= 1024 else 'B'}"
+                             for k, v in sizes[logical].items())
+        print(f"  {logical:<45} -> {manifest[logical]}  [{variants}]")
+    print(f"Wrote {len(manifest)} assets and static/dist/{MANIFEST_NAME}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,12 @@ if %errorlevel% neq 0 (
     exit /b
 )
 
+echo Vendoring and fingerprinting static assets...
+python build_assets.py
+if %errorlevel% neq 0 (
+    echo Asset build failed; the executable will load CSS/JS from the CDNs.
+)
+
 echo Building attendX executable...
 python -m PyInstaller --noconfirm --name attendX --onefile --console --add-data "templates;templates" --add-data "static;static" --hidden-import=flask --hidden-import=qrcode app.py
 if %errorlevel% neq 0 (
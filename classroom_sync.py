@@ -0,0 +1,383 @@
+"""
+Offline-first classroom mode for AttendX (ATTENDX_CLASSROOM=1).
+
+The laptop build (attendX.spec) serves a class over the LAN, but every scan
+still crossed the uplink to Supabase, so a flaky connection stalled the whole
+room. In classroom mode the live session and every mark are written to a local
+SQLite file instead (the QR tokens already live in state_store.py), and
+SyncEngine pushes them to Supabase in the background:
+
+- sessions are upserted on their client_ref (migrate_classroom_sync.sql), so a
+  push whose reply was lost is simply repeated;
+- marks are upserted in batches keyed on (session_id, sid). A batch that fails
+  stays pending and is retried with exponential backoff;
+- conflicts: a teacher's manual mark (or clear) overwrites the Supabase row,
+  while a QR or automatic mark never replaces a row already there, the same
+  first-mark-wins rule the online path gets from UNIQUE(session_id, sid);
+- absentees are marked at stop from the class list; if Supabase cannot be
+  reached then, the engine marks them as soon as it can.
+
+Users, subjects and the reports still come from Supabase. A session is pushed
+with its real state: active while the class runs (this laptop is still the only
+place that issues tokens for it), and deactivated upstream only once it was
+stopped here and its absentees and marks are all pushed, so the deactivation
+is its last write.
+"""
+
+import os, sqlite3, threading, uuid
+from datetime import datetime
+
+CLASSROOM_DB_PATH = os.environ.get("ATTENDX_CLASSROOM_DB") or os.path.join(os.path.abspath("."), "classroom.db")
+SYNC_INTERVAL = 5             # seconds between pushes while everything is healthy
+SYNC_MAX_BACKOFF = 300        # seconds; ceiling for the retry delay after failed pushes
+SYNC_BATCH_SIZE = 500         # marks per upsert
+SYNC_LOCK_TTL = 120           # seconds one worker may hold the sync lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_ref TEXT NOT NULL UNIQUE,
+    remote_id INTEGER,
+    remote_active INTEGER,
+    teacher_id TEXT,
+    subject_id INTEGER,
+    subject TEXT NOT NULL,
+    session_date TEXT,
+    session_name TEXT,
+    start_time TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    change_seq INTEGER NOT NULL DEFAULT 0,
+    absentees_pending INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS marks (
+    session_id INTEGER NOT NULL REFERENCES sessions(session_id),
+    sid TEXT NOT NULL,
+    name TEXT,
+    date TEXT,
+    time TEXT,
+    status TEXT,
+    marked_type TEXT,
+    marked_by TEXT,
+    seq INTEGER NOT NULL,
+    synced_seq INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, sid)
+);
+CREATE INDEX IF NOT EXISTS marks_pending ON marks (seq, synced_seq);
+"""
+
+SESSION_COLUMNS = "session_id, client_ref, remote_id, teacher_id, subject_id, subject, session_date, " \
+                  "session_name, start_time, active, change_seq, absentees_pending, remote_active"
+
+
+class ClassroomStore:
+    """ Sessions and marks of classroom mode, in a SQLite WAL file shared by the workers on this laptop """
+
+    def __init__(self, path=CLASSROOM_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # Same per-thread, per-process connections as StateStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._upgrade(conn)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def _upgrade(conn):
+        # Files from before remote_active: every session they pushed went up inactive
+        if "remote_active" in {row['name'] for row in conn.execute("PRAGMA table_info(sessions)")}:
+            return
+        try:
+            conn.execute("ALTER TABLE sessions ADD COLUMN remote_active INTEGER")
+            conn.execute("UPDATE sessions SET remote_active = 0 WHERE remote_id IS NOT NULL")
+        except sqlite3.OperationalError:
+            pass        # another worker added it first
+
+    def _transaction(self, work):
+        """ Run `work(conn)` under a write lock so sequence numbers stay in order across workers """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------------- SESSIONS ----------------
+    def start_session(self, teacher_id, subject, session_date, session_name):
+        def work(conn):
+            conn.execute("UPDATE sessions SET active = 0 WHERE active = 1")
+            conn.execute(
+                "INSERT INTO sessions (client_ref, teacher_id, subject_id, subject, session_date, session_name, "
+                "start_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (uuid.uuid4().hex, teacher_id, subject['subject_id'], subject['subject_name'], session_date,
+                 session_name, datetime.now().isoformat()))
+        self._transaction(work)
+        return self.active_session()
+
+    def active_session(self):
+        row = self._conn().execute(f"SELECT {SESSION_COLUMNS} FROM sessions WHERE active = 1 LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+    def stop_session(self, session_id, enrolled=None):
+        """ Close the session; `enrolled` students without a mark become absent (None: the engine does it later) """
+        def work(conn):
+            if enrolled is not None:
+                self._add_absentees(conn, session_id, enrolled)
+            conn.execute("UPDATE sessions SET active = 0, absentees_pending = ? WHERE session_id = ?",
+                         (int(enrolled is None), session_id))
+        self._transaction(work)
+
+    # ---------------- MARKS ----------------
+    def _next_seq(self, conn, session_id):
+        conn.execute("UPDATE sessions SET change_seq = change_seq + 1 WHERE session_id = ?", (session_id,))
+        return conn.execute("SELECT change_seq FROM sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def mark(self, active_session, sid, name, status, marked_type, marked_by=None, date=None, replace=True):
+        """ Record a mark; with replace=False an existing mark wins and False is returned """
+        now = datetime.now()
+        session_id = active_session['session_id']
+
+        def work(conn):
+            existing = conn.execute("SELECT status FROM marks WHERE session_id = ? AND sid = ?",
+                                    (session_id, sid)).fetchone()
+            if existing and existing['status'] is not None and not replace:
+                return False
+            seq = self._next_seq(conn, session_id)
+            conn.execute(
+                "INSERT INTO marks (session_id, sid, name, date, time, status, marked_type, marked_by, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(session_id, sid) DO UPDATE SET "
+                "name = excluded.name, status = excluded.status, marked_type = excluded.marked_type, "
+                "marked_by = excluded.marked_by, seq = excluded.seq",
+                (session_id, sid, name, date or now.strftime("%d-%m-%Y"),
+                 now.strftime("%H:%M:%S"), status, marked_type, marked_by, seq))
+            return True
+        return self._transaction(work)
+
+    def clear(self, session_id, sid):
+        """ Remove a mark; kept as a row with no status so the delete reaches Supabase too """
+        def work(conn):
+            if conn.execute("SELECT 1 FROM marks WHERE session_id = ? AND sid = ? AND status IS NOT NULL",
+                            (session_id, sid)).fetchone():
+                conn.execute("UPDATE marks SET status = NULL, marked_type = 'manual', seq = ? "
+                             "WHERE session_id = ? AND sid = ?", (self._next_seq(conn, session_id), session_id, sid))
+        self._transaction(work)
+
+    def _add_absentees(self, conn, session_id, enrolled):
+        session = conn.execute("SELECT session_date FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        now = datetime.now()
+        for student in enrolled:
+            sid = str(student['sid']).strip()
+            if conn.execute("SELECT 1 FROM marks WHERE session_id = ? AND sid = ? AND status IS NOT NULL",
+                            (session_id, sid)).fetchone():
+                continue
+            conn.execute(
+                "INSERT INTO marks (session_id, sid, name, date, time, status, marked_type, seq) "
+                "VALUES (?, ?, ?, ?, ?, 'absent', 'auto', ?) ON CONFLICT(session_id, sid) DO UPDATE SET "
+                "status = excluded.status, marked_type = excluded.marked_type, seq = excluded.seq",
+                (session_id, sid, student['name'], now.strftime("%d-%m-%Y"), now.strftime("%H:%M:%S"),
+                 self._next_seq(conn, session_id)))
+
+    def has_mark(self, session_id, sid):
+        return self._conn().execute("SELECT 1 FROM marks WHERE session_id = ? AND sid = ? AND status IS NOT NULL",
+                                    (session_id, sid)).fetchone() is not None
+
+    def records(self, session_id):
+        rows = self._conn().execute("SELECT sid, status, marked_type FROM marks WHERE session_id = ? "
+                                    "AND status IS NOT NULL", (session_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def changes_since(self, session_id, since):
+        """ Latest state of every student written after change `since`; status None means cleared """
+        rows = self._conn().execute("SELECT seq, sid, status, marked_type FROM marks WHERE session_id = ? "
+                                    "AND seq > ? ORDER BY seq", (session_id, since)).fetchall()
+        return [dict(r) for r in rows]
+
+    # ---------------- SYNC QUEUE ----------------
+    def unpushed_sessions(self):
+        rows = self._conn().execute(f"SELECT {SESSION_COLUMNS} FROM sessions WHERE remote_id IS NULL").fetchall()
+        return [dict(r) for r in rows]
+
+    def set_remote_id(self, session_id, remote_id):
+        self._conn().execute("UPDATE sessions SET remote_id = ?, remote_active = 1 WHERE session_id = ?",
+                             (remote_id, session_id))
+
+    def sessions_to_close(self):
+        """ Sessions stopped here, still active upstream, with their absentees and marks all pushed """
+        rows = self._conn().execute(
+            f"SELECT {SESSION_COLUMNS} FROM sessions s WHERE active = 0 AND remote_active = 1 "
+            "AND absentees_pending = 0 AND NOT EXISTS (SELECT 1 FROM marks m "
+            "WHERE m.session_id = s.session_id AND m.seq > m.synced_seq)").fetchall()
+        return [dict(r) for r in rows]
+
+    def set_remote_closed(self, session_id):
+        self._conn().execute("UPDATE sessions SET remote_active = 0 WHERE session_id = ?", (session_id,))
+
+    def sessions_awaiting_absentees(self):
+        rows = self._conn().execute(f"SELECT {SESSION_COLUMNS} FROM sessions WHERE absentees_pending = 1").fetchall()
+        return [dict(r) for r in rows]
+
+    def add_absentees(self, session_id, enrolled):
+        def work(conn):
+            self._add_absentees(conn, session_id, enrolled)
+            conn.execute("UPDATE sessions SET absentees_pending = 0 WHERE session_id = ?", (session_id,))
+        self._transaction(work)
+
+    def pending_marks(self, limit=SYNC_BATCH_SIZE):
+        """ Marks written since their last push, for sessions that already exist in Supabase """
+        rows = self._conn().execute(
+            "SELECT m.*, s.remote_id, s.subject_id, s.subject FROM marks m JOIN sessions s USING (session_id) "
+            "WHERE m.seq > m.synced_seq AND s.remote_id IS NOT NULL ORDER BY m.seq LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def mark_synced(self, marks):
+        # Only the pushed version counts as synced; a write that landed meanwhile stays pending
+        self._conn().executemany("UPDATE marks SET synced_seq = ? WHERE session_id = ? AND sid = ? AND seq = ?",
+                                 [(m['seq'], m['session_id'], m['sid'], m['seq']) for m in marks])
+
+    def backlog(self):
+        conn = self._conn()
+        return {
+            "marks": conn.execute("SELECT COUNT(*) FROM marks WHERE seq > synced_seq").fetchone()[0],
+            "sessions": conn.execute("SELECT COUNT(*) FROM sessions WHERE remote_id IS NULL "
+                                     "OR absentees_pending = 1 OR (active = 0 AND remote_active = 1)").fetchone()[0],
+        }
+
+
+class SyncEngine:
+    """ Background thread that drains the ClassroomStore into Supabase; one worker at a time holds the lock """
+
+    def __init__(self, store, client, state, list_enrolled, interval=SYNC_INTERVAL):
+        self.store = store
+        self.client = client
+        self.state = state
+        self.list_enrolled = list_enrolled
+        self.interval = interval
+        self._wake = threading.Event()
+        self._pid = None
+
+    def start(self):
+        # Called by app.create_app() in each serving process (under gunicorn from post_fork in
+        # the worker, never in the preloading master); a second call in one process is a no-op
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self.run, name="attendx-classroom-sync", daemon=True).start()
+        return self
+
+    def wake(self):
+        """ Push now instead of at the next interval (e.g. when a session stops) """
+        self._wake.set()
+
+    def run(self):
+        delay = self.interval
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            if not self.state.claim("classroom_sync", ttl=SYNC_LOCK_TTL):
+                continue
+            try:
+                self.sync_once()
+                self._record(error=None)
+                delay = self.interval
+            except Exception as e:
+                print(f"Classroom sync error: {e}")
+                failures = self._record(error=str(e))
+                delay = min(self.interval * 2 ** failures, SYNC_MAX_BACKOFF)
+            finally:
+                self.state.delete("classroom_sync")
+
+    def sync_once(self):
+        """ Push new sessions, pending absentees, pending marks, then stops; raises if Supabase cannot be reached """
+        if not self.client:
+            raise ConnectionError("Supabase is not configured")
+        for session in self.store.unpushed_sessions():
+            self.push_session(session)
+        for session in self.store.sessions_awaiting_absentees():
+            self.store.add_absentees(session['session_id'], self.list_enrolled(session['subject_id']))
+        while True:
+            batch = self.store.pending_marks()
+            if not batch:
+                break
+            self.push_marks(batch)
+            self.store.mark_synced(batch)
+        for session in self.store.sessions_to_close():
+            self.close_session(session)
+
+    def push_session(self, session):
+        row = self.client.table("attendance_sessions").upsert({
+            "client_ref": session['client_ref'],
+            "teacher_id": session['teacher_id'],
+            "subject_id": session['subject_id'],
+            "subject": session['subject'],
+            "session_date": session['session_date'],
+            "session_name": session['session_name'],
+            "start_time": session['start_time'],
+            # Active even if it already stopped here: its marks follow, and close_session() ends it
+            "active": True
+        }, on_conflict="client_ref").execute().data[0]
+        self.store.set_remote_id(session['session_id'], row['session_id'])
+
+    def close_session(self, session):
+        self.client.table("attendance_sessions").update({"active": False}, returning="minimal").eq(
+            "session_id", session['remote_id']).execute()
+        self.store.set_remote_closed(session['session_id'])
+
+    def push_marks(self, batch):
+        manual, first_wins, cleared = [], [], {}
+        for mark in batch:
+            if mark['status'] is None:
+                cleared.setdefault(mark['remote_id'], []).append(mark['sid'])
+                continue
+            row = {
+                "session_id": mark['remote_id'],
+                "sid": mark['sid'],
+                "name": mark['name'],
+                "subject_id": mark['subject_id'],
+                "subject": mark['subject'],
+                "date": mark['date'],
+                "time": mark['time'],
+                "status": mark['status'],
+                "marked_type": mark['marked_type'],
+                "marked_by": mark['marked_by']
+            }
+            (manual if mark['marked_type'] == 'manual' else first_wins).append(row)
+
+        if first_wins:
+            self.client.table("attendance_records").upsert(first_wins, on_conflict="session_id,sid", ignore_duplicates=True,
+                           returning="minimal").execute()
+        if manual:
+            self.client.table("attendance_records").upsert(manual, on_conflict="session_id,sid", returning="minimal").execute()
+        for remote_id, sids in cleared.items():
+            self.client.table("attendance_records").delete().eq("session_id", remote_id).in_("sid", sids).execute()
+
+    def _record(self, error):
+        """ Publish the outcome for the status indicator; returns the number of failures in a row """
+        status = self.state.get("classroom_sync_status") or {}
+        if error:
+            status.update(error=error, failures=status.get("failures", 0) + 1)
+        else:
+            status = {"last_sync": datetime.now().isoformat(timespec="seconds"), "failures": 0}
+        self.state.set("classroom_sync_status", status)
+        return status.get("failures", 0)
+
+    def status(self):
+        """ Indicator data: 'synced', 'pending' (queued, last push fine) or 'offline' (last push failed) """
+        status = dict(self.state.get("classroom_sync_status") or {})
+        backlog = self.store.backlog()
+        if status.get("failures"):
+            status["state"] = "offline"
+        else:
+            status["state"] = "pending" if backlog["marks"] or backlog["sessions"] else "synced"
+        status["pending_marks"] = backlog["marks"]
+        status["pending_sessions"] = backlog["sessions"]
+        return status
@@ -0,0 +1,163 @@
+"""
+Export files for AttendX.
+
+/export and the student report export write their file to a spool directory
+on this host (ATTENDX_EXPORT_DIR) instead of building it in memory, and serve
+it from there:
+
+- a file is named after what it holds: the report, its parameters, the format
+  and the data version it was read at (export_key). Downloading an unchanged
+  dataset again finds the finished file and sends it without reading a row;
+- rows are written in batches as they arrive, so a whole-institution export
+  never sits in memory, and the writer reports progress after every batch;
+- a file is written under a temporary name and renamed into place, with a
+  sidecar JSON holding its size, row count and SHA-256, so a half-written
+  export is never served;
+- CSV, gzipped CSV and XLSX (with openpyxl installed) are supported.
+
+Files older than EXPORT_KEEP seconds are removed by purge().
+"""
+
+import csv, gzip, hashlib, importlib.util, io, json, os, tempfile, time
+
+EXPORT_DIR = os.environ.get("ATTENDX_EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "attendx_exports")
+EXPORT_KEEP = 24 * 3600       # seconds a finished export stays on disk
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "csv.gz": ("application/gzip", ".csv.gz"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+
+
+def available_formats():
+    """ The formats this host can write (XLSX needs openpyxl) """
+    return [f for f in FORMATS if f != "xlsx" or importlib.util.find_spec("openpyxl")]
+
+
+def export_key(report, params, fmt, version):
+    """ Name of the export of `report` with `params` in `fmt`, read at data version `version` """
+    raw = json.dumps([report, params, fmt, version], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def file_sha256(path, chunk=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExportSpool:
+    """ Finished export files in a directory shared by every worker process on the host """
+
+    def __init__(self, directory=EXPORT_DIR):
+        self.directory = directory
+
+    def _paths(self, key, fmt):
+        return os.path.join(self.directory, key + FORMATS[fmt][1]), os.path.join(self.directory, key + ".json")
+
+    def lookup(self, key):
+        """ The finished export `key` (its sidecar, with 'path'), or None """
+        meta_path = os.path.join(self.directory, key + ".json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = self._paths(key, meta['format'])[0]
+        try:
+            if os.path.getsize(path) != meta['size']:
+                return None
+        except OSError:
+            return None
+        return dict(meta, path=path)
+
+    def write(self, key, fmt, header, batches, total=None, progress=None, **extra):
+        """
+        Write the rows of `batches` (lists of rows) under `key` and return its sidecar.
+        progress(fraction, message) is called after every batch; `total` is the expected row count.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown export format {fmt!r}")
+        os.makedirs(self.directory, exist_ok=True)
+        path, meta_path = self._paths(key, fmt)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".export-", suffix=FORMATS[fmt][1])
+        os.close(fd)
+        try:
+            rows = (self._write_xlsx if fmt == "xlsx" else self._write_csv)(
+                tmp, fmt, header, batches, total, progress)
+            meta = dict(extra, key=key, format=fmt, mimetype=FORMATS[fmt][0], rows=rows,
+                        size=os.path.getsize(tmp), sha256=file_sha256(tmp), created_at=time.time())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._write_json(meta_path, meta)
+        return dict(meta, path=path)
+
+    @staticmethod
+    def _report(progress, rows, total):
+        if progress:
+            progress(min(rows / total, 0.99) if total else 0.5, f"{rows} rows written")
+
+    def _write_csv(self, path, fmt, header, batches, total, progress):
+        raw = gzip.open(path, "wb") if fmt == "csv.gz" else open(path, "wb")
+        with io.TextIOWrapper(raw, encoding="utf-8", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(header)
+            rows = 0
+            for batch in batches:
+                writer.writerows(batch)
+                out.flush()
+                rows += len(batch)
+                self._report(progress, rows, total)
+        return rows
+
+    def _write_xlsx(self, path, fmt, header, batches, total, progress):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("XLSX export needs openpyxl (pip install openpyxl)")
+        # write_only keeps one row in memory at a time; the sheet is zipped on save
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Export")
+        sheet.append(header)
+        rows = 0
+        for batch in batches:
+            for row in batch:
+                sheet.append(row)
+            rows += len(batch)
+            self._report(progress, rows, total)
+        workbook.save(path)
+        return rows
+
+    def _write_json(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".export-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def purge(self, older_than=EXPORT_KEEP):
+        """ Delete exports (and abandoned temporary files) older than `older_than` seconds; returns how many files went """
+        cutoff = time.time() - older_than
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def clear(self):
+        """ Delete every export (tests and benchmarks start from an empty spool) """
+        return self.purge(older_than=-1)
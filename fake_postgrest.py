@@ -0,0 +1,544 @@
+"""
+Local PostgREST-compatible stand-in for Supabase.
+
+Serves the subset of the PostgREST protocol that supabase-py uses in app.py
+(select/insert/upsert/update/delete with eq/neq/lt/lte/gt/gte/ilike/in
+filters, order, limit/offset and exact counts) from in-memory tables, so the
+app, the benchmarks and the verification scripts can run fully offline:
+
+    python fake_postgrest.py --port 54321 --latency-ms 20
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=sb_fake gunicorn app:app
+
+Every request is counted; GET /_fake/stats returns call and row totals and
+POST /_fake/reset clears them (add ?data=1 to also drop all rows). Setting
+db.outage simulates an incident: "down" answers every query with PostgREST's
+503 "database unreachable" error, a number of seconds stalls every query that
+long first.
+"""
+
+import json, re, threading, time, argparse
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+FAKE_KEY = "sb_fake_local_key"
+
+# Mirrors supabase_schema.sql plus the later migrations
+TABLES = {
+    "users": {
+        "pk": ("sid",), "timestamps": ("created_at",), "touched": ("updated_at",), "indexes": ("sid", "role"),
+        "defaults": {"role": "student", "status": "pending", "department": "General",
+                     "semester": "1", "section": "A", "photo_path": None},
+    },
+    "subjects": {
+        "pk": ("subject_id",), "identity": "subject_id", "timestamps": ("created_at",), "touched": ("updated_at",),
+        "defaults": {"department": "General", "semester": "1", "section": "A", "added_by": None},
+    },
+    "attendance_sessions": {
+        "pk": ("session_id",), "identity": "session_id", "timestamps": ("start_time",), "touched": ("updated_at",),
+        "unique": [("client_ref",)], "indexes": ("session_id", "active", "subject_id"),
+        "defaults": {"active": True, "end_time": None, "session_name": None, "change_seq": 0, "client_ref": None,
+                     "present_bits": None, "absent_bits": None},
+    },
+    "valid_tokens": {
+        "pk": ("token",), "timestamps": ("created_at",), "indexes": ("token",),
+    },
+    "attendance_records": {
+        "pk": ("record_id",), "identity": "record_id",
+        "unique": [("session_id", "sid")], "indexes": ("session_id", "sid", "subject_id"),
+        "defaults": {"status": "present", "marked_type": "qr", "marked_by": None},
+    },
+    "attendance_changes": {
+        "pk": ("change_id",), "identity": "change_id", "timestamps": ("changed_at",),
+        "unique": [("session_id", "seq")], "indexes": ("session_id",),
+    },
+    "student_bits": {
+        "pk": ("sid",), "identity": "bit", "unique": [("bit",)], "indexes": ("sid",),
+    },
+    "terms": {
+        "pk": ("term_id",), "identity": "term_id", "unique": [("name",)],
+        "defaults": {"archived": False},
+    },
+    "attendance_sessions_archive": {
+        "pk": ("term_id", "session_id"), "indexes": ("term_id", "subject_id"),
+    },
+    "attendance_records_archive": {
+        "pk": ("term_id", "record_id"), "indexes": ("term_id", "sid", "subject_id"),
+    },
+}
+
+
+# ---------------- TRIGGERS ----------------
+# Python versions of the triggers in migrate_roster_changes.sql and
+# migrate_attendance_bitmaps.sql. They run inside the write that fired them (under
+# the database lock), like an AFTER ROW trigger would.
+def log_attendance_change(db, op, old, new):
+    record = old if op == "DELETE" else new
+    if record.get("session_id") is None:
+        return
+    matched = db._matching("attendance_sessions", {"filters": [("session_id", f"eq.{record['session_id']}")]})
+    if not matched:
+        return
+    row_id, session = matched[0]
+    seq = db._replace("attendance_sessions", row_id, {"change_seq": (session.get("change_seq") or 0) + 1,
+                                                         "present_bits": None, "absent_bits": None})["change_seq"]
+    db.insert("attendance_changes", {
+        "session_id": record["session_id"], "seq": seq, "sid": record.get("sid"),
+        "status": None if op == "DELETE" else (record.get("status") or "present"),
+        "marked_type": None if op == "DELETE" else record.get("marked_type"),
+    })
+
+
+def prune_attendance_changes(db, op, old, new):
+    if op == "UPDATE" and old.get("active") and not new.get("active"):
+        db.delete("attendance_changes", {"filters": [("session_id", f"eq.{new['session_id']}")]})
+
+
+TRIGGERS = {
+    "attendance_records": [log_attendance_change],
+    "attendance_sessions": [prune_attendance_changes],
+}
+
+
+class FakeError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.body = {"code": code, "message": message, "details": None, "hint": None}
+
+
+def _split_top_level(text):
+    """ Split a select list on commas that are not inside an embed's parentheses """
+    parts, depth, current = [], 0, ""
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    parts.append(current)
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _coerce(row_value, raw):
+    """ Convert a filter literal to the type of the stored value so comparisons behave like SQL """
+    if isinstance(row_value, bool):
+        return raw.lower() == "true"
+    if isinstance(row_value, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return raw
+    if isinstance(row_value, float):
+        try:
+            return float(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def _like_to_regex(pattern):
+    pattern = pattern.replace("*", "%")
+    regex = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern)
+    return re.compile(f"^{regex}$", re.DOTALL | re.IGNORECASE)
+
+
+def _parse_in_list(raw):
+    inner = raw[1:-1] if raw.startswith("(") and raw.endswith(")") else raw
+    values = re.findall(r'"((?:[^"\\]|\\.)*)"|([^,]+)', inner)
+    return [quoted if quoted else plain for quoted, plain in values]
+
+
+def _bucket_key(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _make_filter(column, expr):
+    negate = expr.startswith("not.")
+    if negate:
+        expr = expr[4:]
+    op, _, raw = expr.partition(".")
+
+    if op == "in":
+        options = _parse_in_list(raw)
+        test = lambda v: v is not None and str(v).lower() in [o.lower() for o in options]
+    elif op == "is":
+        target = {"null": None, "true": True, "false": False}.get(raw.lower())
+        test = lambda v: v is target
+    elif op in ("like", "ilike"):
+        regex = _like_to_regex(raw)
+        test = lambda v: v is not None and bool(regex.match(str(v)))
+    else:
+        compare = {
+            "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+            "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+            "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+        }.get(op)
+        if compare is None:
+            raise FakeError(400, "PGRST100", f"unsupported operator '{op}'")
+
+        def test(v):
+            if v is None:
+                return False
+            try:
+                return compare(v, _coerce(v, raw))
+            except TypeError:
+                return compare(str(v), raw)
+
+    if negate:
+        return lambda row: not test(row.get(column))
+    return lambda row: test(row.get(column))
+
+
+class FakeDatabase:
+    """ In-memory tables with PostgREST-like query semantics and call accounting """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.unique = {}
+        self.buckets = {}
+        self.identities = Counter()
+        self.next_row_id = 0
+        self.triggers = {table: list(fns) for table, fns in TRIGGERS.items()}
+        self.outage = None
+        self.reset_stats()
+
+    # ---------------- STATS ----------------
+    def reset_stats(self):
+        self.stats = {"calls": 0, "rows_out": 0, "rows_in": 0, "by_table": Counter(), "by_method": Counter()}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "calls": self.stats["calls"],
+                "rows_out": self.stats["rows_out"],
+                "rows_in": self.stats["rows_in"],
+                "by_table": dict(self.stats["by_table"]),
+                "by_method": dict(self.stats["by_method"]),
+                "rows": {name: len(rows) for name, rows in self.tables.items()},
+            }
+
+    def _count_call(self, method, table, rows_in=0, rows_out=0):
+        self.stats["calls"] += 1
+        self.stats["rows_in"] += rows_in
+        self.stats["rows_out"] += rows_out
+        self.stats["by_table"][table] += 1
+        self.stats["by_method"][method] += 1
+
+    # ---------------- DATA ----------------
+    # Rows live in insertion-ordered dicts keyed by a private row id. Unique keys
+    # and the columns listed under "indexes" keep hash buckets so the eq lookups
+    # on the scan path stay O(1) even with millions of seeded records.
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.unique.clear()
+            self.buckets.clear()
+            self.identities.clear()
+
+    def rows(self, table):
+        return list(self.tables.get(table, {}).values())
+
+    def _key(self, row, columns):
+        return tuple(str(row.get(c)) for c in columns)
+
+    def _unique_keys(self, table):
+        spec = TABLES.get(table, {})
+        return ([spec["pk"]] if "pk" in spec else []) + spec.get("unique", [])
+
+    def _index(self, table, row_id, row):
+        for columns in self._unique_keys(table):
+            if any(row.get(c) is None for c in columns):
+                continue    # NULLs never collide, as in Postgres
+            self.unique.setdefault((table, columns), {})[self._key(row, columns)] = row_id
+        for column in TABLES.get(table, {}).get("indexes", ()):
+            self.buckets.setdefault((table, column), {}).setdefault(_bucket_key(row.get(column)), {})[row_id] = row
+
+    def _unindex(self, table, row_id, row):
+        for columns in self._unique_keys(table):
+            self.unique.get((table, columns), {}).pop(self._key(row, columns), None)
+        for column in TABLES.get(table, {}).get("indexes", ()):
+            self.buckets.get((table, column), {}).get(_bucket_key(row.get(column)), {}).pop(row_id, None)
+
+    def _lookup(self, table, columns, row):
+        """ Row id of an existing row with the same values for `columns`, if any """
+        if any(row.get(c) is None for c in columns):
+            return None
+        index = self.unique.get((table, columns))
+        if index is not None:
+            return index.get(self._key(row, columns))
+        key = self._key(row, columns)
+        return next((rid for rid, r in self.tables.get(table, {}).items() if self._key(r, columns) == key), None)
+
+    def _prepare(self, table, row):
+        spec = TABLES.get(table, {})
+        row = dict(row)
+        for column, value in spec.get("defaults", {}).items():
+            row.setdefault(column, value)
+        for column in spec.get("timestamps", ()) + spec.get("touched", ()):
+            if row.get(column) is None:
+                row[column] = datetime.now().isoformat()
+        identity = spec.get("identity")
+        if identity:
+            if row.get(identity) is None:
+                self.identities[table] += 1
+                row[identity] = self.identities[table]
+            else:
+                self.identities[table] = max(self.identities[table], int(row[identity]))
+        return row
+
+    def _fire(self, table, op, old, new):
+        for trigger in self.triggers.get(table, []):
+            trigger(self, op, old, new)
+
+    def _replace(self, table, row_id, changes):
+        rows = self.tables[table]
+        old = rows[row_id]
+        new = dict(old, **changes)
+        for column in TABLES.get(table, {}).get("touched", ()):
+            new[column] = datetime.now().isoformat()     # touch_updated_at (migrate_report_replica.sql)
+        for columns in self._unique_keys(table):
+            clash = self._lookup(table, columns, new)
+            if clash is not None and clash != row_id:
+                raise FakeError(409, "23505", f'duplicate key value violates unique constraint on "{table}"')
+        self._unindex(table, row_id, old)
+        rows[row_id] = new
+        self._index(table, row_id, new)
+        self._fire(table, "UPDATE", old, new)
+        return new
+
+    def select(self, table, params):
+        with self.lock:
+            rows = self._filter(table, params)
+            total = len(rows)
+            rows = self._order(rows, params.get("order"))
+            offset = int(params.get("offset", 0))
+            limit = params.get("limit")
+            rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+            rows = self._project(rows, params.get("select", "*"))
+            return rows, total, offset
+
+    def insert(self, table, payload, on_conflict=None, resolution=None):
+        payload = payload if isinstance(payload, list) else [payload]
+        conflict_columns = tuple(c.strip() for c in on_conflict.split(",")) if on_conflict else None
+        if resolution and not conflict_columns:
+            conflict_columns = TABLES.get(table, {}).get("pk")     # PostgREST defaults to the primary key
+        written = []
+        with self.lock:
+            rows = self.tables.setdefault(table, {})
+            for incoming in payload:
+                if resolution and conflict_columns:
+                    match = self._lookup(table, conflict_columns, incoming)
+                    if match is not None:
+                        if resolution != "ignore-duplicates":
+                            written.append(dict(self._replace(table, match, incoming)))
+                        continue
+                row = self._prepare(table, incoming)
+                if any(self._lookup(table, columns, row) is not None for columns in self._unique_keys(table)):
+                    if resolution == "ignore-duplicates":
+                        continue
+                    raise FakeError(409, "23505", f'duplicate key value violates unique constraint on "{table}"')
+                self.next_row_id += 1
+                rows[self.next_row_id] = row
+                self._index(table, self.next_row_id, row)
+                self._fire(table, "INSERT", None, row)
+                written.append(dict(row))
+        return written
+
+    def update(self, table, params, changes):
+        with self.lock:
+            return [dict(self._replace(table, row_id, changes)) for row_id, _ in self._matching(table, params)]
+
+    def delete(self, table, params):
+        with self.lock:
+            matched = self._matching(table, params)
+            for row_id, row in matched:
+                del self.tables[table][row_id]
+                self._unindex(table, row_id, row)
+                self._fire(table, "DELETE", row, None)
+            return [dict(row) for _, row in matched]
+
+    # ---------------- QUERY HELPERS ----------------
+    def _matching(self, table, params):
+        """ (row_id, row) pairs matching every filter, narrowed through an index when possible """
+        conditions = params.get("filters", [])
+        candidates = self.tables.get(table, {})
+        for column, expr in conditions:
+            bucket = self.buckets.get((table, column))
+            if bucket is not None and expr.startswith("eq."):
+                candidates = bucket.get(expr[3:], {})
+                break
+        filters = [_make_filter(column, expr) for column, expr in conditions]
+        return [(rid, row) for rid, row in list(candidates.items()) if all(f(row) for f in filters)]
+
+    def _filter(self, table, params):
+        return [row for _, row in self._matching(table, params)]
+
+    def _order(self, rows, order):
+        if not order:
+            return list(rows)
+        rows = list(rows)
+        for term in reversed(order.split(",")):
+            parts = term.split(".")
+            column, desc = parts[0], "desc" in parts[1:]
+            present = [r for r in rows if r.get(column) is not None]
+            missing = [r for r in rows if r.get(column) is None]
+            present.sort(key=lambda r: r[column], reverse=desc)
+            rows = present + missing if not desc else missing + present
+        return rows
+
+    def _project(self, rows, select):
+        columns = _split_top_level(select)
+        if "*" in columns:
+            return [dict(r) for r in rows]
+        # Embedded resources such as users!fk(name) are not emulated
+        plain = [c for c in columns if "(" not in c]
+        return [{c: r.get(c) for c in plain} for r in rows]
+
+
+RESERVED_PARAMS = ("select", "order", "limit", "offset", "on_conflict", "columns")
+
+
+def parse_query(query):
+    params = {"filters": []}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        if key in RESERVED_PARAMS:
+            params[key] = value
+        else:
+            params["filters"].append((key, value))
+    return params
+
+
+def make_handler(db, latency=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=None, headers=None, include_body=True):
+            payload = b"" if body is None else json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(payload) if include_body else 0))
+            self.end_headers()
+            if include_body and payload:
+                self.wfile.write(payload)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"null") if length else None
+
+        def _prefer(self):
+            return {p.split("=")[0].strip(): (p.split("=") + [""])[1].strip()
+                    for p in self.headers.get("Prefer", "").split(",") if p.strip()}
+
+        def _dispatch(self, method):
+            url = urlsplit(self.path)
+            if url.path.startswith("/_fake/"):
+                return self._admin(method, url)
+            if not url.path.startswith("/rest/v1/"):
+                return self._send(404, {"message": "not found"})
+            table = url.path[len("/rest/v1/"):].strip("/")
+            params = parse_query(url.query)
+            prefer = self._prefer()
+            if latency:
+                time.sleep(latency)
+            if db.outage == "down":
+                with db.lock:
+                    db._count_call(method, table)
+                return self._send(503, {"code": "PGRST000", "message": "Database connection error",
+                                        "hint": None, "details": "connection refused"})
+            if db.outage:
+                time.sleep(db.outage)
+            try:
+                if method in ("GET", "HEAD"):
+                    rows, total, offset = db.select(table, params)
+                    headers = {}
+                    if prefer.get("count"):
+                        end = offset + len(rows) - 1
+                        headers["Content-Range"] = f"{offset}-{end}/{total}" if rows else f"*/{total}"
+                    with db.lock:
+                        db._count_call(method, table, rows_out=0 if method == "HEAD" else len(rows))
+                    return self._send(200, rows, headers, include_body=method == "GET")
+
+                body = self._body()
+                if method == "POST":
+                    written = db.insert(table, body, params.get("on_conflict"), prefer.get("resolution"))
+                    rows_in = len(body) if isinstance(body, list) else 1
+                    status = 201
+                elif method == "PATCH":
+                    written = db.update(table, params, body or {})
+                    rows_in, status = len(written), 200
+                else:
+                    written = db.delete(table, params)
+                    rows_in, status = 0, 200
+                returned = written if prefer.get("return") == "representation" else []
+                # Like PostgREST, count=exact on a write reports the rows it actually touched
+                headers = {"Content-Range": f"*/{len(written)}"} if prefer.get("count") else {}
+                with db.lock:
+                    db._count_call(method, table, rows_in=rows_in, rows_out=len(returned))
+                return self._send(status, returned, headers)
+            except FakeError as e:
+                with db.lock:
+                    db._count_call(method, table)
+                return self._send(e.status, e.body)
+
+        def _admin(self, method, url):
+            if url.path == "/_fake/stats":
+                return self._send(200, db.snapshot())
+            if url.path == "/_fake/reset" and method == "POST":
+                with db.lock:
+                    db.reset_stats()
+                if dict(parse_qsl(url.query)).get("data") == "1":
+                    db.clear()
+                return self._send(200, {"ok": True})
+            return self._send(404, {"message": "not found"})
+
+        def do_GET(self): self._dispatch("GET")
+        def do_HEAD(self): self._dispatch("HEAD")
+        def do_POST(self): self._dispatch("POST")
+        def do_PATCH(self): self._dispatch("PATCH")
+        def do_DELETE(self): self._dispatch("DELETE")
+
+    return Handler
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The async Supabase client opens its whole connection pool at once; the default
+    # listen backlog of 5 would drop those SYNs and add seconds of retransmit delay
+    request_queue_size = 1024
+
+
+def start_fake_postgrest(db=None, host="127.0.0.1", port=0, latency_ms=0):
+    """ Start the fake in a daemon thread and return (server, base_url, db) """
+    db = db or FakeDatabase()
+    server = FakeServer((host, port), make_handler(db, latency_ms / 1000.0))
+    threading.Thread(target=server.serve_forever, name="fake-postgrest", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}", db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local PostgREST-compatible Supabase stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0, help="artificial delay added to every call")
+    args = parser.parse_args()
+
+    server, url, _ = start_fake_postgrest(host=args.host, port=args.port, latency_ms=args.latency_ms)
+    print(f"Fake PostgREST listening on {url} (SUPABASE_KEY={FAKE_KEY})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,280 @@
+"""
+Synthetic institution generator for AttendX scale testing.
+
+Builds a realistic institution - departments, semesters, sections, subjects,
+teachers, students and several academic terms of sessions and attendance - and
+bulk-loads it into one of:
+
+  copy  CSV files plus a load.sql that uses \\copy, the fastest way into
+        Postgres/Supabase:   psql "$DATABASE_URL" -f out/load.sql
+  rest  chunked bulk inserts through the PostgREST API, e.g. the local
+        fake_postgrest.py server or a Supabase project (SUPABASE_URL/KEY)
+
+Attendance is not uniform: every student gets a personal attendance propensity
+drawn from a Beta distribution (typical turnout ~80%, with a long tail of
+chronic absentees), absences cluster into streaks, and turnout dips late in the
+week and rises before exams.
+
+    python generate_synthetic_data.py --students 20000 --records 2000000 --target copy --out synthetic/
+    python generate_synthetic_data.py --students 500 --records 50000 --target rest --url http://127.0.0.1:54321
+"""
+
+import argparse, csv, os, random, sys, time
+from datetime import date, timedelta
+
+DEPARTMENTS = ["CSE", "ECE", "EEE", "MECH", "CIVIL", "IT", "AIDS", "BIO"]
+SECTIONS = ["A", "B", "C", "D"]
+SUBJECT_WORDS = ["Data Structures", "Algorithms", "Operating Systems", "Networks", "Databases",
+                 "Signals", "Thermodynamics", "Mechanics", "Circuits", "Mathematics", "Physics",
+                 "Chemistry", "Machine Learning", "Compilers", "Control Systems", "Electronics",
+                 "Structures", "Surveying", "Genetics", "Statistics"]
+FIRST_NAMES = ["Aarav", "Diya", "Rohan", "Ananya", "Vikram", "Meera", "Arjun", "Kavya", "Rahul", "Sneha",
+               "Karthik", "Priya", "Aditya", "Nisha", "Siddharth", "Pooja", "Varun", "Isha", "Manoj", "Lakshmi",
+               "Joseph", "Fatima", "Daniel", "Aisha", "Samuel", "Maria", "Arun", "Divya", "Nikhil", "Riya"]
+LAST_NAMES = ["Sharma", "Nair", "Reddy", "Iyer", "Menon", "Patel", "Kumar", "Das", "Singh", "Thomas",
+              "Pillai", "Rao", "Gupta", "Joshi", "Varghese", "Khan", "Bose", "Mehta", "George", "Krishnan"]
+
+TABLE_COLUMNS = {
+    "users": ["sid", "name", "password", "role", "status", "department", "semester", "section"],
+    "subjects": ["subject_id", "subject_name", "class_name", "department", "semester", "section", "added_by"],
+    "attendance_sessions": ["session_id", "teacher_id", "subject_id", "subject", "session_date",
+                            "session_name", "start_time", "end_time", "active"],
+    "attendance_records": ["record_id", "session_id", "sid", "name", "subject_id", "subject", "date",
+                           "time", "status", "marked_type", "marked_by"],
+}
+IDENTITY_COLUMNS = {"subjects": "subject_id", "attendance_sessions": "session_id",
+                    "attendance_records": "record_id"}
+
+
+class Institution:
+    """ Deterministic (seeded) generator that streams rows table by table """
+
+    def __init__(self, students, records, terms, subjects_per_class, first_term, password, seed):
+        self.rng = random.Random(seed)
+        self.password = password
+        self.terms = terms
+        self.first_term = first_term
+        self.subjects_per_class = subjects_per_class
+
+        # Enough classes that sections hold ~60 students, spread over departments and semesters
+        class_count = max(1, students // 60)
+        self.classes = []
+        for i in range(class_count):
+            dept = DEPARTMENTS[i % len(DEPARTMENTS)]
+            sem = str((i // len(DEPARTMENTS)) % 8 + 1)
+            sec = SECTIONS[(i // (len(DEPARTMENTS) * 8)) % len(SECTIONS)]
+            self.classes.append((dept, sem, sec))
+        self.classes = sorted(set(self.classes))
+
+        self.students = []          # (sid, name, class, propensity)
+        for i in range(students):
+            klass = self.classes[i % len(self.classes)]
+            propensity = self.rng.betavariate(9, 1.2)
+            if self.rng.random() < 0.04:             # chronic absentees
+                propensity *= self.rng.uniform(0.3, 0.7)
+            self.students.append((f"S{24000000 + i}", self._name(), klass, propensity))
+
+        self.teachers = [(f"T-{dept}-{n:02d}", "Prof. " + self._name(), dept)
+                         for dept in DEPARTMENTS for n in range(max(2, class_count // len(DEPARTMENTS)))]
+
+        subject_count = len(self.classes) * subjects_per_class
+        per_subject = records / max(1, subject_count) / max(1, students / len(self.classes))
+        self.sessions_per_term = max(1, round(per_subject / terms))
+
+    def _name(self):
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def users(self):
+        yield {"sid": "admin", "name": "Administrator", "password": "admin123", "role": "admin",
+               "status": "approved", "department": "General", "semester": "1", "section": "A"}
+        for sid, name, dept in self.teachers:
+            yield {"sid": sid, "name": name, "password": self.password, "role": "teacher",
+                   "status": "approved", "department": dept, "semester": "1", "section": "A"}
+        for sid, name, (dept, sem, sec), _ in self.students:
+            status = "approved" if self.rng.random() > 0.002 else "pending"
+            yield {"sid": sid, "name": name, "password": self.password, "role": "student",
+                   "status": status, "department": dept, "semester": sem, "section": sec}
+
+    def subjects(self):
+        subject_id = 0
+        self.subject_rows = []
+        for dept, sem, sec in self.classes:
+            words = self.rng.sample(SUBJECT_WORDS, self.subjects_per_class)
+            for word in words:
+                subject_id += 1
+                teacher = self.rng.choice([t for t in self.teachers if t[2] == dept])
+                row = {"subject_id": subject_id, "subject_name": f"{word} {sem}{sec}",
+                       "class_name": f"{dept}-{sem}{sec}", "department": dept, "semester": sem,
+                       "section": sec, "added_by": "admin"}
+                self.subject_rows.append((row, teacher[0]))
+                yield row
+
+    def sessions_and_records(self):
+        """ Yields ("attendance_sessions", row) and ("attendance_records", row) in load order """
+        roster = {}
+        for student in self.students:
+            roster.setdefault(student[2], []).append(student)
+
+        session_id = record_id = 0
+        for term in range(self.terms):
+            term_start = self.first_term + timedelta(weeks=26 * term)
+            for subject, teacher_id in self.subject_rows:
+                klass = (subject["department"], subject["semester"], subject["section"])
+                streak = {}
+                for n in range(self.sessions_per_term):
+                    # Spread the term's sessions over 16 teaching weeks, Monday to Friday
+                    day = term_start + timedelta(days=int(n * 112 / self.sessions_per_term))
+                    while day.weekday() >= 5:
+                        day += timedelta(days=1)
+                    hour = 9 + self.rng.randrange(7)
+                    session_id += 1
+                    yield "attendance_sessions", {
+                        "session_id": session_id, "teacher_id": teacher_id,
+                        "subject_id": subject["subject_id"], "subject": subject["subject_name"],
+                        "session_date": day.isoformat(), "session_name": f"Lecture {n + 1}",
+                        "start_time": f"{day.isoformat()}T{hour:02d}:00:00",
+                        "end_time": f"{day.isoformat()}T{hour:02d}:50:00", "active": False,
+                    }
+
+                    # Fridays are emptier, the last two weeks before exams are fuller
+                    day_factor = 0.93 if day.weekday() == 4 else 1.0
+                    if n >= self.sessions_per_term * 0.85:
+                        day_factor *= 1.05
+                    for sid, name, _, propensity in roster.get(klass, []):
+                        # Absences come in streaks: an absent student is likely to stay away
+                        chance = propensity * day_factor * (0.55 if streak.get(sid) else 1.0)
+                        present = self.rng.random() < min(chance, 0.995)
+                        streak[sid] = not present
+                        manual = self.rng.random() < 0.02
+                        record_id += 1
+                        yield "attendance_records", {
+                            "record_id": record_id, "session_id": session_id, "sid": sid, "name": name,
+                            "subject_id": subject["subject_id"], "subject": subject["subject_name"],
+                            "date": day.strftime("%d-%m-%Y"),
+                            "time": f"{hour:02d}:{self.rng.randrange(12):02d}:{self.rng.randrange(60):02d}"
+                                    if present else f"{hour:02d}:50:00",
+                            "status": "present" if present else "absent",
+                            "marked_type": "manual" if manual else ("qr" if present else "auto"),
+                            "marked_by": teacher_id if manual else None,
+                        }
+
+
+# ---------------- LOADERS ----------------
+def load_copy(institution, out_dir):
+    """ Write one CSV per table and a psql script that \\copy-loads them """
+    os.makedirs(out_dir, exist_ok=True)
+    files, writers, counts = {}, {}, {}
+    for table, columns in TABLE_COLUMNS.items():
+        files[table] = open(os.path.join(out_dir, f"{table}.csv"), "w", newline="", encoding="utf-8")
+        writers[table] = csv.DictWriter(files[table], fieldnames=columns, extrasaction="ignore")
+        writers[table].writeheader()
+        counts[table] = 0
+
+    def write(table, row):
+        writers[table].writerow(row)
+        counts[table] += 1
+
+    for row in institution.users():
+        write("users", row)
+    for row in institution.subjects():
+        write("subjects", row)
+    for table, row in institution.sessions_and_records():
+        write(table, row)
+    for f in files.values():
+        f.close()
+
+    with open(os.path.join(out_dir, "load.sql"), "w", encoding="utf-8") as f:
+        f.write("-- Generated by generate_synthetic_data.py; run with: psql \"$DATABASE_URL\" -f load.sql\n")
+        f.write("BEGIN;\n")
+        # History needs no roster change log (migrate_roster_changes.sql); skip the per-row trigger
+        f.write("ALTER TABLE attendance_records DISABLE TRIGGER USER;\n")
+        for table, columns in TABLE_COLUMNS.items():
+            f.write(f"\\copy {table} ({', '.join(columns)}) FROM '{table}.csv' WITH (FORMAT csv, HEADER true)\n")
+        f.write("ALTER TABLE attendance_records ENABLE TRIGGER USER;\n")
+        for table, column in IDENTITY_COLUMNS.items():
+            f.write(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                    f"COALESCE((SELECT MAX({column}) FROM {table}), 1));\n")
+        f.write("COMMIT;\nANALYZE;\n")
+    return counts
+
+
+def load_rest(institution, url, key, chunk_size):
+    """ Upsert rows through PostgREST in chunks (one HTTP request per chunk) """
+    from supabase import create_client
+    client = create_client(url, key)
+    counts, buffers = {}, {}
+
+    def flush(table):
+        rows = buffers.get(table)
+        if rows:
+            client.table(table).upsert(rows, returning="minimal").execute()
+            buffers[table] = []
+
+    def write(table, row):
+        buffers.setdefault(table, []).append({k: row[k] for k in TABLE_COLUMNS[table]})
+        counts[table] = counts.get(table, 0) + 1
+        if len(buffers[table]) >= chunk_size:
+            if table == "attendance_records":
+                flush("attendance_sessions")     # records reference their session
+            flush(table)
+
+    for row in institution.users():
+        write("users", row)
+    flush("users")
+    for row in institution.subjects():
+        write("subjects", row)
+    flush("subjects")
+    for table, row in institution.sessions_and_records():
+        write(table, row)
+    flush("attendance_sessions")
+    flush("attendance_records")
+    try:
+        # The change-log trigger fired for every historical record; only live sessions need it
+        client.table("attendance_changes").delete().gte("seq", 0).execute()
+    except Exception as e:
+        print(f"Change log cleanup skipped: {e}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic institution for AttendX scale tests")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--records", type=int, default=200000, help="approximate attendance rows to create")
+    parser.add_argument("--terms", type=int, default=4, help="academic terms of history")
+    parser.add_argument("--subjects-per-class", type=int, default=5)
+    parser.add_argument("--first-term", default="2024-07-01", help="start date of the oldest term")
+    parser.add_argument("--password", default="password", help="password for generated accounts")
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--target", choices=["copy", "rest"], default="copy")
+    parser.add_argument("--out", default="synthetic_data", help="output directory for --target copy")
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL"), help="PostgREST/Supabase URL for --target rest")
+    parser.add_argument("--key", default=os.environ.get("SUPABASE_KEY", "sb_fake_local_key"))
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    institution = Institution(args.students, args.records, args.terms, args.subjects_per_class,
+                              date.fromisoformat(args.first_term), args.password, args.seed)
+    print(f"Generating {len(institution.classes)} classes, {len(institution.students)} students, "
+          f"{institution.sessions_per_term} sessions per subject per term over {args.terms} terms...")
+
+    started = time.time()
+    if args.target == "copy":
+        counts = load_copy(institution, args.out)
+        print(f"Wrote CSVs and load.sql to {args.out}/")
+    else:
+        if not args.url:
+            print("ERROR: --url (or SUPABASE_URL) is required for --target rest")
+            return 1
+        counts = load_rest(institution, args.url, args.key, args.chunk_size)
+        print(f"Loaded into {args.url}")
+
+    elapsed = time.time() - started
+    for table, count in counts.items():
+        print(f"  {table}: {count:,} rows")
+    total = sum(counts.values())
+    print(f"Done in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)" if elapsed else "Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Background jobs for AttendX.
+
+Some work does not have to finish before the response: marking a stopped
+session's absentees, purging expired QR tokens, building a large export.
+Run inside the request it holds a gunicorn worker thread for seconds. Instead
+the route submits a job and returns, and JobRunner threads in every worker
+process pick it up:
+
+- jobs live in a SQLite WAL file (ATTENDX_JOBS_DB) shared by the workers on
+  the host, so queued work survives a restart;
+- submit(..., key=...) is idempotent while a job with the same key is queued
+  or running (e.g. one absentee job per session);
+- a running job holds a lease that every progress() call renews. A job whose
+  worker died is claimed again once the lease runs out, and a failed job is
+  retried with backoff, up to MAX_ATTEMPTS runs in all. Handlers must
+  therefore be safe to repeat;
+- finished jobs are kept JOB_KEEP seconds for their status page.
+
+Threads are started by start() (app.create_app() calls it in each serving
+process, under gunicorn from post_fork), never by submit():
+a job queued by a process that did not start them waits in the file for one
+that did. ATTENDX_JOB_WORKERS=0 starts no threads; run_pending() then drains
+the queue in the caller (scripts and verify_query_counts.py).
+"""
+
+import json, os, sqlite3, tempfile, threading, time, uuid
+
+JOBS_DB_PATH = os.environ.get("ATTENDX_JOBS_DB") or os.path.join(tempfile.gettempdir(), "attendx_jobs.db")
+JOB_WORKERS = int(os.environ.get("ATTENDX_JOB_WORKERS", 2))   # threads per worker process
+JOB_POLL = 1.0                # seconds an idle thread waits before looking for jobs another process queued
+JOB_LEASE = 120               # seconds a job may run without reporting progress before it is reclaimed
+JOB_KEEP = 24 * 3600          # seconds finished jobs stay visible
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 5               # seconds before the first retry; doubles with every attempt
+PURGE_EVERY = 600             # seconds between sweeps of old jobs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    job_key TEXT,
+    owner TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_live_key ON jobs (job_key) WHERE status IN ('queued', 'running');
+"""
+
+ACTIVE = ("queued", "running")
+
+
+class JobStore:
+    """ The job table, in a SQLite WAL file shared by every worker process on the host """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # Same per-thread, per-process connections as StateStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _decode(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['args'] = json.loads(job['args'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def submit(self, kind, args=None, owner=None, key=None):
+        """ Queue a job and return its id; the live job's id if one with this key is queued or running """
+        def work(conn):
+            if key is not None:
+                live = conn.execute("SELECT job_id FROM jobs WHERE job_key = ? AND status IN ('queued', 'running')",
+                                    (key,)).fetchone()
+                if live:
+                    return live[0]
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            conn.execute("INSERT INTO jobs (job_id, kind, args, job_key, owner, run_after, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (job_id, kind, json.dumps(args or {}), key, owner, now, now))
+            return job_id
+        return self._transaction(work)
+
+    def claim(self, kinds, lease=JOB_LEASE):
+        """ Take the oldest runnable job of these kinds (queued, or running on an expired lease), or None """
+        kinds = list(kinds)
+        if not kinds:
+            return None
+
+        def work(conn):
+            now = time.time()
+            while True:
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE kind IN ({', '.join('?' * len(kinds))}) AND "
+                    "((status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_until < ?)) "
+                    "ORDER BY run_after LIMIT 1", (*kinds, now, now)).fetchone()
+                if row is None:
+                    return None
+                if row['attempts'] >= MAX_ATTEMPTS:
+                    # Its last run died without reporting back
+                    conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                                 (row['error'] or "worker stopped while running the job", now, row['job_id']))
+                    continue
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                             "started_at = COALESCE(started_at, ?) WHERE job_id = ?",
+                             (now + lease, now, row['job_id']))
+                return self._decode(conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row['job_id'],)).fetchone())
+        return self._transaction(work)
+
+    def progress(self, job_id, fraction, message=None, lease=JOB_LEASE):
+        self._conn().execute(
+            "UPDATE jobs SET progress = ?, message = COALESCE(?, message), lease_until = ? "
+            "WHERE job_id = ? AND status = 'running'", (min(max(fraction, 0.0), 1.0), message, time.time() + lease, job_id))
+
+    def finish(self, job_id, result=None, message=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', progress = 1, message = COALESCE(?, message), result = ?, "
+            "error = NULL, lease_until = NULL, finished_at = ? WHERE job_id = ?",
+            (message, json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        """ Retry later with backoff, or give up after MAX_ATTEMPTS runs """
+        def work(conn):
+            row = conn.execute("SELECT attempts FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            now = time.time()
+            if row and row['attempts'] < MAX_ATTEMPTS:
+                conn.execute("UPDATE jobs SET status = 'queued', error = ?, lease_until = NULL, run_after = ? "
+                             "WHERE job_id = ?", (error, now + RETRY_DELAY * 2 ** (row['attempts'] - 1), job_id))
+            else:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, finished_at = ? "
+                             "WHERE job_id = ?", (error, now, job_id))
+        self._transaction(work)
+
+    def get(self, job_id):
+        return self._decode(self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def for_owner(self, owner, limit=10, active_only=False):
+        """ The owner's newest jobs first """
+        where = " AND status IN ('queued', 'running')" if active_only else ""
+        return [self._decode(row) for row in self._conn().execute(
+            f"SELECT * FROM jobs WHERE owner = ?{where} ORDER BY created_at DESC LIMIT ?", (owner, limit))]
+
+    def purge(self, older_than=JOB_KEEP):
+        """ Delete finished jobs older than `older_than` seconds; returns them """
+        cutoff = time.time() - older_than
+
+        def work(conn):
+            old = [self._decode(row) for row in conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))]
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+            return old
+        return self._transaction(work)
+
+
+class JobContext:
+    """ What a handler gets: the job's id and args, and a way to report progress """
+
+    def __init__(self, store, job):
+        self.store = store
+        self.job_id = job['job_id']
+        self.args = job['args']
+        self.attempt = job['attempts']
+
+    def progress(self, fraction, message=None):
+        """ Publish progress (0..1) and renew the lease """
+        self.store.progress(self.job_id, fraction, message)
+
+
+class JobRunner:
+    """ Threads that run queued jobs through their registered handlers """
+
+    def __init__(self, store, workers=JOB_WORKERS, poll=JOB_POLL):
+        self.store = store
+        self.workers = workers
+        self.poll = poll
+        self.handlers = {}
+        self._wake = threading.Event()
+        self._pid = None
+        self._last_purge = 0.0
+        self.on_purge = None           # called after every sweep with the jobs it purged (e.g. to delete files)
+
+    def register(self, kind, handler):
+        """ handler(JobContext) -> JSON-serializable result """
+        self.handlers[kind] = handler
+        return handler
+
+    def submit(self, kind, args=None, owner=None, key=None):
+        if kind not in self.handlers:
+            raise ValueError(f"no handler registered for job kind {kind!r}")
+        job_id = self.store.submit(kind, args, owner, key)
+        self._wake.set()
+        return job_id
+
+    def start(self):
+        # Threads do not survive a fork, so a preloaded gunicorn worker starts its own
+        if self._pid != os.getpid() and self.workers > 0:
+            self._pid = os.getpid()
+            for n in range(self.workers):
+                threading.Thread(target=self.run, name=f"attendx-jobs-{n}", daemon=True).start()
+        return self
+
+    def run(self):
+        while True:
+            try:
+                if not self.run_one():
+                    self._wake.wait(self.poll)
+                    self._wake.clear()
+                    self._maybe_purge()
+            except Exception as e:
+                # The job table itself failed (disk full, locked too long): keep the thread alive
+                print(f"Job runner error: {e}")
+                time.sleep(self.poll)
+
+    def run_one(self):
+        """ Run one runnable job in this thread; False if there was none """
+        job = self.store.claim(self.handlers)
+        if job is None:
+            return False
+        try:
+            result = self.handlers[job['kind']](JobContext(self.store, job))
+        except Exception as e:
+            print(f"Job {job['kind']} {job['job_id']} failed (attempt {job['attempts']}): {e}")
+            self.store.fail(job['job_id'], str(e))
+        else:
+            self.store.finish(job['job_id'], result)
+        return True
+
+    def run_pending(self):
+        """ Drain the runnable jobs in the calling thread; returns how many ran """
+        ran = 0
+        while self.run_one():
+            ran += 1
+        return ran
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._last_purge < PURGE_EVERY:
+            return
+        self._last_purge = time.monotonic()
+        purged = self.store.purge()
+        if self.on_purge:
+            self.on_purge(purged)
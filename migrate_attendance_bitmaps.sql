@@ -0,0 +1,55 @@
+-- Bitmap attendance storage (attendance_bitmaps.py)
+-- Each student gets a permanent, dense bit position; every finished session then
+-- carries its present / absent sets as two compressed bitmaps over those positions,
+-- next to the row-per-student attendance_records that stay the source of truth.
+
+-- 1. Dense student index. Bits are handed out once and never reused, so a bitmap
+--    written today still decodes after students leave.
+CREATE TABLE IF NOT EXISTS student_bits (
+    sid TEXT PRIMARY KEY,
+    bit INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE
+);
+
+-- 2. Per-session bitmaps (zlib + base64 of the little-endian bit string).
+--    NULL means "not built yet or out of date"; '' is a built, empty bitmap.
+ALTER TABLE attendance_sessions
+ADD COLUMN IF NOT EXISTS present_bits TEXT,
+ADD COLUMN IF NOT EXISTS absent_bits TEXT;
+
+-- 3. Any write to a session's records makes its bitmaps stale; readers rebuild them
+--    from attendance_records on demand. Same trigger as migrate_roster_changes.sql
+--    with the two columns reset in the counter UPDATE.
+CREATE OR REPLACE FUNCTION log_attendance_change() RETURNS TRIGGER AS $$
+DECLARE
+    rec attendance_records%ROWTYPE;
+    next_seq BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+
+    IF rec.session_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE attendance_sessions
+    SET change_seq = change_seq + 1, present_bits = NULL, absent_bits = NULL
+    WHERE session_id = rec.session_id
+    RETURNING change_seq INTO next_seq;
+
+    INSERT INTO attendance_changes (session_id, seq, sid, status, marked_type)
+    VALUES (
+        rec.session_id, next_seq, rec.sid,
+        CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE COALESCE(rec.status, 'present') END,
+        CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE rec.marked_type END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4. Same access as the other attendance tables (see fix_tokens_permissions.sql)
+ALTER TABLE public.student_bits DISABLE ROW LEVEL SECURITY;
+GRANT ALL ON TABLE public.student_bits TO anon, authenticated, service_role, postgres;
+GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO anon, authenticated, service_role, postgres;
@@ -0,0 +1,9 @@
+-- Offline classroom mode (classroom_sync.py)
+-- A laptop in classroom mode creates its sessions locally and pushes them later. Each
+-- carries a client_ref so a push that timed out can be repeated as an upsert without
+-- creating a second session. Online sessions leave it NULL, and NULLs never collide.
+ALTER TABLE attendance_sessions
+ADD COLUMN IF NOT EXISTS client_ref TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_sessions_client_ref
+ON attendance_sessions (client_ref);
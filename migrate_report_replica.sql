@@ -0,0 +1,92 @@
+-- Change tracking for the report replica (see report_replica.py)
+-- The replicator copies users, subjects and attendance_sessions by an updated_at
+-- watermark, so those rows get a timestamp that every UPDATE moves forward.
+-- attendance_records needs no new column: new rows are found by record_id, and
+-- in-place edits and deletes already bump their session's change_seq
+-- (migrate_roster_changes.sql), which moves the session's updated_at.
+
+-- 1. updated_at on the replicated tables
+ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+ALTER TABLE subjects ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+ALTER TABLE attendance_sessions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_touch_updated_at ON users;
+CREATE TRIGGER users_touch_updated_at
+BEFORE UPDATE ON users
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS subjects_touch_updated_at ON subjects;
+CREATE TRIGGER subjects_touch_updated_at
+BEFORE UPDATE ON subjects
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS attendance_sessions_touch_updated_at ON attendance_sessions;
+CREATE TRIGGER attendance_sessions_touch_updated_at
+BEFORE UPDATE ON attendance_sessions
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- 2. The watermark queries: "updated_at >= X ORDER BY updated_at"
+CREATE INDEX IF NOT EXISTS users_updated_at ON users (updated_at);
+CREATE INDEX IF NOT EXISTS subjects_updated_at ON subjects (updated_at);
+CREATE INDEX IF NOT EXISTS attendance_sessions_updated_at ON attendance_sessions (updated_at);
+
+-- 3. Term archives (migrate_term_archive.sql): give the sessions archive the new column and
+--    copy rows by column name from now on, so columns added after term_id still line up
+ALTER TABLE attendance_sessions_archive ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+
+CREATE OR REPLACE FUNCTION archive_term(p_term_id BIGINT) RETURNS BIGINT AS $$
+DECLARE
+    t terms%ROWTYPE;
+    moved BIGINT;
+    session_cols TEXT;
+    record_cols TEXT;
+BEGIN
+    SELECT * INTO t FROM terms WHERE term_id = p_term_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'term % does not exist', p_term_id;
+    END IF;
+    IF t.ends_on >= CURRENT_DATE THEN
+        RAISE EXCEPTION 'term % has not ended yet', t.name;
+    END IF;
+
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF attendance_sessions_archive FOR VALUES IN (%s)',
+                   'attendance_sessions_archive_' || p_term_id, p_term_id);
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF attendance_records_archive FOR VALUES IN (%s)',
+                   'attendance_records_archive_' || p_term_id, p_term_id);
+
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO session_cols
+    FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'attendance_sessions';
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO record_cols
+    FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'attendance_records';
+
+    CREATE TEMP TABLE term_sessions ON COMMIT DROP AS
+    SELECT session_id FROM attendance_sessions
+    WHERE active IS NOT TRUE
+      AND COALESCE(session_date, start_time::date) BETWEEN t.starts_on AND t.ends_on;
+
+    EXECUTE format('INSERT INTO attendance_sessions_archive (%s, term_id) SELECT %s, $1 FROM attendance_sessions '
+                   'WHERE session_id IN (SELECT session_id FROM term_sessions)', session_cols, session_cols)
+    USING p_term_id;
+
+    EXECUTE format('INSERT INTO attendance_records_archive (%s, term_id) SELECT %s, $1 FROM attendance_records '
+                   'WHERE session_id IN (SELECT session_id FROM term_sessions)', record_cols, record_cols)
+    USING p_term_id;
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    ALTER TABLE attendance_records DISABLE TRIGGER attendance_records_change_log;
+    DELETE FROM attendance_records WHERE session_id IN (SELECT session_id FROM term_sessions);
+    ALTER TABLE attendance_records ENABLE TRIGGER attendance_records_change_log;
+    DELETE FROM attendance_sessions WHERE session_id IN (SELECT session_id FROM term_sessions);
+
+    UPDATE terms SET archived = TRUE WHERE term_id = p_term_id;
+    DROP TABLE term_sessions;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
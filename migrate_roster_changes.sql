@@ -0,0 +1,78 @@
+-- Roster change feed for the teacher's live tracking panel
+-- Every write to attendance_records bumps a per-session sequence number and logs
+-- the new state of that student's row, so the panel can ask for "changes since N"
+-- instead of re-reading the whole session.
+
+-- 1. Per-session counter (also used as the roster version by /teacher/live)
+ALTER TABLE attendance_sessions
+ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0;
+
+-- 2. Change log: one row per write; status is NULL when the record was deleted (cleared)
+CREATE TABLE IF NOT EXISTS attendance_changes (
+    change_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    session_id BIGINT NOT NULL REFERENCES attendance_sessions(session_id) ON DELETE CASCADE,
+    seq BIGINT NOT NULL,
+    sid TEXT NOT NULL,
+    status TEXT,
+    marked_type TEXT,
+    changed_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE(session_id, seq)
+);
+
+-- 3. Row trigger on attendance_records
+-- The counter is taken with UPDATE ... RETURNING, which row-locks the session until the
+-- writing transaction commits. Sequence numbers therefore become visible in order and a
+-- reader that has seen seq N can never later miss a change numbered below N (a plain
+-- identity column would not guarantee that under concurrent scans).
+CREATE OR REPLACE FUNCTION log_attendance_change() RETURNS TRIGGER AS $$
+DECLARE
+    rec attendance_records%ROWTYPE;
+    next_seq BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+
+    IF rec.session_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE attendance_sessions SET change_seq = change_seq + 1
+    WHERE session_id = rec.session_id
+    RETURNING change_seq INTO next_seq;
+
+    INSERT INTO attendance_changes (session_id, seq, sid, status, marked_type)
+    VALUES (
+        rec.session_id, next_seq, rec.sid,
+        CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE COALESCE(rec.status, 'present') END,
+        CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE rec.marked_type END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS attendance_records_change_log ON attendance_records;
+CREATE TRIGGER attendance_records_change_log
+AFTER INSERT OR UPDATE OR DELETE ON attendance_records
+FOR EACH ROW EXECUTE FUNCTION log_attendance_change();
+
+-- 4. The log is only needed while a session is live; drop it when the session stops
+CREATE OR REPLACE FUNCTION prune_attendance_changes() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM attendance_changes WHERE session_id = NEW.session_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS attendance_sessions_prune_changes ON attendance_sessions;
+CREATE TRIGGER attendance_sessions_prune_changes
+AFTER UPDATE OF active ON attendance_sessions
+FOR EACH ROW WHEN (OLD.active AND NOT NEW.active)
+EXECUTE FUNCTION prune_attendance_changes();
+
+-- 5. Same access as the other attendance tables (see fix_tokens_permissions.sql)
+ALTER TABLE public.attendance_changes DISABLE ROW LEVEL SECURITY;
+GRANT ALL ON TABLE public.attendance_changes TO anon, authenticated, service_role, postgres;
+GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO anon, authenticated, service_role, postgres;
@@ -0,0 +1,18 @@
+-- Student search (student_search.py)
+-- The attendance view used to run ilike('%text%') over attendance_records, which
+-- cannot use a B-tree index. Searches now resolve to sids in the app and filter the
+-- records by sid; these indexes serve that filter and any search run in SQL.
+
+-- 1. Records of one or more students (the existing UNIQUE(session_id, sid) index
+--    leads with session_id, so it cannot serve sid = ... on its own)
+CREATE INDEX IF NOT EXISTS attendance_records_sid
+ON attendance_records (sid);
+
+-- 2. Trigram indexes for substring / fuzzy matching on users (ilike, %, similarity())
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS users_name_trgm
+ON users USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS users_sid_trgm
+ON users USING gin (sid gin_trgm_ops);
@@ -0,0 +1,106 @@
+-- Term-based archival of attendance data
+-- attendance_sessions / attendance_records only keep the terms that are still open;
+-- a closed term is moved into archive tables partitioned by term, so everyday pages
+-- and counts stop growing with every semester. The app reads the archives only when
+-- a report's date range reaches back into an archived term (see archived_terms_for()).
+
+-- 1. Academic terms
+CREATE TABLE IF NOT EXISTS terms (
+    term_id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    starts_on DATE NOT NULL,
+    ends_on DATE NOT NULL,
+    archived BOOLEAN NOT NULL DEFAULT FALSE,
+    CHECK (ends_on >= starts_on)
+);
+
+-- 2. Archives: the live tables' columns plus term_id, one list partition per term
+--    (created by archive_term). If the live tables gain columns later, add them here too.
+CREATE TABLE IF NOT EXISTS attendance_sessions_archive (
+    LIKE attendance_sessions INCLUDING DEFAULTS,
+    term_id BIGINT NOT NULL REFERENCES terms(term_id),
+    PRIMARY KEY (term_id, session_id)
+) PARTITION BY LIST (term_id);
+
+CREATE TABLE IF NOT EXISTS attendance_records_archive (
+    LIKE attendance_records INCLUDING DEFAULTS,
+    term_id BIGINT NOT NULL REFERENCES terms(term_id),
+    PRIMARY KEY (term_id, record_id)
+) PARTITION BY LIST (term_id);
+
+CREATE INDEX IF NOT EXISTS attendance_records_archive_sid
+ON attendance_records_archive (term_id, sid);
+
+CREATE INDEX IF NOT EXISTS attendance_records_archive_subject
+ON attendance_records_archive (term_id, subject_id);
+
+-- 3. Move one ended term. Sessions belong to the term their session_date falls in
+--    (start_time when it is missing); their records go with them. The change-log
+--    trigger is switched off for the move: deleting finished sessions' rows is not
+--    a roster change anyone is polling for.
+CREATE OR REPLACE FUNCTION archive_term(p_term_id BIGINT) RETURNS BIGINT AS $$
+DECLARE
+    t terms%ROWTYPE;
+    moved BIGINT;
+BEGIN
+    SELECT * INTO t FROM terms WHERE term_id = p_term_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'term % does not exist', p_term_id;
+    END IF;
+    IF t.ends_on >= CURRENT_DATE THEN
+        RAISE EXCEPTION 'term % has not ended yet', t.name;
+    END IF;
+
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF attendance_sessions_archive FOR VALUES IN (%s)',
+                   'attendance_sessions_archive_' || p_term_id, p_term_id);
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF attendance_records_archive FOR VALUES IN (%s)',
+                   'attendance_records_archive_' || p_term_id, p_term_id);
+
+    CREATE TEMP TABLE term_sessions ON COMMIT DROP AS
+    SELECT session_id FROM attendance_sessions
+    WHERE active IS NOT TRUE
+      AND COALESCE(session_date, start_time::date) BETWEEN t.starts_on AND t.ends_on;
+
+    INSERT INTO attendance_sessions_archive
+    SELECT s.*, p_term_id FROM attendance_sessions s
+    WHERE s.session_id IN (SELECT session_id FROM term_sessions);
+
+    INSERT INTO attendance_records_archive
+    SELECT r.*, p_term_id FROM attendance_records r
+    WHERE r.session_id IN (SELECT session_id FROM term_sessions);
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    ALTER TABLE attendance_records DISABLE TRIGGER attendance_records_change_log;
+    DELETE FROM attendance_records WHERE session_id IN (SELECT session_id FROM term_sessions);
+    ALTER TABLE attendance_records ENABLE TRIGGER attendance_records_change_log;
+    DELETE FROM attendance_sessions WHERE session_id IN (SELECT session_id FROM term_sessions);
+
+    UPDATE terms SET archived = TRUE WHERE term_id = p_term_id;
+    DROP TABLE term_sessions;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4. Archive every term that has ended (safe to re-run; schedule it with pg_cron if wanted:
+--    SELECT cron.schedule('archive-closed-terms', '0 3 * * *', 'SELECT archive_closed_terms()');)
+CREATE OR REPLACE FUNCTION archive_closed_terms() RETURNS BIGINT AS $$
+DECLARE
+    t RECORD;
+    moved BIGINT := 0;
+BEGIN
+    FOR t IN SELECT term_id FROM terms WHERE NOT archived AND ends_on < CURRENT_DATE ORDER BY starts_on LOOP
+        moved := moved + archive_term(t.term_id);
+    END LOOP;
+    RETURN moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 5. Same access as the other attendance tables (see fix_tokens_permissions.sql)
+ALTER TABLE public.terms DISABLE ROW LEVEL SECURITY;
+GRANT ALL ON TABLE public.terms TO anon, authenticated, service_role, postgres;
+GRANT SELECT ON TABLE public.attendance_sessions_archive TO anon, authenticated, service_role, postgres;
+GRANT SELECT ON TABLE public.attendance_records_archive TO anon, authenticated, service_role, postgres;
+GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO anon, authenticated, service_role, postgres;
+
+-- 6. Move the terms that are already closed
+SELECT archive_closed_terms();
@@ -0,0 +1,91 @@
+"""
+On-demand request profiler for AttendX.
+
+A sampling profiler that follows a single request thread and records its
+stacks in "folded" format (one `frame;frame;frame count` line per unique
+stack), which flamegraph.pl, speedscope and inferno all read directly.
+Finished profiles are kept in a small in-memory ring so admins can look at
+the last few slow requests without any external tooling.
+"""
+
+import sys, threading, time, itertools
+from collections import deque, Counter
+from datetime import datetime
+
+PROFILE_SAMPLE_INTERVAL = 0.002   # seconds between stack samples
+PROFILE_RING_SIZE = 20            # profiles kept in memory
+
+
+class RequestSampler:
+    """ Samples the stack of one thread from a background thread until stopped """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="attendx-profiler", daemon=True)
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            # Folded stacks are root-first, separated by ';'
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+class ProfileRing:
+    """ Thread-safe, bounded store of the most recent profiles """
+
+    def __init__(self, size=PROFILE_RING_SIZE):
+        self._profiles = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, sampler, method, path, status_code, user):
+        profile = {
+            'id': next(self._ids),
+            'method': method,
+            'path': path,
+            'status': status_code,
+            'user': user,
+            'captured_at': datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+            'duration_ms': round(sampler.duration * 1000, 1),
+            'samples': sampler.samples,
+            'folded': sampler.folded(),
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._profiles))
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((p for p in self._profiles if p['id'] == profile_id), None)
@@ -0,0 +1,138 @@
+"""
+Rate limits and admission control for AttendX.
+
+A lecture burst already sends every student's scan at once; students
+re-submitting a slow scan and scripts guessing passwords at /login (each guess
+a users query) used to pass straight through to Supabase on top of it. Two
+guards now sit in front of the routes that query the database:
+
+- token buckets, one per (endpoint, identity): the signed-in user, the sid
+  typed into the login form or the client address. A bucket holds up to
+  `burst` tokens and refills at `rate` tokens per second; a request takes
+  one or is refused with the seconds until the next one is due. The buckets
+  live in a SQLite WAL file (ATTENDX_RATE_DB) shared by the workers on the
+  host, so four workers do not mean four times the budget.
+  ATTENDX_RATE_STORE=memory keeps them in the process instead;
+- AdmissionGate, a cap on the requests a worker process runs at once. A
+  request over the cap is refused immediately rather than queued behind the
+  others, so a backlog never builds up in front of the database.
+
+Refused requests get 429 Too Many Requests with Retry-After (see app.py).
+"""
+
+import math, os, sqlite3, tempfile, threading, time
+
+RATE_DB_PATH = os.environ.get("ATTENDX_RATE_DB") or os.path.join(tempfile.gettempdir(), "attendx_rate.db")
+PURGE_EVERY = 1000            # takes between sweeps of idle buckets
+IDLE_AFTER = 3600             # seconds without a request after which a bucket is dropped (it is full again by then)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + (now - updated_at) * rate)
+
+
+def wait_for(tokens, rate, cost=1):
+    """ Seconds until a bucket holding `tokens` has `cost` of them """
+    return (cost - tokens) / rate if rate > 0 else math.inf
+
+
+class TokenBuckets:
+    """ Token buckets in a SQLite WAL file shared by every worker process on the host """
+
+    def __init__(self, path=RATE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _conn(self):
+        # Same per-thread, per-process connections as StateStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, cost=1):
+        """ Take `cost` tokens from bucket `key`; 0 if granted, else seconds until they would be """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill(*row, now, rate, burst) if row else burst
+            wait = 0.0 if tokens >= cost else wait_for(tokens, rate, cost)
+            if not wait:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._takes += 1
+        if self._takes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - IDLE_AFTER,))
+        return wait
+
+    def clear(self):
+        """ Refill every bucket (tests and benchmarks start from an empty store) """
+        self._conn().execute("DELETE FROM buckets")
+
+
+class LocalTokenBuckets:
+    """ The same buckets in a dict, for a single process """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            wait = 0.0 if tokens >= cost else wait_for(tokens, rate, cost)
+            if not wait:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._takes += 1
+            if self._takes % PURGE_EVERY == 0:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[1] >= now - IDLE_AFTER}
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class AdmissionGate:
+    """ At most `limit` requests inside at once in this process; the rest are turned away, not queued """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inside = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self):
+        with self._lock:
+            if self.inside >= self.limit:
+                return False
+            self.inside += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.inside = max(0, self.inside - 1)
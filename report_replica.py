@@ -0,0 +1,425 @@
+"""
+Local analytical replica for AttendX reports (ATTENDX_REPORT_REPLICA=1).
+
+The report pages (/admin/reports, the teacher and admin attendance view and
+/export) download and aggregate whole tables, which is the heaviest read
+traffic Supabase sees. With the replica enabled, Replicator copies
+attendance_records, attendance_sessions, users and subjects into a SQLite file
+on this host, and those routes run their joins and GROUP BYs there instead:
+
+- users, subjects and attendance_sessions are copied by an updated_at
+  watermark (migrate_report_replica.sql). Each pass re-reads
+  WATERMARK_OVERLAP seconds behind it, so a transaction that committed after
+  a later one was copied is not skipped;
+- attendance_records are copied by a record_id watermark. Every insert, edit
+  or delete of a record bumps its session's change_seq, so a session whose
+  change_seq moved by more than the records newly copied for it is re-read in
+  full (which also picks up a record whose id was handed out early but
+  committed late);
+- deleted users and subjects, and sessions moved out by term archival, are
+  found by comparing primary keys every RECONCILE_EVERY passes.
+
+One worker per host replicates at a time (a state store claim); all workers
+read the same WAL file. Report pages show how far behind the replica is and
+fall back to Supabase when it is more than ATTENDX_REPLICA_MAX_LAG seconds old.
+"""
+
+import os, sqlite3, tempfile, threading, time
+from collections import Counter
+from datetime import datetime, timedelta
+
+REPLICA_DB_PATH = os.environ.get("ATTENDX_REPLICA_DB") or os.path.join(tempfile.gettempdir(), "attendx_replica.db")
+REPLICA_INTERVAL = float(os.environ.get("ATTENDX_REPLICA_INTERVAL", 30))   # seconds between passes
+REPLICA_MAX_LAG = float(os.environ.get("ATTENDX_REPLICA_MAX_LAG", 300))    # seconds; staler replicas are not read
+REPLICA_MAX_BACKOFF = 300     # seconds; ceiling for the retry delay after failed passes
+REPLICA_LOCK_TTL = 600        # seconds one worker may hold the replication lock (a first copy is long)
+PAGE_SIZE = 1000              # rows per request, PostgREST's default max-rows
+WATERMARK_OVERLAP = 60        # seconds re-read behind an updated_at watermark
+RECONCILE_EVERY = 10          # passes between primary key comparisons
+RESYNC_BATCH = 50             # sessions whose records are re-read per request
+SQL_BATCH = 500               # keys per IN (...) list on the SQLite side
+
+# table -> (primary key, watermark column, replicated columns)
+TABLES = {
+    "users": ("sid", "updated_at",
+              ("sid", "name", "role", "status", "department", "semester", "section", "updated_at")),
+    "subjects": ("subject_id", "updated_at",
+                 ("subject_id", "subject_name", "class_name", "department", "semester", "section", "added_by",
+                  "updated_at")),
+    "attendance_sessions": ("session_id", "updated_at",
+                            ("session_id", "teacher_id", "subject_id", "subject", "session_date", "session_name",
+                             "start_time", "end_time", "active", "change_seq", "updated_at")),
+    "attendance_records": ("record_id", "record_id",
+                           ("record_id", "session_id", "sid", "name", "subject_id", "subject", "date", "time",
+                            "status", "marked_type", "marked_by")),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    sid TEXT PRIMARY KEY,
+    name TEXT,
+    role TEXT,
+    status TEXT,
+    department TEXT,
+    semester TEXT,
+    section TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS subjects (
+    subject_id INTEGER PRIMARY KEY,
+    subject_name TEXT,
+    class_name TEXT,
+    department TEXT,
+    semester TEXT,
+    section TEXT,
+    added_by TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS attendance_sessions (
+    session_id INTEGER PRIMARY KEY,
+    teacher_id TEXT,
+    subject_id INTEGER,
+    subject TEXT,
+    session_date TEXT,
+    session_name TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    active INTEGER,
+    change_seq INTEGER,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS attendance_records (
+    record_id INTEGER PRIMARY KEY,
+    session_id INTEGER,
+    sid TEXT,
+    name TEXT,
+    subject_id INTEGER,
+    subject TEXT,
+    date TEXT,
+    time TEXT,
+    status TEXT,
+    marked_type TEXT,
+    marked_by TEXT
+);
+CREATE INDEX IF NOT EXISTS records_session ON attendance_records (session_id);
+CREATE INDEX IF NOT EXISTS records_sid ON attendance_records (sid);
+CREATE INDEX IF NOT EXISTS records_subject_date ON attendance_records (subject_id, date);
+CREATE INDEX IF NOT EXISTS records_date ON attendance_records (date, time);
+CREATE TABLE IF NOT EXISTS replica_meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ReportReplica:
+    """ The replicated tables in a SQLite WAL file shared by the workers on this host """
+
+    def __init__(self, path=REPLICA_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # Same per-thread, per-process connections as StateStore
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _transaction(self, work):
+        """ Run `work(conn)` in one write transaction; the data version moves if it changed any row """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            result = work(conn)
+            if conn.total_changes != before:
+                conn.execute("INSERT INTO replica_meta (key, value) VALUES ('data_version', 1) "
+                             "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------------- REPLICATION STATE ----------------
+    def meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM replica_meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None or row[0] is None else row[0]
+
+    def set_meta(self, key, value):
+        self._conn().execute("INSERT INTO replica_meta (key, value) VALUES (?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def lag(self):
+        """ Seconds since the start of the last completed pass (None before the first one) """
+        synced_at = self.meta("synced_at")
+        return None if synced_at is None else max(0.0, time.time() - synced_at)
+
+    def version(self):
+        """ Data version for report ETags; also moves with every pass, so a cached page's lag note stays current """
+        return f"replica.{self.meta('data_version', 0)}.{self.meta('passes', 0)}"
+
+    # ---------------- WRITES (replicator) ----------------
+    def apply(self, table, rows):
+        """ Upsert rows; rows identical to the stored copy are left alone """
+        if not rows:
+            return
+        pk, _, columns = TABLES[table]
+        others = [c for c in columns if c != pk]
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT({pk}) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in others)} "
+               f"WHERE ({', '.join(others)}) IS NOT ({', '.join(f'excluded.{c}' for c in others)})")
+        values = [tuple(row.get(c) for c in columns) for row in rows]
+        self._transaction(lambda conn: conn.executemany(sql, values))
+
+    def existing(self, table, keys):
+        """ The subset of `keys` already in the replica """
+        pk = TABLES[table][0]
+        found = set()
+        for chunk in _chunks(keys, SQL_BATCH):
+            found.update(row[0] for row in self._conn().execute(
+                f"SELECT {pk} FROM {table} WHERE {pk} IN ({', '.join('?' * len(chunk))})", chunk))
+        return found
+
+    def change_seqs(self, session_ids):
+        seqs = {}
+        for chunk in _chunks(session_ids, SQL_BATCH):
+            seqs.update((row[0], row[1]) for row in self._conn().execute(
+                f"SELECT session_id, change_seq FROM attendance_sessions WHERE session_id IN "
+                f"({', '.join('?' * len(chunk))})", chunk))
+        return seqs
+
+    def set_change_seqs(self, seqs):
+        """ Record how many of a session's changes the replica already holds """
+        if seqs:
+            self._transaction(lambda conn: conn.executemany(
+                "UPDATE attendance_sessions SET change_seq = ? WHERE session_id = ?",
+                [(seq, session_id) for session_id, seq in seqs.items()]))
+
+    def replace_session_records(self, session_ids, rows):
+        """ Make the records of these sessions exactly `rows` """
+        columns = TABLES["attendance_records"][2]
+        keep = {row['record_id'] for row in rows}
+
+        def work(conn):
+            placeholders = ', '.join('?' * len(session_ids))
+            stale = [r[0] for r in conn.execute(
+                f"SELECT record_id FROM attendance_records WHERE session_id IN ({placeholders})", list(session_ids))
+                if r[0] not in keep]
+            for chunk in _chunks(stale, SQL_BATCH):
+                conn.execute(f"DELETE FROM attendance_records WHERE record_id IN ({', '.join('?' * len(chunk))})",
+                             chunk)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO attendance_records ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})", [tuple(row.get(c) for c in columns) for row in rows])
+        self._transaction(work)
+
+    def keep_only(self, table, keys):
+        """ Delete the rows whose primary key is not in `keys` (sessions take their records along) """
+        pk = TABLES[table][0]
+        keys = set(keys)
+
+        def work(conn):
+            gone = [r[0] for r in conn.execute(f"SELECT {pk} FROM {table}") if r[0] not in keys]
+            for chunk in _chunks(gone, SQL_BATCH):
+                placeholders = ', '.join('?' * len(chunk))
+                conn.execute(f"DELETE FROM {table} WHERE {pk} IN ({placeholders})", chunk)
+                if table == "attendance_sessions":
+                    conn.execute(f"DELETE FROM attendance_records WHERE session_id IN ({placeholders})", chunk)
+            return len(gone)
+        return self._transaction(work)
+
+    # ---------------- REPORT QUERIES ----------------
+    def _query(self, sql, params=()):
+        return [dict(row) for row in self._conn().execute(sql, params)]
+
+    def _where(self, sid=None, subject_id=None, from_date=None, to_date=None, sids=None, name_like=None, name=None):
+        clauses, params = [], []
+        if sid:
+            clauses.append("sid = ?")
+            params.append(sid)
+        if subject_id:
+            clauses.append("subject_id = ?")
+            params.append(subject_id)
+        if from_date:
+            clauses.append("date >= ?")
+            params.append(from_date)
+        if to_date:
+            clauses.append("date <= ?")
+            params.append(to_date)
+        if sids is not None:
+            clauses.append(f"sid IN ({', '.join('?' * len(sids))})")
+            params.extend(sids)
+        if name_like:
+            clauses.append("name LIKE ?")       # case-insensitive for ASCII, like ilike
+            params.append(f"%{name_like}%")
+        if name:
+            clauses.append("LOWER(name) = LOWER(?)")     # the whole name, ignoring case
+            params.append(name)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def records(self, order="date DESC, time DESC, record_id", **filters):
+        """ attendance_records rows matching the attendance view's filters """
+        where, params = self._where(**filters)
+        return self._query(f"SELECT * FROM attendance_records{where} ORDER BY {order}", params)
+
+    def count(self, table):
+        return self._query(f"SELECT COUNT(*) AS n FROM {table}")[0]['n']
+
+    def attendance_summary(self, **filters):
+        """ Present / total per (student, subject) over the matching records """
+        where, params = self._where(**filters)
+        return self._query(
+            "SELECT sid, MAX(name) AS name, COALESCE(MAX(subject), 'N/A') AS subject, subject_id, "
+            "SUM(COALESCE(status, 'present') = 'present') AS present, COUNT(*) AS total "
+            f"FROM attendance_records{where} GROUP BY sid, subject_id", params)
+
+    def records_with_roles(self):
+        """ Every record, newest first, with the role of the user it belongs to """
+        return self._query(
+            "SELECT r.*, COALESCE(u.role, 'Unknown') AS role FROM attendance_records r "
+            "LEFT JOIN users u ON u.sid = TRIM(r.sid) ORDER BY r.record_id DESC")
+
+
+class Replicator:
+    """ Background thread that copies Supabase changes into the ReportReplica; one worker at a time """
+
+    def __init__(self, replica, client, state, interval=REPLICA_INTERVAL):
+        self.replica = replica
+        self.client = client
+        self.state = state
+        self.interval = interval
+        self._pid = None
+
+    def start(self):
+        # Called by app.create_app() in each serving process (under gunicorn from post_fork in
+        # the worker, never in the preloading master); a second call in one process is a no-op
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self.run, name="attendx-report-replica", daemon=True).start()
+        return self
+
+    def run(self):
+        delay, failures = 0, 0
+        while True:
+            time.sleep(delay)
+            delay = self.interval
+            lag = self.replica.lag()
+            if lag is not None and lag < self.interval / 2:
+                continue    # another worker just finished a pass
+            if not self.state.claim("report_replica", ttl=REPLICA_LOCK_TTL):
+                continue
+            try:
+                self.sync_once()
+                failures = 0
+            except Exception as e:
+                print(f"Report replica error: {e}")
+                failures += 1
+                delay = min(self.interval * 2 ** failures, REPLICA_MAX_BACKOFF)
+            finally:
+                self.state.delete("report_replica")
+
+    def sync_once(self):
+        """ One replication pass; raises if Supabase cannot be reached (the replica then just ages) """
+        if not self.client:
+            raise ConnectionError("Supabase is not configured")
+        started = time.time()
+        passes = int(self.replica.meta("passes", 0))
+
+        self.copy_changed("users")
+        self.copy_changed("subjects")
+        sessions = self.copy_changed("attendance_sessions")
+        new_per_session = self.copy_new_records()
+        stale, accounted = [], {}
+        for session, old_seq in sessions:
+            if session.get('change_seq') is None:
+                continue    # migrate_roster_changes.sql not applied: only new records are copied
+            expected = (old_seq or 0) + new_per_session[session['session_id']]
+            if session['change_seq'] > expected:
+                stale.append(session['session_id'])        # edited, cleared, or a record committed out of id order
+            elif session['change_seq'] < expected:
+                accounted[session['session_id']] = expected  # records written after the session row was read
+        self.replica.set_change_seqs(accounted)
+        for chunk in _chunks(stale, RESYNC_BATCH):
+            self.replica.replace_session_records(chunk, self._fetch_all(
+                lambda q: q.in_("session_id", chunk), "attendance_records", "record_id"))
+
+        if passes % RECONCILE_EVERY == 0:
+            for table in ("users", "subjects", "attendance_sessions"):
+                self.reconcile(table)
+        self.replica.set_meta("passes", passes + 1)
+        self.replica.set_meta("synced_at", started)
+
+    def _fetch_all(self, narrow, table, order, select=None):
+        """ Every row of `narrow(query)`, PAGE_SIZE rows per request """
+        rows, offset = [], 0
+        while True:
+            query = narrow(self.client.table(table).select(select or ", ".join(TABLES[table][2])))
+            if order != TABLES[table][0]:
+                query = query.order(order)
+            page = query.order(TABLES[table][0]).range(offset, offset + PAGE_SIZE - 1).execute().data
+            rows += page
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    def copy_changed(self, table):
+        """ Copy rows updated since the table's watermark; returns [(row, previous change_seq)] for sessions """
+        watermark = self.replica.meta(f"watermark:{table}")
+        since = None
+        if watermark:
+            since = (datetime.fromisoformat(watermark) - timedelta(seconds=WATERMARK_OVERLAP)).isoformat()
+        rows = self._fetch_all(lambda q: q.gte("updated_at", since) if since else q, table, "updated_at")
+        if not rows:
+            return []
+        previous = self.replica.change_seqs([r['session_id'] for r in rows]) if table == "attendance_sessions" else {}
+        self.replica.apply(table, rows)
+        self.replica.set_meta(f"watermark:{table}", rows[-1]['updated_at'])
+        return [(row, previous.get(row['session_id'])) for row in rows] if table == "attendance_sessions" else []
+
+    def copy_new_records(self):
+        """ Copy records past the record_id watermark; returns how many were new to the replica per session """
+        watermark = int(self.replica.meta("watermark:attendance_records", 0))
+        columns = ", ".join(TABLES["attendance_records"][2])
+        new_per_session = Counter()
+        while True:
+            page = self.client.table("attendance_records").select(columns).gt("record_id", watermark) \
+                .order("record_id").limit(PAGE_SIZE).execute().data
+            if not page:
+                break
+            known = self.replica.existing("attendance_records", [r['record_id'] for r in page])
+            new_per_session.update(r['session_id'] for r in page if r['record_id'] not in known)
+            self.replica.apply("attendance_records", page)
+            watermark = page[-1]['record_id']
+            self.replica.set_meta("watermark:attendance_records", watermark)
+            if len(page) < PAGE_SIZE:
+                break
+        return new_per_session
+
+    def reconcile(self, table):
+        """ Drop replica rows that no longer exist in Supabase """
+        pk = TABLES[table][0]
+        keys, last = [], None
+        while True:
+            query = self.client.table(table).select(pk)
+            if last is not None:
+                query = query.gt(pk, last)
+            page = query.order(pk).limit(PAGE_SIZE).execute().data
+            keys += [r[pk] for r in page]
+            if len(page) < PAGE_SIZE:
+                break
+            last = page[-1][pk]
+        return self.replica.keep_only(table, keys)
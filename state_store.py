@@ -0,0 +1,102 @@
+"""
+Host-local shared state for AttendX workers.
+
+gunicorn runs several worker processes, so anything kept in a Python dict is
+invisible to the other workers. This store keeps that state in one SQLite file
+in WAL mode instead: readers never block the single writer, every worker on the
+host sees the same values, and a process restart loses nothing that matters.
+Values are JSON (or raw bytes for blobs such as the QR image) with an optional
+expiry; `claim()` is a cross-process try-lock and `incr()` an atomic counter.
+
+It is deliberately host-local. Several hosts still agree through Supabase,
+which stays the source of truth; the store only saves round trips to it.
+"""
+
+import json, os, sqlite3, tempfile, threading, time
+
+STATE_DB_PATH = os.environ.get("ATTENDX_STATE_DB") or os.path.join(tempfile.gettempdir(), "attendx_state.db")
+PURGE_EVERY = 500     # writes between sweeps of expired keys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value BLOB,
+    is_json INTEGER NOT NULL DEFAULT 1,
+    expires_at REAL
+)
+"""
+
+
+class StateStore:
+    """ Key/value store in a SQLite WAL file shared by every worker process on the host """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        # One connection per thread and per process: connections must not cross a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _write(self, sql, params):
+        conn = self._conn()
+        cursor = conn.execute(sql, params)
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        return cursor
+
+    def get(self, key, default=None):
+        row = self._conn().execute(
+            "SELECT value, is_json FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (key, time.time())).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0]) if row[1] else row[0]
+
+    def set(self, key, value, ttl=None):
+        self._put(key, json.dumps(value), 1, ttl)
+
+    def set_blob(self, key, data, ttl=None):
+        self._put(key, sqlite3.Binary(data), 0, ttl)
+
+    def _put(self, key, value, is_json, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        self._write("INSERT INTO state (key, value, is_json, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, is_json = excluded.is_json, "
+                    "expires_at = excluded.expires_at", (key, value, is_json, expires_at))
+
+    def delete(self, *keys):
+        for key in keys:
+            self._write("DELETE FROM state WHERE key = ?", (key,))
+
+    def claim(self, key, ttl):
+        """ Try-lock across processes: True if this caller now holds `key` for `ttl` seconds """
+        now = time.time()
+        cursor = self._write(
+            "INSERT INTO state (key, value, is_json, expires_at) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE state.expires_at IS NOT NULL AND state.expires_at < ?",
+            (key, json.dumps(os.getpid()), now + ttl, now))
+        return cursor.rowcount == 1
+
+    def incr(self, key, amount=1):
+        """ Atomically add `amount` to an integer key (created at 0) and return the new value """
+        row = self._write(
+            "INSERT INTO state (key, value, is_json) VALUES (?, ?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(CAST(state.value AS INTEGER) + ? AS TEXT) RETURNING value",
+            (key, json.dumps(amount), amount)).fetchone()
+        return int(row[0])
+
+    def clear(self):
+        """ Drop every key (tests and benchmarks start from an empty store) """
+        self._write("DELETE FROM state", ())
@@ -0,0 +1,129 @@
+"""
+In-memory student search for AttendX (autocomplete and the attendance view).
+
+Searching attendance_records with ilike('%text%') scans every record, since a
+leading wildcard cannot use a B-tree index. StudentIndex instead searches the
+students themselves, which are few, and returns sids; the records are then
+filtered with sid equality (indexed, see migrate_student_search.sql).
+
+Per worker it keeps:
+
+- a sorted list of (key, sid) over each sid, each word of each name and each
+  full name, so prefix matches are two bisects;
+- a trigram posting list (the same three-letter grams pg_trgm uses), which
+  finds substrings like the old ilike did and, when nothing matches exactly,
+  near misses ("ramen" for "Raman") by trigram similarity.
+
+The index is rebuilt when the user directory's shared version moves (a
+student registered, was approved or was deleted on this host,
+see user_directory.py) or after ATTENDX_SEARCH_TTL seconds (default 300).
+"""
+
+import bisect, os, threading, time
+from user_directory import VERSION_KEY
+
+SEARCH_TTL = float(os.environ.get("ATTENDX_SEARCH_TTL", 300))     # seconds
+FUZZY_THRESHOLD = 0.3         # minimum trigram similarity, pg_trgm's default
+
+# Match ranks, best first
+EXACT_SID, PREFIX, SUBSTRING, FUZZY = range(4)
+
+
+def normalize(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def trigrams(text):
+    """ pg_trgm style grams: each word padded with two spaces in front and one behind """
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class StudentIndex:
+    """ Prefix and trigram index over student sids and names, rebuilt when users change """
+
+    def __init__(self, load, state, ttl=SEARCH_TTL):
+        self._load = load          # () -> rows with sid and name for every student
+        self._state = state
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None      # (shared version, built_at, names, texts, keys, postings, name grams)
+
+    def _build(self, rows):
+        names, texts, keys, postings, name_grams = {}, {}, [], {}, {}
+        for row in rows:
+            sid = str(row['sid']).strip()
+            name = normalize(row.get('name'))
+            names[sid] = row.get('name') or ""
+            texts[sid] = f"{sid.lower()} {name}"
+            for key in {sid.lower(), name, *name.split()}:
+                if key:
+                    keys.append((key, sid))
+            words = name.split()
+            name_grams[sid] = [trigrams(name)] + ([trigrams(word) for word in words] if len(words) > 1 else [])
+            for gram in trigrams(sid) | name_grams[sid][0]:
+                postings.setdefault(gram, set()).add(sid)
+        keys.sort()
+        return names, texts, keys, postings, name_grams
+
+    def _current(self):
+        shared = self._state.get(VERSION_KEY, 0)
+        snapshot = self._snapshot
+        if snapshot and snapshot[0] == shared and time.monotonic() - snapshot[1] < self._ttl:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot and snapshot[0] == shared and time.monotonic() - snapshot[1] < self._ttl:
+                return snapshot
+            try:
+                rows = self._load()
+            except Exception as e:
+                if snapshot is None:
+                    raise
+                print(f"Student index rebuild failed, searching the previous copy: {e}")
+                return snapshot
+            self._snapshot = (shared, time.monotonic(), *self._build(rows))
+            return self._snapshot
+
+    def search(self, text, limit=10, fuzzy=True):
+        """ [(sid, name)] best matches first: exact sid, prefixes, substrings, then (with fuzzy) near misses """
+        _, _, names, texts, keys, postings, name_grams = self._current()
+        query = normalize(text)
+        if not query:
+            return []
+        ranks = {}
+
+        def rank(sid, value):
+            if value < ranks.get(sid, FUZZY + 1):
+                ranks[sid] = value
+
+        start = bisect.bisect_left(keys, (query,))
+        end = bisect.bisect_left(keys, (query + "\uffff",))
+        for key, sid in keys[start:end]:
+            rank(sid, EXACT_SID if key == sid.lower() == query else PREFIX)
+
+        # Substrings: every gram inside a word of the query must be among the student's grams
+        # (fragments too short to have one are checked against every student, still in memory)
+        inner = {word[i:i + 3] for word in query.split() for i in range(len(word) - 2)}
+        candidates = set.intersection(*(postings.get(gram, set()) for gram in inner)) if inner else texts
+        for sid in candidates:
+            if query in texts[sid]:
+                rank(sid, SUBSTRING)
+
+        # Near misses, scored like pg_trgm's similarity() against the whole name or any one word of it
+        if fuzzy and not ranks:
+            wanted = trigrams(query)
+            candidates = set().union(*(postings.get(gram, ()) for gram in wanted))
+            for sid in candidates:
+                if any(len(wanted & grams) / len(wanted | grams) >= FUZZY_THRESHOLD for grams in name_grams[sid]):
+                    rank(sid, FUZZY)
+
+        ordered = sorted(ranks, key=lambda sid: (ranks[sid], names[sid].lower(), sid))
+        return [(sid, names[sid]) for sid in (ordered[:limit] if limit else ordered)]
+
+    def reset(self):
+        """ Drop the index; the next search rebuilds it """
+        self._snapshot = None
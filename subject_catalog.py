@@ -0,0 +1,85 @@
+"""
+Process-wide subject catalog for AttendX.
+
+Subjects change a few times per term but were read on nearly every teacher and
+report page (the teacher screen alone polls every 15 s). SubjectCatalog keeps
+one snapshot of the table per worker, sorted by name and indexed by subject_id
+and by class (department, semester, section).
+
+Freshness is versioned rather than timed alone:
+
+- the admin routes that write subjects call invalidate(), which bumps a counter
+  in the shared state store (state_store.py); every worker on the host compares
+  that counter on each read and reloads on the next request after a change;
+- other hosts cannot see that counter, so a snapshot is also reloaded once it
+  is older than ATTENDX_SUBJECTS_TTL seconds (default 60), which bounds how long
+  they serve an edited catalog.
+
+If Supabase cannot be reached during a reload the previous snapshot keeps
+being served, so a classroom laptop with a flaky uplink still lists subjects.
+"""
+
+import hashlib, json, os, threading, time
+
+SUBJECTS_TTL = float(os.environ.get("ATTENDX_SUBJECTS_TTL", 60))   # seconds, bound for other hosts
+VERSION_KEY = "subjects_version"
+
+
+def class_key(department, semester, section):
+    """ Index key of a class; matched case- and whitespace-insensitively like fetch_enrolled() """
+    return tuple(str(v or "").strip().lower() for v in (department, semester, section))
+
+
+class SubjectCatalog:
+    """ Cached copy of the subjects table, shared by the threads of one worker """
+
+    def __init__(self, load, state, ttl=SUBJECTS_TTL):
+        self._load = load          # () -> list of subject rows
+        self._state = state
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None      # (shared version, loaded_at, data version, rows, by_id, by_class)
+
+    def _current(self):
+        shared = self._state.get(VERSION_KEY, 0)
+        snapshot = self._snapshot
+        if snapshot and snapshot[0] == shared and time.monotonic() - snapshot[1] < self._ttl:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot and snapshot[0] == shared and time.monotonic() - snapshot[1] < self._ttl:
+                return snapshot
+            try:
+                rows = self._load()
+            except Exception as e:
+                if snapshot is None:
+                    raise
+                print(f"Subject catalog reload failed, serving the previous copy: {e}")
+                return snapshot
+            rows = sorted(rows, key=lambda s: str(s.get('subject_name') or ""))
+            by_id = {str(s['subject_id']): s for s in rows}
+            by_class = {}
+            for s in rows:
+                by_class.setdefault(class_key(s.get('department'), s.get('semester'), s.get('section')), []).append(s)
+            digest = hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode()).hexdigest()[:16]
+            self._snapshot = (shared, time.monotonic(), digest, rows, by_id, by_class)
+            return self._snapshot
+
+    def all(self):
+        """ Every subject, ordered by subject_name """
+        return self._current()[3]
+
+    def get(self, subject_id):
+        return self._current()[4].get(str(subject_id))
+
+    def for_class(self, department, semester, section):
+        return self._current()[5].get(class_key(department, semester, section), [])
+
+    def version(self):
+        """ Content hash of the snapshot being served (part of report ETags) """
+        return self._current()[2]
+
+    def invalidate(self):
+        """ Call after writing subjects: this worker reloads now, the others on their next read """
+        self._state.incr(VERSION_KEY)
+        self._snapshot = None
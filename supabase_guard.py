@@ -0,0 +1,200 @@
+"""
+Timeouts, retries and a circuit breaker for AttendX's Supabase queries.
+
+During an upstream incident every query used to wait out supabase-py's
+120-second HTTP timeout, and every route caught the error and rendered an
+empty page. Queries built on app.LazySupabase now go through GuardedQuery:
+
+- the client for reads (select, including count-only HEADs) times out after
+  DB_READ_TIMEOUT seconds and the one for writes after DB_WRITE_TIMEOUT;
+- reads are idempotent, so a read that fails upstream is retried up to
+  READ_RETRIES times after a jittered exponential backoff. Writes are never
+  retried here. postgrest's own retries (1, 2 and 4 s on a 503) are switched
+  off so that the two do not stack;
+- BREAKER_THRESHOLD upstream failures in a row open the breaker. For the next
+  BREAKER_COOLDOWN seconds queries fail at once with UpstreamUnavailable
+  instead of waiting, then a single probe query decides whether it closes.
+
+Only upstream failures count: timeouts, refused or reset connections, 5xx
+gateway answers and PostgREST's "database unreachable" codes. Client errors
+such as a duplicate key show that Supabase is up and pass straight through.
+Each process keeps its own breaker; each of its workers learns of an outage
+after BREAKER_THRESHOLD failed queries. The async client of asgi.py runs its
+queries through run_guarded_async() on the same breaker as the sync client.
+"""
+
+import asyncio, os, random, threading, time
+
+DB_READ_TIMEOUT = float(os.environ.get("ATTENDX_DB_READ_TIMEOUT", 5))      # seconds
+DB_WRITE_TIMEOUT = float(os.environ.get("ATTENDX_DB_WRITE_TIMEOUT", 10))   # seconds
+DB_CONNECT_TIMEOUT = 3        # seconds to open a connection, reads and writes alike
+READ_RETRIES = 2
+RETRY_BASE = 0.2              # seconds; the backoff before retry n is uniform in [0, RETRY_BASE * 2**n]
+RETRY_MAX = 2.0               # seconds; ceiling of one backoff
+BREAKER_THRESHOLD = int(os.environ.get("ATTENDX_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.environ.get("ATTENDX_BREAKER_COOLDOWN", 30))  # seconds
+
+# PostgREST codes for "the database behind me is unreachable or overloaded"
+# (connection errors, schema cache, pool timeout) and Postgres' statement_timeout
+UPSTREAM_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003", "57014"}
+
+# Builder attributes that are properties, not methods (query.not_.is_(...))
+PROPERTY_STEPS = {"not_"}
+
+
+class UpstreamUnavailable(Exception):
+    """ Raised instead of querying while the breaker is open """
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"Supabase ({name}) unavailable; retrying in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def is_upstream_failure(error):
+    """ True if `error` says Supabase is down or overloaded, not that the query was wrong """
+    if isinstance(error, UpstreamUnavailable):
+        return True
+    import httpx
+    if isinstance(error, httpx.TransportError):     # timeouts, refused and reset connections
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int):                       # postgrest's code for a non-JSON answer: the HTTP status
+        return code >= 500
+    return code in UPSTREAM_CODES
+
+
+class CircuitBreaker:
+    """ closed -> open after `threshold` failures in a row -> one probe after `cooldown` seconds -> closed or open """
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self._probing or time.monotonic() >= self.opened_at + self.cooldown else "open"
+
+    def allow(self):
+        """ Whether a query may go out now; after the cooldown only one (the probe) does """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.monotonic() >= self.opened_at + self.cooldown:
+                self._probing = True
+                return True
+            return False
+
+    def retry_in(self):
+        return 0.0 if self.opened_at is None else max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"Supabase ({self.name}) reachable again; circuit closed")
+            self.failures, self.opened_at, self._probing = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    print(f"Supabase ({self.name}) failing; circuit open for {self.cooldown:.0f}s")
+                self.opened_at, self._probing = time.monotonic(), False
+
+
+class GuardedQuery:
+    """ A query being built: the calls are recorded and replayed on the right client by execute() """
+
+    def __init__(self, owner, steps):
+        self._owner = owner
+        self._steps = steps
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name in PROPERTY_STEPS:
+            return GuardedQuery(self._owner, self._steps + [(name, None, None)])
+
+        def step(*args, **kwargs):
+            return GuardedQuery(self._owner, self._steps + [(name, args, kwargs)])
+        return step
+
+    @property
+    def is_read(self):
+        return len(self._steps) > 1 and self._steps[1][0] == "select"
+
+    def build(self, client):
+        query = client
+        for name, args, kwargs in self._steps:
+            query = getattr(query, name)
+            if args is not None:
+                query = query(*args, **kwargs)
+        return query
+
+    def execute(self):
+        return self._owner.run(self)
+
+
+def run_guarded(breaker, query, client, on_failure=None):
+    """ Execute a GuardedQuery on `client` through `breaker`, retrying reads; on_failure(error) is told of upstream failures """
+    attempts = 1 + (READ_RETRIES if query.is_read else 0)
+    for attempt in range(attempts):
+        if not breaker.allow():
+            error = UpstreamUnavailable(breaker.name, breaker.retry_in())
+            if on_failure:
+                on_failure(error)
+            raise error
+        built = query.build(client)
+        if hasattr(built, "retry"):
+            built = built.retry(False)
+        try:
+            result = built.execute()
+        except Exception as e:
+            if not is_upstream_failure(e):
+                breaker.record_success()        # Supabase answered; the query itself was refused
+                raise
+            breaker.record_failure()
+            if on_failure:
+                on_failure(e)
+            if attempt + 1 >= attempts:
+                raise
+            time.sleep(random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt)))
+        else:
+            breaker.record_success()
+            return result
+
+
+async def run_guarded_async(breaker, query, client, on_failure=None):
+    """ run_guarded() for an async client: the same breaker, retries and backoff, awaited """
+    attempts = 1 + (READ_RETRIES if query.is_read else 0)
+    for attempt in range(attempts):
+        if not breaker.allow():
+            error = UpstreamUnavailable(breaker.name, breaker.retry_in())
+            if on_failure:
+                on_failure(error)
+            raise error
+        built = query.build(client)
+        if hasattr(built, "retry"):
+            built = built.retry(False)
+        try:
+            result = await built.execute()
+        except Exception as e:
+            if not is_upstream_failure(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if on_failure:
+                on_failure(e)
+            if attempt + 1 >= attempts:
+                raise
+            await asyncio.sleep(random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt)))
+        else:
+            breaker.record_success()
+            return result
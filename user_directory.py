@@ -0,0 +1,101 @@
+"""
+sid -> name / role / status / class directory for AttendX.
+
+Pages that only need to label sids (who added a subject, whether a record
+belongs to a student or a teacher) used to download the whole users table on
+every load. UserDirectory keeps a compact per-worker cache instead: one tuple
+per sid, filled on demand, with batch lookups that query only the sids it does
+not hold yet. A lookup that misses more than LOOKUP_BATCH sids (a cold worker
+opening the all-records report) loads the whole directory in one query rather
+than in many batches. Unknown sids are cached too, so records of deleted users
+do not trigger a lookup on every page.
+
+Invalidation is targeted. The routes that write users call invalidate(sid, ...),
+which appends the sids to a short log in the shared state store
+(state_store.py); the other workers on the host replay that log on their next
+lookup and drop just those entries. If a worker has fallen behind the log, it
+drops everything. Other hosts cannot see the log, so every entry is also
+reloaded after ATTENDX_USERS_TTL seconds (default 300).
+"""
+
+import os, threading, time
+from collections import namedtuple
+
+USERS_TTL = float(os.environ.get("ATTENDX_USERS_TTL", 300))    # seconds, bound for other hosts
+LOOKUP_BATCH = 200            # most sids queried by name (keeps the in.(...) filter well inside URL limits)
+LOG_TTL = 3600                # seconds an invalidation stays in the shared log
+VERSION_KEY = "users_version"
+LOG_KEY = "users_invalidated:{}"
+
+FIELDS = ("sid", "name", "role", "status", "department", "semester", "section")
+UserEntry = namedtuple("UserEntry", FIELDS)
+
+
+class UserDirectory:
+    """ Cached user lookups by sid, shared by the threads of one worker """
+
+    def __init__(self, load, state, ttl=USERS_TTL):
+        self._load = load          # (list of sids, or None for everyone) -> user rows with FIELDS
+        self._state = state
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}         # sid -> (loaded_at, UserEntry or None)
+        self._seen = None          # last shared version whose invalidations were applied here
+
+    def _apply_invalidations(self):
+        shared = self._state.get(VERSION_KEY, 0)
+        if shared == self._seen:
+            return shared
+        with self._lock:
+            if self._seen is None or shared < self._seen:
+                self._entries.clear()
+            else:
+                for version in range(self._seen + 1, shared + 1):
+                    sids = self._state.get(LOG_KEY.format(version))
+                    if sids is None:
+                        self._entries.clear()
+                        break
+                    for sid in sids:
+                        self._entries.pop(sid, None)
+            self._seen = shared
+        return shared
+
+    def lookup(self, sids):
+        """ {sid: UserEntry} for the given sids that exist; only uncached sids are queried """
+        version = self._apply_invalidations()
+        now = time.monotonic()
+        found, missing = {}, []
+        for sid in {str(s).strip() for s in sids if s is not None}:
+            hit = self._entries.get(sid)
+            if hit is None or now - hit[0] >= self._ttl:
+                missing.append(sid)
+            elif hit[1] is not None:
+                found[sid] = hit[1]
+
+        if not missing:
+            return found
+        everyone = len(missing) > LOOKUP_BATCH
+        loaded = {}
+        for row in self._load(None if everyone else missing):
+            loaded[str(row['sid'])] = UserEntry(*(row.get(field) for field in FIELDS))
+        found.update((sid, loaded[sid]) for sid in missing if sid in loaded)
+        # A user written while this lookup was in flight may have come back stale: use it, don't keep it
+        if self._state.get(VERSION_KEY, 0) == version:
+            for sid in set(missing) | set(loaded):
+                self._entries[sid] = (now, loaded.get(sid))
+        return found
+
+    def get(self, sid):
+        return self.lookup([sid]).get(str(sid).strip())
+
+    def invalidate(self, *sids):
+        """ Call after writing these users; every worker on the host drops its copy (all of them if no sids) """
+        sids = [str(s).strip() for s in sids if s is not None]
+        version = self._state.incr(VERSION_KEY)
+        if sids:
+            self._state.set(LOG_KEY.format(version), sids, ttl=LOG_TTL)
+        with self._lock:
+            if not sids:
+                self._entries.clear()
+            for sid in sids:
+                self._entries.pop(sid, None)
@@ -0,0 +1,1262 @@
+"""
+Query-count regression check for AttendX.
+
+Drives every route against the fake PostgREST server (fake_postgrest.py) at
+several data sizes and asserts an upper bound on Supabase round trips and on
+rows transferred per request. Round-trip bounds are constants: a route that
+needs more calls as the class grows (an N+1 loop) fails. Row bounds are
+functions of the data size, so a page that starts downloading whole tables it
+does not need fails too. Report pages are also replayed with If-None-Match to
+check that an unchanged page costs only its data-version lookups (HTTP 304),
+admin edits are checked to reach every worker's subject catalog and user
+directory, archived terms are checked to be read only when a date range
+reaches them, the report replica is checked to converge on the fake's rows
+and to serve the report pages without Supabase round trips, and reads are
+checked to reach a second fake standing in for a read endpoint only while it
+keeps up. Background jobs (the absentees of a stopped session) are checked to
+report progress, stay private to their owner and be rerun after a lost lease,
+and large exports to be built by a job in pages, sent with Range support and a
+content hash, and reused until the data changes. An outage of the fake is
+checked to trip the circuit breaker, after which pages answer at once with
+their last good copy under a banner, and the async client of asgi.py to share
+that breaker and its timeouts. Repeated logins and scans are checked to
+be refused with 429 once their budget runs out, before they reach the fake.
+Importing app.py is checked not to build a Supabase client, and under
+gunicorn.conf.py the background threads are checked to start in the worker
+processes and never in the preloading master.
+
+    python verify_query_counts.py            # exit code 1 on any violation
+    python verify_query_counts.py --verbose  # print the measured numbers
+"""
+
+import os
+import sys
+import tempfile
+
+import attendance_bitmaps as bitmaps
+from fake_postgrest import FAKE_KEY, start_fake_postgrest
+
+DATA_SIZES = (10, 100, 400)     # students enrolled in the class under test
+HISTORY_SESSIONS = 4
+SLACK_ROWS = 5
+
+CLASS = {"department": "CS", "semester": "3", "section": "A"}
+OTHER_CLASS = {"department": "EE", "semester": "5", "section": "B"}
+
+# (label, role, method, path, form, max_calls, max_rows(size))
+# `size` has: students, users, subjects, sessions, records, pending, my_records
+ROUTES = [
+    ("GET /login", None, "GET", "/login", None, 0, lambda d: 0),
+    ("POST /login", None, "POST", "/login",
+     lambda ctx: {"username": ctx["student"], "password": "pw", "role": "student"}, 1, lambda d: 1),
+    ("GET /register", None, "GET", "/register", None, 0, lambda d: 0),
+    ("POST /register", None, "POST", "/register",
+     lambda ctx: {"name": "New Student", "sid": "S-NEW", "password": "pw", **CLASS}, 1, lambda d: 1),
+
+    ("GET /admin_dashboard", "admin", "GET", "/admin_dashboard", None, 5, lambda d: d["pending"]),
+    ("GET /admin/users", "admin", "GET", "/admin/users", None, 2, lambda d: d["users"]),
+    ("GET /admin_subjects", "admin", "GET", "/admin_subjects", None, 2, lambda d: d["subjects"] + d["users"]),
+    # report pages and exports add up to 3 data-version lookups (see verify_conditional_get); subjects
+    # come from the subject catalog, loaded once per seed by the first page that needs it
+    ("GET /admin/reports", "admin", "GET", "/admin/reports", None, 5, lambda d: d["records"] + d["users"]),
+    ("GET /user/approve", "admin", "GET", "/user/approve/S-NEW", None, 1, lambda d: 1),
+    ("GET /user/reject", "admin", "GET", "/user/reject/S-PENDING-0", None, 1, lambda d: 1),
+
+    ("GET /teacher_dashboard", "teacher", "GET", "/teacher_dashboard", None, 4,
+     lambda d: d["subjects"] + d["pending"] + 1),
+    ("POST /teacher start", "teacher", "POST", "/teacher",
+     lambda ctx: {"action": "start", "subject_id": ctx["subject_id"], "session_date": "2026-01-15",
+                  "session_name": "Lecture"}, 2, lambda d: 3),
+    ("GET /teacher", "teacher", "GET", "/teacher", None, 6,
+     lambda d: d["subjects"] + d["students"] + 3),
+    # active session + token (from the shared state store; DB check, cleanup and insert on rotation) + change log
+    ("GET /teacher/live", "teacher", "GET", "/teacher/live", None, 5, lambda d: d["students"] + 4),
+    ("GET /teacher/live?since", "teacher", "GET", lambda ctx: f"/teacher/live?since={ctx['roster_version']}",
+     None, 4, lambda d: 3),
+    ("POST /teacher/manual_mark", "teacher", "POST", "/teacher/manual_mark",
+     lambda ctx: {"student_sid": ctx["manual_student"], "student_name": "Manual", "mark_status": "present"},
+     3, lambda d: 3),
+
+    ("POST /api/scan", "student", "POST", "/api/scan", lambda ctx: {"token": ctx["token"]}, 3, lambda d: 2),
+    ("GET /student?token", "student", "GET", lambda ctx: f"/student?token={ctx['token']}", None, 3,
+     lambda d: 3),
+    ("POST /student", "student", "POST", "/student", lambda ctx: {"token": ctx["token"]}, 5, lambda d: 3),
+    ("GET /student_dashboard", "student", "GET", "/student_dashboard", None, 2, lambda d: 11),
+    ("GET /student_report", "student", "GET", "/student_report", None, 4,
+     lambda d: d["subjects"] + d["sessions"] + d["my_records"]),
+    ("GET /student_report/export", "student", "GET", "/student_report/export", None, 4,
+     lambda d: d["subjects"] + d["sessions"] + d["my_records"]),
+    ("GET /attendance/view (student)", "student", "GET", "/attendance/view", None, 3,
+     lambda d: d["my_records"]),
+
+    ("GET /attendance", "teacher", "GET", "/attendance", None, 3, lambda d: d["subjects"] + d["records"]),
+    ("GET /attendance/view (teacher)", "teacher", "GET", "/attendance/view", None, 3,
+     lambda d: d["subjects"] + d["records"]),
+    # the search is resolved to sids by the student index (one load per seed, then in memory)
+    ("GET /api/students/search", "teacher", "GET", "/api/students/search?q=stud", None, 1,
+     lambda d: d["users"]),
+    ("GET /attendance/view?search", "teacher", "GET", "/attendance/view?search=Student%200001", None, 3,
+     lambda d: d["subjects"] + d["my_records"]),
+    ("GET /export", "teacher", "GET", "/export", None, 3, lambda d: d["records"]),
+    # the stop itself only deactivates the session and queues the absentee job
+    ("POST /teacher stop", "teacher", "POST", "/teacher", lambda ctx: {"action": "stop"}, 2, lambda d: 3),
+    # method "JOBS" runs the queued background jobs: the session, enrolled roster, marked sids,
+    # student bits (two more calls to give S-NEW one), one bulk write of the absentees, the
+    # session bitmaps, the change log cleanup and the token purges
+    ("job stop_session", "teacher", "JOBS", None, None, 13, lambda d: 3 * d["students"] + 20),
+]
+
+SESSION_USERS = {
+    "admin": ("admin", "admin", "Administrator"),
+    "teacher": ("T-1", "teacher", "Teacher One"),
+}
+
+
+def seed(db, students):
+    """ Fill the fake with one class of `students`, a second class, pending sign-ups and a short history """
+    db.clear()
+    db.insert("users", [
+        {"sid": "admin", "name": "Administrator", "password": "pw", "role": "admin", "status": "approved"},
+        {"sid": "T-1", "name": "Teacher One", "password": "pw", "role": "teacher", "status": "approved"},
+    ])
+    db.insert("users", [{"sid": f"S-{i:04d}", "name": f"Student {i:04d}", "password": "pw",
+                         "role": "student", "status": "approved", **CLASS} for i in range(students)])
+    db.insert("users", [{"sid": f"S-OTHER-{i:04d}", "name": f"Other {i:04d}", "password": "pw",
+                         "role": "student", "status": "approved", **OTHER_CLASS} for i in range(students // 2)])
+    db.insert("users", [{"sid": f"S-PENDING-{i}", "name": f"Pending {i}", "password": "pw",
+                         "role": "student", "status": "pending", **CLASS} for i in range(3)])
+    subject = db.insert("subjects", {"subject_name": "Algorithms", "class_name": "CS-3A",
+                                     "added_by": "admin", **CLASS})[0]
+    db.insert("subjects", [{"subject_name": f"Elective {i}", "class_name": "EE-5B", "added_by": "admin",
+                            **OTHER_CLASS} for i in range(3)])
+
+    for n in range(HISTORY_SESSIONS):
+        sess = db.insert("attendance_sessions", {"teacher_id": "T-1", "subject_id": subject["subject_id"],
+                                                 "subject": "Algorithms", "session_date": f"2026-01-0{n + 1}",
+                                                 "active": False})[0]
+        db.insert("attendance_records", [{
+            "session_id": sess["session_id"], "sid": f"S-{i:04d}", "name": f"Student {i:04d}",
+            "subject_id": subject["subject_id"], "subject": "Algorithms", "date": f"0{n + 1}-01-2026",
+            "time": "09:00:00", "status": "present" if (i + n) % 5 else "absent",
+            "marked_type": "qr" if (i + n) % 5 else "auto"
+        } for i in range(students)])
+
+    # Bitmaps as a finished stop leaves them (bit i is S-i), so reports read them instead of rebuilding
+    db.insert("student_bits", [{"sid": f"S-{i:04d}", "bit": i} for i in range(students)])
+    for n, sess in enumerate(db.rows("attendance_sessions")):
+        present = bitmaps.from_positions(i for i in range(students) if (i + n) % 5)
+        absent = bitmaps.from_positions(i for i in range(students) if not (i + n) % 5)
+        db.update("attendance_sessions", {"filters": [("session_id", f"eq.{sess['session_id']}")]},
+                  {"present_bits": bitmaps.encode(present), "absent_bits": bitmaps.encode(absent)})
+
+    return {
+        "students": students,
+        "users": len(db.rows("users")) + 1,
+        "subjects": len(db.rows("subjects")),
+        "sessions": HISTORY_SESSIONS + 1,
+        "records": len(db.rows("attendance_records")) + 3,
+        "pending": 4,
+        "my_records": HISTORY_SESSIONS + 1,
+    }, subject["subject_id"]
+
+
+def measure(app, db, size):
+    sizes, subject_id = seed(db, size)
+    reset_state()
+    ctx = {"student": "S-0001", "subject_id": subject_id, "manual_student": "S-0002", "token": "",
+           "roster_version": 0}
+    client = app.test_client()
+    results = []
+
+    for label, role, method, path, form, max_calls, max_rows in ROUTES:
+        with client.session_transaction() as sess:
+            sess.clear()
+            if role == "student":
+                sess.update(user=ctx["student"], role="student", name="Student 0001")
+            elif role:
+                sid, r, name = SESSION_USERS[role]
+                sess.update(user=sid, role=r, name=name)
+
+        url = path(ctx) if callable(path) else path
+        data = form(ctx) if form else None
+        db.reset_stats()
+        if method == "JOBS":
+            import app as attendx
+            response = None
+            status = 200 if attendx.job_runner.run_pending() else 500
+        else:
+            response = client.open(url, method=method, data=data)
+            status = response.status_code
+        stats = db.snapshot()
+
+        results.append({
+            "label": label, "status": status,
+            "calls": stats["calls"], "rows": stats["rows_out"] + stats["rows_in"],
+            "max_calls": max_calls, "max_rows": max_rows(sizes) + SLACK_ROWS,
+        })
+
+        if label == "GET /teacher":
+            tokens = sorted(db.rows("valid_tokens"), key=lambda t: t["created_at"])
+            ctx["token"] = tokens[-1]["token"] if tokens else ""
+        elif label == "GET /teacher/live" and response.is_json:
+            ctx["roster_version"] = response.get_json().get("roster_version", 0)
+    return results
+
+
+def load_app():
+    """ Import app.py pointed at a fresh fake PostgREST server """
+    _, url, db = start_fake_postgrest()
+    os.environ["SUPABASE_URL"] = url
+    os.environ["SUPABASE_KEY"] = FAKE_KEY
+    scratch = tempfile.mkdtemp(prefix="attendx-verify-")
+    os.environ["ATTENDX_STATE_DB"] = os.path.join(scratch, "state.db")
+    os.environ["ATTENDX_JOBS_DB"] = os.path.join(scratch, "jobs.db")
+    os.environ["ATTENDX_JOB_WORKERS"] = "0"     # background jobs run when a check calls run_pending()
+    os.environ["ATTENDX_EXPORT_DIR"] = os.path.join(scratch, "exports")
+    os.environ["ATTENDX_DB_READ_TIMEOUT"] = "1"     # verify_degraded_mode stalls the fake past it
+    os.environ["ATTENDX_RATE_DB"] = os.path.join(scratch, "rate.db")
+    import app as attendx
+    attendx.app.config["TESTING"] = True
+    # One page per export and one student_bits batch per stop, so the round-trip bounds stay
+    # constants; verify_export_jobs and verify_background_jobs check the paging and the batches
+    attendx.EXPORT_PAGE = 5000
+    attendx.STUDENT_BITS_BATCH = 5000
+    return attendx.app, db
+
+
+def reset_state():
+    """ Seeding replaces the fake's rows, so drop what the workers' shared store remembers about the old ones """
+    import app as attendx
+    attendx.state.clear()
+    attendx.subject_catalog.invalidate()
+    attendx.user_directory.invalidate()
+    attendx.student_index.reset()
+    attendx.export_spool.clear()
+    attendx.supabase.breaker.record_success()
+    attendx._last_good_saved.clear()
+    attendx.rate_buckets.clear()
+
+
+def verify_route_bounds(app, db, verbose=False):
+    print("\n=== Verifying Supabase round trips per route ===")
+    runs = {size: measure(app, db, size) for size in DATA_SIZES}
+    ok = True
+    for index, (label, *_rest) in enumerate(ROUTES):
+        per_size = [runs[size][index] for size in DATA_SIZES]
+        problems = []
+        for size, r in zip(DATA_SIZES, per_size):
+            if r["status"] >= 500:
+                problems.append(f"HTTP {r['status']} at {size} students")
+            if r["calls"] > r["max_calls"]:
+                problems.append(f"{r['calls']} calls > {r['max_calls']} at {size} students")
+            if r["rows"] > r["max_rows"]:
+                problems.append(f"{r['rows']} rows > {r['max_rows']} at {size} students")
+        if per_size[-1]["calls"] > per_size[0]["calls"]:
+            problems.append(f"round trips grow with data size ({per_size[0]['calls']} -> {per_size[-1]['calls']})")
+
+        counts = " / ".join(f"{r['calls']}c {r['rows']}r" for r in per_size)
+        if problems:
+            ok = False
+            print(f"✗ {label}: " + "; ".join(problems))
+        else:
+            print(f"✓ {label}" + (f"  [{counts}]" if verbose else ""))
+    return ok
+
+
+# (role, path) of every page that answers If-None-Match with 304
+CONDITIONAL_ROUTES = [
+    ("admin", "/admin/reports"),
+    ("teacher", "/attendance"),
+    ("teacher", "/attendance/view"),
+    ("teacher", "/export"),
+    ("student", "/attendance/view"),
+    ("student", "/student_report"),
+    ("student", "/student_report/export"),
+]
+MAX_NOT_MODIFIED_CALLS = 3
+
+
+def verify_conditional_get(app, db, verbose=False):
+    print("\n=== Verifying ETag / 304 on report pages ===")
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    client = app.test_client()
+    ok = True
+    for role, path in CONDITIONAL_ROUTES:
+        with client.session_transaction() as sess:
+            sess.clear()
+            if role == "student":
+                sess.update(user="S-0001", role="student", name="Student 0001")
+            else:
+                sid, r, name = SESSION_USERS[role]
+                sess.update(user=sid, role=r, name=name)
+
+        first = client.get(path, headers={"Accept-Encoding": "gzip"})
+        etag = first.headers.get("ETag", "")
+        db.reset_stats()
+        again = client.get(path, headers={"If-None-Match": etag})
+        calls = db.snapshot()["calls"]
+        # Any new session moves every report's data version; its record changes every export's content
+        new_session = db.insert("attendance_sessions", {"teacher_id": "T-1", "subject_id": 1, "subject": "Algorithms",
+                                                        "session_date": "2026-02-01", "active": False})[0]
+        db.insert("attendance_records", {"session_id": new_session["session_id"], "sid": "S-0001",
+                                         "name": "Student 0001", "subject_id": 1, "subject": "Algorithms",
+                                         "date": "01-02-2026", "time": "09:00:00", "status": "present"})
+        changed = client.get(path, headers={"If-None-Match": etag})
+
+        problems = []
+        if not etag:
+            problems.append("no ETag on first response")
+        if again.status_code != 304:
+            problems.append(f"repeat request returned {again.status_code}, expected 304")
+        elif calls > MAX_NOT_MODIFIED_CALLS:
+            problems.append(f"304 took {calls} calls > {MAX_NOT_MODIFIED_CALLS}")
+        if changed.status_code != 200:
+            problems.append(f"request after a data change returned {changed.status_code}, expected 200")
+        # Spooled exports are sent as stored, so Range requests address their bytes
+        if (len(first.get_data()) >= 1024 and first.headers.get("Content-Encoding") != "gzip"
+                and "Repr-Digest" not in first.headers):
+            problems.append("large response was not gzip encoded")
+
+        label = f"{role} {path}"
+        if problems:
+            ok = False
+            print(f"✗ {label}: " + "; ".join(problems))
+        else:
+            print(f"✓ {label}" + (f"  [304 in {calls} calls]" if verbose else ""))
+    return ok
+
+
+def verify_subject_catalog(app, db, verbose=False):
+    print("\n=== Verifying subject catalog invalidation ===")
+    import app as attendx
+    from subject_catalog import SubjectCatalog
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    # A second catalog on the same state store stands in for another worker process
+    other_worker = SubjectCatalog(attendx.load_subjects, attendx.state)
+    subject_id = attendx.subject_catalog.all()[0]["subject_id"]
+    other_worker.all()
+
+    db.reset_stats()
+    for _ in range(50):
+        attendx.subject_catalog.all()
+        other_worker.get(subject_id)
+    cached_calls = db.snapshot()["calls"]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["admin"]
+        sess.update(user=sid, role=r, name=name)
+    client.post(f"/admin/edit_subject/{subject_id}", data={"subject_name": "Renamed", "class_name": "CS-3A", **CLASS})
+
+    problems = []
+    if cached_calls:
+        problems.append(f"cached reads made {cached_calls} calls")
+    for label, catalog in (("this worker", attendx.subject_catalog), ("other worker", other_worker)):
+        subject = catalog.get(subject_id)
+        if not subject or subject["subject_name"] != "Renamed":
+            problems.append(f"{label} still serves the old subject after the edit")
+
+    if problems:
+        print("✗ subject catalog: " + "; ".join(problems))
+        return False
+    print("✓ subject catalog" + (f"  [{cached_calls} calls for 100 cached reads]" if verbose else ""))
+    return True
+
+
+def verify_user_directory(app, db, verbose=False):
+    print("\n=== Verifying user directory lookups and invalidation ===")
+    import app as attendx
+    from user_directory import UserDirectory
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    other_worker = UserDirectory(attendx.load_users, attendx.state)
+    known = ["S-0000", "S-0001", "S-PENDING-0"]
+    attendx.user_directory.lookup(known)
+    other_worker.lookup(known)
+
+    problems = []
+    db.reset_stats()
+    attendx.user_directory.lookup(known)
+    if db.snapshot()["calls"]:
+        problems.append("cached sids were queried again")
+    db.reset_stats()
+    attendx.user_directory.lookup(known + ["S-0002"])
+    stats = db.snapshot()
+    if stats["calls"] != 1 or stats["rows_out"] != 1:
+        problems.append(f"one new sid took {stats['calls']} calls / {stats['rows_out']} rows")
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["admin"]
+        sess.update(user=sid, role=r, name=name)
+    client.get("/user/approve/S-PENDING-0")
+    db.reset_stats()
+    for label, directory in (("this worker", attendx.user_directory), ("other worker", other_worker)):
+        entry = directory.get("S-PENDING-0")
+        if not entry or entry.status != "approved":
+            problems.append(f"{label} still serves the old status after approval")
+    if db.snapshot()["calls"] != 2:
+        problems.append(f"invalidation of one sid cost {db.snapshot()['calls']} calls, expected one per worker")
+    db.reset_stats()
+    other_worker.get("S-0000")
+    if db.snapshot()["calls"]:
+        problems.append("other worker dropped entries the approval did not touch")
+
+    if problems:
+        print("✗ user directory: " + "; ".join(problems))
+        return False
+    print("✓ user directory")
+    return True
+
+
+def verify_student_search(app, db, verbose=False):
+    print("\n=== Verifying the attendance view search ===")
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    # Records of a student since removed from users, whom the index no longer knows
+    db.insert("attendance_records", {"session_id": db.rows("attendance_sessions")[0]["session_id"], "sid": "S-OLD",
+                                     "name": "Old Student", "subject_id": 1, "subject": "Algorithms",
+                                     "date": "01-01-2026", "time": "09:00:00", "status": "present"})
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["teacher"]
+        sess.update(user=sid, role=r, name=name)
+
+    problems = []
+    # (the page echoes the search text, so each check looks for text only a record puts there)
+    for text, wanted, unwanted in (("S-OLD", "Old Student", "S-0001"), ("old student", "Old Student", "S-0001"),
+                                   ("Student 0001", "S-0001", "Old Student"), ("Studnet 0001", "S-0001", "Old Student")):
+        body = client.get(f"/attendance/view?search={text}").get_data(as_text=True)
+        if wanted not in body or unwanted in body:
+            problems.append(f"searching {text!r} should show {wanted} and not {unwanted}")
+
+    if problems:
+        print("✗ student search: " + "; ".join(problems))
+        return False
+    print("✓ student search")
+    return True
+
+
+def verify_term_archive(app, db, verbose=False):
+    print("\n=== Verifying term archive routing ===")
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    # Archive the first history session the way archive_term() would
+    term = db.insert("terms", {"name": "2025 Autumn", "starts_on": "2025-08-01", "ends_on": "2025-12-20",
+                               "archived": True})[0]
+    session_row = db.rows("attendance_sessions")[0]
+    old_records = db.delete("attendance_records", {"filters": [("session_id", f"eq.{session_row['session_id']}")]})
+    db.delete("attendance_sessions", {"filters": [("session_id", f"eq.{session_row['session_id']}")]})
+    db.insert("attendance_sessions_archive", dict(session_row, term_id=term["term_id"]))
+    db.insert("attendance_records_archive", [dict(r, term_id=term["term_id"]) for r in old_records])
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["teacher"]
+        sess.update(user=sid, role=r, name=name)
+
+    problems = []
+    for path, wants_archive in (("/export", False), ("/export?from_date=2025-09-01", True),
+                                ("/export?from_date=2026-01-01", False),
+                                ("/attendance/view?search=Student%200001", False),
+                                ("/attendance/view?search=Student%200001&from_date=2025-09-01", True)):
+        db.reset_stats()
+        body = client.get(path).get_data(as_text=True)
+        read_archive = db.snapshot()["by_table"].get("attendance_records_archive", 0) > 0
+        if read_archive != wants_archive:
+            problems.append(f"{path} {'did not read' if wants_archive else 'read'} the archive")
+        if path.startswith("/export"):
+            rows = body.count("\n") - 1
+            expected = len(db.rows("attendance_records")) + (len(old_records) if wants_archive else 0)
+            if rows != expected:
+                problems.append(f"{path} exported {rows} rows, expected {expected}")
+
+    if problems:
+        print("✗ term archive: " + "; ".join(problems))
+        return False
+    print("✓ term archive")
+    return True
+
+
+def verify_session_bitmaps(app, db, verbose=False):
+    print("\n=== Verifying session bitmap fallback ===")
+    import app as attendx
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    # A late write to one session cleared its bitmaps; it was by S-NEW, who has no bit yet
+    stale = db.rows("attendance_sessions")[0]
+    db.insert("attendance_records", {"session_id": stale["session_id"], "sid": "S-NEW", "name": "New Student",
+                                     "subject_id": stale["subject_id"], "subject": "Algorithms",
+                                     "date": "01-01-2026", "time": "09:30:00", "status": "present"})
+    held = len([s for s in db.rows("attendance_sessions") if s["subject_id"] == stale["subject_id"]])
+
+    problems = []
+    for sid in ("S-0001", "S-NEW"):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess.update(user=sid, role="student", name=sid)
+        db.reset_stats()
+        client.get("/student_report")
+        writes = {m: n for m, n in db.snapshot()["by_method"].items() if m not in ("GET", "HEAD")}
+        if writes:
+            problems.append(f"GET /student_report wrote to Supabase: {writes}")
+        attended = sum(1 for r in db.rows("attendance_records")
+                       if r["sid"] == sid and r.get("status", "present") == "present")
+        item = next(i for i in attendx.build_student_report(sid) if i["subject_name"] == "Algorithms")
+        if (item["attended"], item["total_classes"]) != (attended, held):
+            problems.append(f"{sid}'s report counts {item['attended']}/{item['total_classes']} classes, "
+                            f"the records {attended}/{held}")
+
+    # The backfill stores what the report only computed
+    attendx.rebuild_session_bitmaps()
+    rebuilt = next(s for s in db.rows("attendance_sessions") if s["session_id"] == stale["session_id"])
+    if rebuilt["present_bits"] is None or not any(b["sid"] == "S-NEW" for b in db.rows("student_bits")):
+        problems.append("rebuild_session_bitmaps() left the session without bitmaps or S-NEW without a bit")
+
+    if problems:
+        print("✗ session bitmaps: " + "; ".join(problems))
+        return False
+    print("✓ session bitmaps")
+    return True
+
+
+def verify_report_replica(app, db, verbose=False):
+    print("\n=== Verifying the report replica ===")
+    import app as attendx
+    from report_replica import ReportReplica, Replicator, TABLES as REPLICA_TABLES, RECONCILE_EVERY
+    seed(db, DATA_SIZES[1])
+    reset_state()
+    replica = ReportReplica(os.path.join(tempfile.mkdtemp(prefix="attendx-verify-"), "replica.db"))
+    replicator = Replicator(replica, attendx.supabase, attendx.state)
+
+    def differences():
+        found = []
+        for table, (pk, _, columns) in REPLICA_TABLES.items():
+            want = {row[pk]: tuple(row.get(c) for c in columns) for row in db.rows(table)}
+            have = {row[pk]: tuple(row[c] for c in columns) for row in replica._query(f"SELECT * FROM {table}")}
+            # SQLite keeps booleans as integers
+            have = {k: tuple(v if not isinstance(w, bool) else bool(v) for v, w in zip(row, want.get(k, row)))
+                    for k, row in have.items()}
+            if want != have:
+                found.append(f"{table} differs ({len(set(want) ^ set(have))} keys, "
+                             f"{sum(want[k] != have[k] for k in set(want) & set(have))} rows)")
+        return found
+
+    problems = []
+    replicator.sync_once()
+    problems += [f"first copy: {d}" for d in differences()]
+
+    # Writes of every kind the replicator has to pick up
+    history = db.rows("attendance_sessions")[0]
+    record = db.rows("attendance_records")[0]
+    db.insert("attendance_records", {"session_id": history["session_id"], "sid": "S-PENDING-1", "name": "Pending 1",
+                                     "subject_id": history["subject_id"], "subject": "Algorithms",
+                                     "date": "01-01-2026", "time": "09:05:00", "status": "present"})
+    db.update("attendance_records", {"filters": [("record_id", f"eq.{record['record_id']}")]},
+              {"status": "absent", "marked_type": "manual"})
+    db.delete("attendance_records", {"filters": [("record_id", f"eq.{db.rows('attendance_records')[1]['record_id']}")]})
+    db.update("subjects", {"filters": [("subject_id", f"eq.{history['subject_id']}")]}, {"subject_name": "Algo II"})
+    db.delete("users", {"filters": [("sid", "eq.S-PENDING-2")]})
+    replica.set_meta("passes", RECONCILE_EVERY)     # make this pass one that compares keys
+    db.reset_stats()
+    replicator.sync_once()
+    if verbose:
+        print(f"  incremental pass: {db.snapshot()['calls']} calls, {db.snapshot()['rows_out']} rows")
+    if db.snapshot()["rows_out"] > len(db.rows("users")) + 4 * len(db.rows("attendance_records")) // HISTORY_SESSIONS:
+        problems.append(f"incremental pass read {db.snapshot()['rows_out']} rows")
+    problems += [f"after writes: {d}" for d in differences()]
+
+    # Report routes on the replica: no attendance reads from Supabase, same export, lag shown
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["teacher"]
+        sess.update(user=sid, role=r, name=name)
+    live_export = client.get("/export").get_data(as_text=True)
+    attendx.student_index.search("warm")    # the search index loads students once, replica or not
+    attendx.report_replica = replica
+    try:
+        for path in ("/export", "/attendance/view", "/attendance/view?search=Student%200001", "/admin/reports"):
+            if path == "/admin/reports":
+                with client.session_transaction() as sess:
+                    sid, r, name = SESSION_USERS["admin"]
+                    sess.update(user=sid, role=r, name=name)
+            db.reset_stats()
+            response = client.get(path)
+            body = response.get_data(as_text=True)
+            reads = {t: n for t, n in db.snapshot()["by_table"].items() if t != "subjects"}
+            if reads:
+                problems.append(f"{path} still queried Supabase: {reads}")
+            if path == "/export":
+                if body != live_export:
+                    problems.append("/export from the replica differs from the live export")
+                if "X-AttendX-Replica-Lag" not in response.headers:
+                    problems.append("/export does not report the replica lag")
+            elif "Data as of" not in body:
+                problems.append(f"{path} does not show the replica lag")
+        replica.set_meta("synced_at", 0)
+        db.reset_stats()
+        client.get("/admin/reports")
+        if not db.snapshot()["by_table"].get("attendance_records"):
+            problems.append("a stale replica was still used")
+    finally:
+        attendx.report_replica = None
+
+    if problems:
+        print("✗ report replica: " + "; ".join(problems))
+        return False
+    print("✓ report replica")
+    return True
+
+
+def verify_read_routing(app, db, verbose=False):
+    print("\n=== Verifying read endpoint routing ===")
+    import app as attendx
+    read_server, read_url, read_db = start_fake_postgrest()
+    seed(db, DATA_SIZES[0])
+    seed(read_db, DATA_SIZES[0])        # seeded after the primary, so it is caught up
+    reset_state()
+    attendx.supabase_read = attendx.LazySupabase(read_url, FAKE_KEY)
+
+    logins = {}
+    for role in ("admin", "teacher", "student"):
+        logins[role] = app.test_client()
+        with logins[role].session_transaction() as sess:
+            sid, r, name = SESSION_USERS.get(role, ("S-0001", "student", "Student 0001"))
+            sess.update(user=sid, role=r, name=name)
+
+    def calls(role, method, path, data=None):
+        db.reset_stats()
+        read_db.reset_stats()
+        logins[role].open(path, method=method, data=data)
+        return db.snapshot()["calls"], read_db.snapshot()["calls"]
+
+    problems = []
+    try:
+        for role, path in (("admin", "/admin_dashboard"), ("admin", "/admin/users"), ("admin", "/admin/reports"),
+                           ("teacher", "/attendance"), ("teacher", "/attendance/view"), ("teacher", "/export")):
+            calls(role, "GET", path)            # loads the cached lookups (subjects, users) on the primary
+            primary, replica = calls(role, "GET", path)
+            if primary or not replica:
+                problems.append(f"{path}: {primary} primary / {replica} read endpoint calls")
+        primary, replica = calls("student", "GET", "/attendance/view")
+        if replica:
+            problems.append("a student's own records were read from the read endpoint")
+
+        # Writes and the writer's next reads stay on the primary
+        primary, replica = calls("teacher", "POST", "/teacher/manual_mark",
+                                 {"student_sid": "S-0002", "student_name": "Student 0002", "mark_status": "present"})
+        if replica:
+            problems.append("a manual mark touched the read endpoint")
+        if calls("teacher", "GET", "/attendance/view")[1]:
+            problems.append("the teacher's read right after a write went to the read endpoint")
+
+        # A lagging read endpoint is skipped until it catches up
+        for row in read_db.rows("attendance_sessions"):
+            row["updated_at"] = "2000-01-01T00:00:00"
+        attendx.state.delete("read_endpoint_lag")
+        if calls("admin", "GET", "/admin/reports")[1] > 1:
+            problems.append("a lagging read endpoint served a report")
+        read_server.shutdown()
+        read_server.server_close()
+        attendx.state.delete("read_endpoint_lag")
+        primary, replica = calls("admin", "GET", "/admin/reports")
+        if not primary:
+            problems.append("an unreachable read endpoint did not fall back to the primary")
+    finally:
+        attendx.supabase_read = None
+        attendx.state.delete("read_endpoint_lag")
+
+    if problems:
+        print("✗ read routing: " + "; ".join(problems))
+        return False
+    print("✓ read routing")
+    return True
+
+
+def verify_qr_images(app, db, verbose=False):
+    print("\n=== Verifying QR images ===")
+    import app as attendx
+    sizes, subject_id = seed(db, DATA_SIZES[0])
+    reset_state()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["teacher"]
+        sess.update(user=sid, role=r, name=name)
+    client.post("/teacher", data={"action": "start", "subject_id": subject_id, "session_date": "2026-01-15",
+                                  "session_name": "Lecture"})
+    client.get("/teacher")
+    token = max(db.rows("valid_tokens"), key=lambda t: t["created_at"])["token"]
+
+    problems = []
+    if client.get(f"/teacher/qr/{token}.png").status_code != 200:
+        problems.append("the live token's QR image was not served")
+    attendx.state.delete(f"qr_png:{token}")
+    if client.get(f"/teacher/qr/{token}.png").status_code != 200:
+        problems.append("the live token's QR image was not drawn again after its copy expired")
+    for bogus in ("not-a-token", "x" * 200):
+        response = client.get(f"/teacher/qr/{bogus}.png")
+        if response.status_code != 404:
+            problems.append(f"a made-up token got {response.status_code}, expected 404")
+
+    if problems:
+        print("✗ QR images: " + "; ".join(problems))
+        return False
+    print("✓ QR images")
+    return True
+
+
+def verify_background_jobs(app, db, verbose=False):
+    print("\n=== Verifying background jobs ===")
+    import app as attendx
+    _, subject_id = seed(db, DATA_SIZES[0])
+    reset_state()
+    teacher, student = app.test_client(), app.test_client()
+    with teacher.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["teacher"]
+        sess.update(user=sid, role=r, name=name)
+    with student.session_transaction() as sess:
+        sess.update(user="S-0001", role="student", name="Student 0001")
+
+    problems = []
+    teacher.post("/teacher", data={"action": "start", "subject_id": subject_id, "session_date": "2026-02-01"})
+    session_id = next(s["session_id"] for s in db.rows("attendance_sessions") if s["active"])
+    db.insert("attendance_records", {"session_id": session_id, "sid": "S-0001", "name": "Student 0001",
+                                     "subject_id": subject_id, "subject": "Algorithms", "date": "01-02-2026",
+                                     "time": "09:00:00", "status": "present"})
+    attendx.job_runner.run_pending()        # token purges queued by the QR rotation
+
+    earlier = {job["job_id"] for job in teacher.get("/jobs").get_json()}     # left by the route bounds run
+    teacher.post("/teacher", data={"action": "stop"})
+    queued = [job for job in teacher.get("/jobs").get_json() if job["job_id"] not in earlier]
+    if len(queued) != 1 or queued[0]["status"] != "queued":
+        problems.append(f"stop queued {queued!r}")
+    elif "Marking absentees" not in teacher.get("/teacher_dashboard").get_data(as_text=True):
+        problems.append("the dashboard does not show the queued job")
+    job_id = queued[0]["job_id"] if queued else ""
+    if student.get(f"/jobs/{job_id}").status_code != 404:
+        problems.append("another user can see the teacher's job")
+
+    # Bits are looked up and handed out a few sids per request
+    batch, attendx.STUDENT_BITS_BATCH = attendx.STUDENT_BITS_BATCH, 4
+    db.reset_stats()
+    try:
+        attendx.job_runner.run_pending()
+    finally:
+        attendx.STUDENT_BITS_BATCH = batch
+    lookups = db.snapshot()["by_table"].get("student_bits", 0)
+    job = teacher.get(f"/jobs/{job_id}").get_json()
+    absent = [r for r in db.rows("attendance_records") if r["session_id"] == session_id and r["status"] == "absent"]
+    counts = job["result"] or {}
+    enrolled = counts.get("enrolled", 0)
+    if job["status"] != "done" or counts.get("marked") != 1 or counts.get("absentees") != enrolled - 1:
+        problems.append(f"job finished as {job!r}")
+    if len(absent) != enrolled - 1:
+        problems.append(f"{len(absent)} absentees recorded, expected {enrolled - 1}")
+    if lookups < -(-enrolled // 4):
+        problems.append(f"bits for {enrolled} students were read in {lookups} requests of up to 4 sids")
+    changes = [c for c in db.rows("attendance_changes") if c["session_id"] == session_id]
+    if changes:
+        problems.append(f"{len(changes)} change log rows left behind by the stop job")
+
+    # A job whose worker died is claimed again once its lease runs out, and repeats safely
+    key = f"stop_session:{session_id}"
+    rerun = attendx.job_runner.submit("stop_session", {"session_id": session_id}, owner="T-1", key=key)
+    if attendx.job_runner.submit("stop_session", {"session_id": session_id}, owner="T-1", key=key) != rerun:
+        problems.append("a second submit with the same key queued another job")
+    attendx.jobs.claim(["stop_session"])
+    attendx.jobs._conn().execute("UPDATE jobs SET lease_until = 0 WHERE job_id = ?", (rerun,))
+    attendx.job_runner.run_pending()
+    job = attendx.jobs.get(rerun)
+    rows = [r for r in db.rows("attendance_records") if r["session_id"] == session_id]
+    if job["status"] != "done" or job["attempts"] != 2:
+        problems.append(f"abandoned job ended {job['status']} after {job['attempts']} attempts")
+    if len(rows) != enrolled:
+        problems.append(f"rerun left {len(rows)} records for {enrolled} enrolled students")
+    stopped = next(s for s in db.rows("attendance_sessions") if s["session_id"] == session_id)
+    if stopped["present_bits"] is None:
+        problems.append("the stop job stored no bitmaps")
+
+    # A student the bit lookup misses: absentees come from the plain set difference, no bitmaps stored
+    teacher.post("/teacher", data={"action": "start", "subject_id": subject_id, "session_date": "2026-02-02"})
+    session_id = next(s["session_id"] for s in db.rows("attendance_sessions") if s["active"])
+    lookup = attendx.student_bits_for
+    attendx.student_bits_for = lambda sids, assign=False: {
+        sid: bit for sid, bit in lookup(sids, assign).items() if sid != "S-0003"}
+    try:
+        teacher.post("/teacher", data={"action": "stop"})
+        attendx.job_runner.run_pending()
+    finally:
+        attendx.student_bits_for = lookup
+    rows = [r for r in db.rows("attendance_records") if r["session_id"] == session_id]
+    stopped = next(s for s in db.rows("attendance_sessions") if s["session_id"] == session_id)
+    if len(rows) != enrolled or not any(r["sid"] == "S-0003" for r in rows):
+        problems.append(f"with a bit missing the stop left {len(rows)} records for {enrolled} enrolled students")
+    if stopped["present_bits"] is not None:
+        problems.append("with a bit missing the stop still stored bitmaps")
+
+    if problems:
+        print("✗ background jobs: " + "; ".join(problems))
+        return False
+    print("✓ background jobs")
+    return True
+
+
+def verify_export_jobs(app, db, verbose=False):
+    print("\n=== Verifying export jobs ===")
+    import gzip, hashlib, base64
+    import app as attendx
+    seed(db, DATA_SIZES[1])
+    reset_state()
+    teacher, student = app.test_client(), app.test_client()
+    with teacher.session_transaction() as sess:
+        sid, r, name = SESSION_USERS["teacher"]
+        sess.update(user=sid, role=r, name=name)
+    with student.session_transaction() as sess:
+        sess.update(user="S-0001", role="student", name="Student 0001")
+
+    def check(problems):
+        records = len(db.rows("attendance_records"))
+        started = teacher.get("/export?format=csv.gz")
+        again = teacher.get("/export?format=csv.gz")
+        if started.status_code != 302 or "/exports/" not in started.location:
+            problems.append(f"a large export answered {started.status_code} instead of queueing a job")
+            return
+        if again.location != started.location:
+            problems.append("asking twice queued two export jobs")
+        waiting = teacher.get(started.location)
+        if waiting.status_code != 200 or "Preparing export" not in waiting.get_data(as_text=True):
+            problems.append(f"the export page answered {waiting.status_code} while the job was queued")
+        if student.get(started.location).status_code != 404:
+            problems.append("another user can download the teacher's export")
+
+        db.reset_stats()
+        attendx.job_runner.run_pending()
+        pages = db.snapshot()["by_table"].get("attendance_records", 0)
+        if pages != records // 150 + 1:
+            problems.append(f"the job read the records in {pages} requests, expected {records // 150 + 1}")
+        job = teacher.get("/jobs/" + started.location.rsplit("/", 1)[1]).get_json()
+        if job["status"] != "done" or job["result"]["rows"] != records or not job["download_url"]:
+            problems.append(f"export job finished as {job!r}")
+
+        done = teacher.get(started.location)
+        body = done.get_data()
+        digest = base64.b64encode(hashlib.sha256(body).digest()).decode()
+        if done.status_code != 200 or gzip.decompress(body).decode().count("\n") != records + 1:
+            problems.append(f"the finished export answered {done.status_code} with the wrong rows")
+        if done.headers.get("Repr-Digest") != f"sha-256=:{digest}:" or done.headers.get("Accept-Ranges") != "bytes":
+            problems.append("the export is sent without its content hash or Range support")
+        resumed = teacher.get(started.location, headers={"Range": "bytes=100-", "If-Range": done.headers["ETag"]})
+        if resumed.status_code != 206 or resumed.get_data() != body[100:]:
+            problems.append(f"a resumed download answered {resumed.status_code}")
+
+        # Unchanged data: the file is sent straight away, after the data-version lookups only
+        db.reset_stats()
+        cached = teacher.get("/export?format=csv.gz")
+        if cached.status_code != 200 or cached.get_data() != body or db.snapshot()["calls"] > 2:
+            problems.append(f"an unchanged export was not reused ({cached.status_code}, "
+                            f"{db.snapshot()['calls']} calls)")
+        db.insert("attendance_records", {"session_id": db.rows("attendance_sessions")[0]["session_id"],
+                                         "sid": "S-PENDING-1", "name": "Pending 1", "subject_id": 1,
+                                         "subject": "Algorithms", "date": "01-01-2026", "time": "09:05:00",
+                                         "status": "present"})
+        if teacher.get("/export?format=csv.gz").status_code != 302:
+            problems.append("an export of changed data reused the old file")
+        if teacher.get("/export?format=pdf").status_code != 400:
+            problems.append("an unknown export format was accepted")
+
+    problems = []
+    page, inline = attendx.EXPORT_PAGE, attendx.EXPORT_INLINE_ROWS
+    attendx.EXPORT_PAGE, attendx.EXPORT_INLINE_ROWS = 150, 0      # every export is "large"
+    try:
+        check(problems)
+    finally:
+        attendx.EXPORT_PAGE, attendx.EXPORT_INLINE_ROWS = page, inline
+
+    if problems:
+        print("✗ export jobs: " + "; ".join(problems))
+        return False
+    print("✓ export jobs")
+    return True
+
+
+def verify_degraded_mode(app, db, verbose=False):
+    print("\n=== Verifying the circuit breaker and degraded mode ===")
+    import time
+    import app as attendx
+    import supabase_guard
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    breaker = attendx.supabase.breaker
+    logins = {}
+    for role in ("admin", "teacher", "student"):
+        logins[role] = app.test_client()
+        with logins[role].session_transaction() as sess:
+            sid, r, name = SESSION_USERS.get(role, ("S-0001", "student", "Student 0001"))
+            sess.update(user=sid, role=r, name=name)
+
+    problems = []
+    cooldown, retries = breaker.cooldown, supabase_guard.READ_RETRIES
+    try:
+        good = logins["teacher"].get("/teacher_dashboard").get_data(as_text=True)
+        logins["admin"].get("/admin/reports")
+        # One copy per user and dashboard, whatever the query string; reports keep none
+        logins["teacher"].get("/teacher_dashboard?nocache=1")
+        kept = [k for k in ("last_good:T-1:teacher:/teacher_dashboard?nocache=1",
+                            f"last_good:{SESSION_USERS['admin'][0]}:admin:/admin/reports")
+                if attendx.state.get(k) is not None]
+        kept += [k for k in attendx._last_good_saved if not k.endswith("/teacher_dashboard")]
+        if kept:
+            problems.append(f"page copies kept beyond the dashboards: {kept}")
+
+        # Reads are retried, writes are not
+        db.outage = "down"
+        for query, expected in ((attendx.supabase.table("users").select("sid"), 1 + retries),
+                                (attendx.supabase.table("users").update({"name": "x"}).eq("sid", "S-0001"), 1)):
+            db.reset_stats()
+            try:
+                query.execute()
+                problems.append("a query succeeded during the outage")
+            except Exception:
+                pass
+            if db.snapshot()["calls"] != expected:
+                problems.append(f"a {'read' if expected > 1 else 'write'} was tried {db.snapshot()['calls']} "
+                                f"times, expected {expected}")
+
+        # A few more failures open the breaker; then pages answer without waiting on Supabase
+        logins["teacher"].get("/teacher_dashboard")
+        if breaker.state != "open":
+            problems.append(f"the breaker is {breaker.state} after {breaker.failures} failures")
+        db.reset_stats()
+        started = time.perf_counter()
+        stale = logins["teacher"].get("/teacher_dashboard")
+        elapsed = time.perf_counter() - started
+        body = stale.get_data(as_text=True)
+        if db.snapshot()["calls"] or elapsed > 0.5:
+            problems.append(f"with the breaker open a page made {db.snapshot()['calls']} calls in {elapsed:.2f}s")
+        if "cannot reach the database" not in body or "Algorithms" not in body or \
+                not stale.headers.get("X-AttendX-Stale", "").isdigit():
+            problems.append("the teacher dashboard was not served from its last good copy")
+        report = logins["admin"].get("/admin/reports")
+        if report.headers.get("X-AttendX-Stale") != "no-copy" or "may be missing" not in report.get_data(as_text=True):
+            problems.append("the admin report does not warn that data may be missing")
+        fresh = logins["student"].get("/student_dashboard")
+        if fresh.headers.get("X-AttendX-Stale") != "no-copy" or "may be missing" not in fresh.get_data(as_text=True):
+            problems.append("a page without a copy does not warn that data may be missing")
+
+        # After the cooldown one probe closes the breaker again
+        db.outage = None
+        breaker.cooldown = 0
+        recovered = logins["teacher"].get("/teacher_dashboard")
+        if breaker.state != "closed" or "cannot reach the database" in recovered.get_data(as_text=True):
+            problems.append(f"the breaker stayed {breaker.state} after Supabase came back")
+        if "cannot reach the database" in good:
+            problems.append("the banner shows while Supabase is up")
+
+        # A stalled Supabase costs one read timeout, not the HTTP client's default 120 s
+        supabase_guard.READ_RETRIES = 0
+        db.outage = 2
+        started = time.perf_counter()
+        try:
+            attendx.supabase.table("users").select("sid").limit(1).execute()
+            problems.append("a stalled read did not time out")
+        except Exception:
+            pass
+        if time.perf_counter() - started > 1.9:
+            problems.append(f"a stalled read took {time.perf_counter() - started:.1f}s")
+    finally:
+        db.outage = None
+        breaker.cooldown, supabase_guard.READ_RETRIES = cooldown, retries
+        breaker.record_success()
+
+    if problems:
+        print("✗ degraded mode: " + "; ".join(problems))
+        return False
+    print("✓ degraded mode")
+    return True
+
+
+GUNICORN_PROBE = """
+exec(open({conf!r}).read())
+import json, os, threading
+
+def _threads(role):
+    with open({out!r}, "a") as f:
+        f.write(json.dumps({{"role": role, "threads": [t.name for t in threading.enumerate()]}}) + "\\n")
+
+def when_ready(server):
+    _threads("master")
+
+def post_worker_init(worker):
+    _threads("worker")
+"""
+
+
+def verify_gunicorn_startup(app, db, verbose=False):
+    print("\n=== Verifying gunicorn startup ===")
+    import json, importlib.util, socket, subprocess, time
+    if not importlib.util.find_spec("gunicorn"):
+        print("- gunicorn startup: skipped (gunicorn is not installed)")
+        return True
+    here = os.path.dirname(os.path.abspath(__file__))
+    scratch = tempfile.mkdtemp(prefix="attendx-verify-")
+    out = os.path.join(scratch, "threads.jsonl")
+    probe = os.path.join(scratch, "probe.conf.py")
+    with open(probe, "w") as f:
+        f.write(GUNICORN_PROBE.format(conf=os.path.join(here, "gunicorn.conf.py"), out=out))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    # The master preloads app.py; every background thread belongs in the worker
+    expected = {"attendx-jobs-0", "attendx-report-replica", "attendx-classroom-sync"}
+    env = dict(os.environ, WEB_CONCURRENCY="1", ATTENDX_JOB_WORKERS="1", ATTENDX_WARM_UP="0",
+               ATTENDX_REPORT_REPLICA="1", ATTENDX_REPLICA_DB=os.path.join(scratch, "replica.db"),
+               ATTENDX_CLASSROOM="1", ATTENDX_CLASSROOM_DB=os.path.join(scratch, "classroom.db"))
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", probe, "--bind", f"127.0.0.1:{port}",
+                               "--access-logfile", "/dev/null"],
+                              cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    seen = {}
+    try:
+        deadline = time.monotonic() + 30
+        while "worker" not in seen and time.monotonic() < deadline and server.poll() is None:
+            time.sleep(0.1)
+            if os.path.exists(out):
+                with open(out) as f:
+                    seen = {row["role"]: set(row["threads"]) for row in map(json.loads, f)}
+    finally:
+        server.terminate()
+        server.wait(timeout=20)
+
+    problems = []
+    if "worker" not in seen:
+        problems.append("no worker came up")
+    else:
+        started_in_master = {t for t in seen.get("master", ()) if t.startswith("attendx-")}
+        if started_in_master:
+            problems.append(f"the master runs {sorted(started_in_master)}")
+        if expected - seen["worker"]:
+            problems.append(f"the worker does not run {sorted(expected - seen['worker'])}")
+    if problems:
+        print("✗ gunicorn startup: " + "; ".join(problems))
+        return False
+    print("✓ gunicorn startup")
+    return True
+
+
+def verify_lazy_import(app, db, verbose=False):
+    print("\n=== Verifying import-time work ===")
+    import subprocess
+    # A fresh interpreter, as the preloading gunicorn master imports app.py; with a read endpoint too
+    probe = ("import sys, app; "
+             "built = [name for name in ('supabase', 'supabase_read') if getattr(app, name)._client is not None]; "
+             "print(','.join(built) or 'none', 'supabase' in sys.modules)")
+    env = dict(os.environ, SUPABASE_READ_URL=os.environ["SUPABASE_URL"], ATTENDX_WARM_UP="0")
+    result = subprocess.run([sys.executable, "-c", probe], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, capture_output=True, text=True, timeout=60)
+    problems = []
+    if result.returncode:
+        problems.append(f"importing app.py failed: {result.stderr.strip().splitlines()[-1:]}")
+    else:
+        built, imported = result.stdout.split()[-2:]
+        if built != "none":
+            problems.append(f"importing app.py built the {built} client")
+        if imported == "True":
+            problems.append("importing app.py imported supabase-py")
+    if problems:
+        print("✗ import-time work: " + "; ".join(problems))
+        return False
+    print("✓ import-time work")
+    return True
+
+
+def verify_async_guard(app, db, verbose=False):
+    print("\n=== Verifying the async client's timeouts and breaker ===")
+    import asyncio, time
+    import app as attendx
+    import supabase_guard
+    os.environ["ATTENDX_WARM_UP"] = "0"     # asgi.py calls create_app() on import
+    import asgi
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    breaker = attendx.supabase.breaker
+    problems = []
+
+    async def attempt(query):
+        started = time.perf_counter()
+        try:
+            await asgi.execute(query)
+            problems.append("an async query succeeded during the outage")
+        except Exception as e:
+            return e, time.perf_counter() - started
+        return None, time.perf_counter() - started
+
+    async def probe():
+        client = await asgi.get_db()
+        db.outage = "down"
+        for query, expected in ((client.table("users").select("sid"), 1 + supabase_guard.READ_RETRIES),
+                                (client.table("users").update({"name": "x"}).eq("sid", "S-0001"), 1)):
+            db.reset_stats()
+            await attempt(query)
+            if db.snapshot()["calls"] != expected:
+                problems.append(f"an async {'read' if expected > 1 else 'write'} was tried "
+                                f"{db.snapshot()['calls']} times, expected {expected}")
+        await attempt(client.table("users").select("sid"))
+        if breaker.state != "open":
+            problems.append(f"async failures left the shared breaker {breaker.state}")
+        db.reset_stats()
+        error, elapsed = await attempt(client.table("valid_tokens").select("token").limit(1))
+        if not isinstance(error, supabase_guard.UpstreamUnavailable) or db.snapshot()["calls"] or elapsed > 0.5:
+            problems.append(f"with the breaker open an async query made {db.snapshot()['calls']} calls "
+                            f"in {elapsed:.2f}s ({error!r})")
+
+        # A stalled Supabase costs one read timeout, not the HTTP client's default
+        breaker.record_success()
+        supabase_guard.READ_RETRIES = 0
+        db.outage = 2
+        _, elapsed = await attempt(client.table("users").select("sid").limit(1))
+        if elapsed > 1.9:
+            problems.append(f"a stalled async read took {elapsed:.1f}s")
+
+    retries = supabase_guard.READ_RETRIES
+    try:
+        asyncio.run(probe())
+    finally:
+        db.outage = None
+        supabase_guard.READ_RETRIES = retries
+        breaker.record_success()
+
+    if problems:
+        print("✗ async guard: " + "; ".join(problems))
+        return False
+    print("✓ async guard")
+    return True
+
+
+def verify_rate_limits(app, db, verbose=False):
+    print("\n=== Verifying rate limits and admission control ===")
+    import app as attendx
+    _, _, login_budget = attendx.RATE_LIMITS["login"][1][0]
+    _, _, scan_budget = attendx.RATE_LIMITS["api_scan"][1][0]
+    seed(db, DATA_SIZES[0])
+    reset_state()
+    problems = []
+
+    def attempts(client, n, path, data=None, json=None, headers=None):
+        db.reset_stats()
+        codes = [client.post(path, data=data, json=json, headers=headers).status_code for _ in range(n)]
+        return codes, db.snapshot()["calls"]
+
+    # Password guessing: the account's budget runs out, then the address's
+    guesser = app.test_client()
+    codes, calls = attempts(guesser, login_budget + 3, "/login",
+                            {"username": "S-0001", "password": "guess", "role": "student"})
+    refused = guesser.post("/login", data={"username": "S-0001", "password": "guess", "role": "student"})
+    if codes.count(429) != 3 or calls != login_budget:
+        problems.append(f"login guesses: {codes.count(429)} refused, {calls} reached the database")
+    if not refused.headers.get("Retry-After", "").isdigit():
+        problems.append("a refused login has no Retry-After")
+    if app.test_client().post("/login", data={"username": "S-0002", "password": "pw", "role": "student"},
+                              environ_base={"REMOTE_ADDR": "10.0.0.9"}).status_code != 302:
+        problems.append("a different account from another address was refused")
+
+    # Behind a proxy the address it appended is the identity, whatever the client put before it
+    _, _, ip_budget = attendx.RATE_LIMITS["login"][1][1]
+    attendx.PROXY_HOPS = 1
+
+    def forwarded_login(i, address):
+        return app.test_client().post("/login", data={"username": f"guess-{i}", "password": "pw",
+                                                      "role": "student"},
+                                      headers={"X-Forwarded-For": f"198.51.100.{i}, {address}"}).status_code
+    try:
+        flood = [forwarded_login(i, "203.0.113.7") for i in range(ip_budget + 1)]
+        if flood.count(429) != 1 or flood[-1] != 429:
+            problems.append(f"{flood.count(429)} of {ip_budget + 1} logins from one forwarded address "
+                            f"were refused, expected the last")
+        if forwarded_login(ip_budget + 1, "203.0.113.8") == 429:
+            problems.append("clients behind the proxy share one address budget")
+    finally:
+        attendx.PROXY_HOPS = 0
+
+    # A student hammering the scan API is refused with JSON; a classmate is not
+    scanners = []
+    for sid in ("S-0003", "S-0004"):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess.update(user=sid, role="student", name=sid)
+        scanners.append(client)
+    codes, _ = attempts(scanners[0], scan_budget + 2, "/api/scan", json={"token": "nope"})
+    busy = scanners[0].post("/api/scan", json={"token": "nope"})
+    if codes.count(429) != 2 or busy.get_json().get("status") != "rate_limited":
+        problems.append(f"scan retries: {codes.count(429)} of {scan_budget + 2} refused")
+    if scanners[1].post("/api/scan", json={"token": "nope"}).status_code == 429:
+        problems.append("a classmate's scan was refused")
+
+    # A full admission gate turns database-bound requests away without a query
+    held = 0
+    while attendx.admission.try_enter():
+        held += 1
+    try:
+        db.reset_stats()
+        full = scanners[1].get("/student_dashboard")
+        if full.status_code != 429 or db.snapshot()["calls"] or "Retry-After" not in full.headers:
+            problems.append(f"with the gate full a page answered {full.status_code} "
+                            f"after {db.snapshot()['calls']} calls")
+    finally:
+        for _ in range(held):
+            attendx.admission.leave()
+    if attendx.admission.inside:
+        problems.append(f"{attendx.admission.inside} requests never left the admission gate")
+
+    if problems:
+        print("✗ rate limits: " + "; ".join(problems))
+        return False
+    print("✓ rate limits")
+    return True
+
+
+def main():
+    verbose = "--verbose" in sys.argv
+    print("=" * 60)
+    print("AttendX Query-Count Verification")
+    print(f"Data sizes: {', '.join(str(s) for s in DATA_SIZES)} students per class")
+    print("=" * 60)
+
+    app, db = load_app()
+    results = [
+        ("Route round trips and row volume", verify_route_bounds(app, db, verbose)),
+        ("Conditional GET on report pages", verify_conditional_get(app, db, verbose)),
+        ("Subject catalog invalidation", verify_subject_catalog(app, db, verbose)),
+        ("User directory invalidation", verify_user_directory(app, db, verbose)),
+        ("Attendance view search", verify_student_search(app, db, verbose)),
+        ("Term archive routing", verify_term_archive(app, db, verbose)),
+        ("Session bitmap fallback", verify_session_bitmaps(app, db, verbose)),
+        ("Report replica", verify_report_replica(app, db, verbose)),
+        ("Read endpoint routing", verify_read_routing(app, db, verbose)),
+        ("QR images", verify_qr_images(app, db, verbose)),
+        ("Background jobs", verify_background_jobs(app, db, verbose)),
+        ("Export jobs", verify_export_jobs(app, db, verbose)),
+        ("Circuit breaker and degraded mode", verify_degraded_mode(app, db, verbose)),
+        ("Async client timeouts and breaker", verify_async_guard(app, db, verbose)),
+        ("Rate limits and admission", verify_rate_limits(app, db, verbose)),
+        ("Import-time work", verify_lazy_import(app, db, verbose)),
+        ("gunicorn startup", verify_gunicorn_startup(app, db, verbose)),
+    ]
+
+    print("\n" + "=" * 60)
+    print("SUMMARY")
+    print("=" * 60)
+    all_passed = True
+    for name, result in results:
+        print(f"{name}: {'✓ PASS' if result else '✗ FAIL'}")
+        all_passed = all_passed and result
+
+    if all_passed:
+        print("\n✅ All verifications PASSED!")
+        return 0
+    print("\n❌ Some verifications FAILED")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())